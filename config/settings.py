@@ -231,6 +231,57 @@ Q_CLUSTER = {
     'sync': DEBUG,  # Run synchronously in development
 }
 
+# Transfer reference IDs (keyed permutation of a database sequence, see transfers/reference_ids.py)
+# Changing the key after go-live is safe but may cause (retried) collisions with existing IDs
+TRANSFER_REFERENCE_KEY = os.getenv('TRANSFER_REFERENCE_KEY', default=secret_key_value or '')
+TRANSFER_REFERENCE_BLOCK_SIZE = int(os.getenv('TRANSFER_REFERENCE_BLOCK_SIZE', '20'))
+
+# Drafts promoted per transaction by the background auto-promotion task
+AUTO_PROMOTION_CHUNK_SIZE = int(os.getenv('AUTO_PROMOTION_CHUNK_SIZE', '500'))
+
+# Transfer lists use keyset pagination (see transfers/pagination.py); ?page_size= is capped at the max
+TRANSFERS_PAGE_SIZE = int(os.getenv('TRANSFERS_PAGE_SIZE', '50'))
+TRANSFERS_MAX_PAGE_SIZE = int(os.getenv('TRANSFERS_MAX_PAGE_SIZE', '200'))
+
+# Rows fetched per database round trip by the streaming exports
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# Maximum transfers per batch validate / reject / execute request
+TRANSFER_BATCH_MAX_SIZE = int(os.getenv('TRANSFER_BATCH_MAX_SIZE', '500'))
+
+# CSV transfer import: rows validated and inserted together, and the limit per uploaded file
+TRANSFER_IMPORT_BATCH_SIZE = int(os.getenv('TRANSFER_IMPORT_BATCH_SIZE', '1000'))
+TRANSFER_IMPORT_MAX_ROWS = int(os.getenv('TRANSFER_IMPORT_MAX_ROWS', '10000'))
+
+# create_transfer asks for confirmation when the same agent declared the same phone, amount,
+# currency and method within this many seconds (0 disables the check, see transfers/duplicates.py)
+TRANSFER_DUPLICATE_WINDOW_SECONDS = int(os.getenv('TRANSFER_DUPLICATE_WINDOW_SECONDS', '600'))
+
+# Maximum amount/currency pairs per batch commission preview request
+COMMISSION_PREVIEW_MAX_ITEMS = int(os.getenv('COMMISSION_PREVIEW_MAX_ITEMS', '100'))
+
+# Audit trail writer (see users/audit.py): records are written in bulk at the end of each request
+# or task; elsewhere a background thread writes them every AUDIT_FLUSH_INTERVAL seconds
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0'))
+AUDIT_BACKGROUND_WRITES = os.getenv('AUDIT_BACKGROUND_WRITES', 'True').lower() in ('true', '1', 'yes')
+# Records that fail to write (e.g. "database is locked") are retried this many times, waiting
+# AUDIT_RETRY_DELAY seconds before the first retry and twice as long before each next one
+AUDIT_WRITE_RETRIES = int(os.getenv('AUDIT_WRITE_RETRIES', '5'))
+AUDIT_RETRY_DELAY = float(os.getenv('AUDIT_RETRY_DELAY', '0.5'))
+# Model labels (e.g. 'stock.Stock') never written to the audit trail, on top of the defaults in users/audit_details.py
+AUDIT_EXCLUDED_MODELS = []
+
+# Audit retention (see users/retention.py): activities older than AUDIT_RETENTION_DAYS are archived
+# to gzip JSONL files under AUDIT_ARCHIVE_DIR then deleted, nightly, in chunks of primary keys
+# The archives hold usernames, IP addresses and beneficiary details: in production point
+# AUDIT_ARCHIVE_DIR outside the project (the default /archives/ is git-ignored)
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '60'))
+AUDIT_RETENTION_CHUNK_SIZE = int(os.getenv('AUDIT_RETENTION_CHUNK_SIZE', '1000'))
+AUDIT_RETENTION_MAX_SECONDS = int(os.getenv('AUDIT_RETENTION_MAX_SECONDS', '60'))  # Below Q_CLUSTER timeout
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', str(BASE_DIR / 'archives' / 'audit'))
+
 # Logging configuration
 LOGGING = {
     'version': 1,
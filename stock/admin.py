@@ -1,13 +1,13 @@
 from django.contrib import admin
-from .models import Stock, StockMovement, ExchangeRate
+from .models import Stock, StockBalanceCheckpoint, StockMovement, ExchangeRate
 
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
-    list_display = ('currency', 'location', 'amount', 'name', 'updated_at')
+    list_display = ('currency', 'location', 'amount', 'name', 'movement_count', 'updated_at')
     list_filter = ('location', 'currency')
     search_fields = ('currency', 'name')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'total_in', 'total_out', 'movement_count')
 
 
 @admin.register(StockMovement)
@@ -44,3 +44,10 @@ class ExchangeRateAdmin(admin.ModelAdmin):
         if not obj.defined_by:
             obj.defined_by = request.user
         super().save_model(request, obj, form, change)
+
+
+@admin.register(StockBalanceCheckpoint)
+class StockBalanceCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('day', 'stock', 'balance', 'movement_count', 'updated_at')
+    list_filter = ('stock', 'day')
+    readonly_fields = ('stock', 'day', 'balance', 'movement_count', 'updated_at')
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class StockConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stock'
+
+    def ready(self):
+        try:
+            import stock.signals
+        except ImportError:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.error("Failed to import stock.signals.")
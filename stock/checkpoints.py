@@ -0,0 +1,329 @@
+"""
+Daily stock balance checkpoints.
+
+StockBalanceCheckpoint keeps, for every day a stock moved, its closing balance and
+the number of movements of that day. StockMovement.save() refreshes the row of the
+day in the same transaction as the balance update, so checkpoints always match
+Stock.amount. A balance changed another way (admin edit, queryset update) is not
+seen: find_checkpoint_drift() reports it and backfill_checkpoints() rebuilds the
+checkpoints from the current Stock.amount (backfill_stock_checkpoints command).
+
+The balance at a time T is then the closing balance of the last checkpoint before
+T's day plus the movements of T's own day up to T: days in between have no
+movements, or they would have a checkpoint.
+
+Days are local dates (settings.TIME_ZONE), like the commission rollup.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0')
+
+
+def _end_of_day(day):
+    """Last instant of a local day, movements after it belong to the next day"""
+    return timezone.make_aware(datetime.combine(day, time.max))
+
+
+def _record(stock_id, day):
+    """Upsert the checkpoint of a stock for a day with its current balance"""
+    from .models import Stock, StockBalanceCheckpoint
+
+    balance = Stock.objects.filter(pk=stock_id).values_list('amount', flat=True).get()
+    rows = StockBalanceCheckpoint.objects.filter(stock_id=stock_id, day=day)
+    values = {'balance': balance, 'movement_count': F('movement_count') + 1, 'updated_at': timezone.now()}
+
+    if rows.update(**values):
+        return
+
+    try:
+        with transaction.atomic():
+            StockBalanceCheckpoint.objects.create(stock_id=stock_id, day=day, balance=balance, movement_count=1)
+    except IntegrityError:
+        # Created concurrently: fall back to the update
+        rows.update(**values)
+
+
+def record_movement(movement):
+    """
+    Refresh the checkpoints of the stocks a new movement changed.
+    Called by StockMovement.save() inside its transaction, after the balance updates.
+    """
+    day = timezone.localdate(movement.created_at)
+    _record(movement.stock_id, day)
+    if movement.destination_stock_id:
+        _record(movement.destination_stock_id, day)
+
+
+def net_change(stock_id, after=None, until=None):
+    """
+    Sum of the changes movements made to a stock, created after `after` and up to `until`.
+
+    Args:
+        stock_id (int): Stock
+        after (datetime, optional): Exclusive lower bound
+        until (datetime, optional): Inclusive upper bound
+
+    Returns:
+        Decimal
+    """
+    from .models import StockMovement
+
+    period = Q()
+    if after is not None:
+        period &= Q(created_at__gt=after)
+    if until is not None:
+        period &= Q(created_at__lte=until)
+
+    own = StockMovement.objects.filter(period, stock_id=stock_id).aggregate(
+            total_in=Sum('amount', filter=Q(type='IN')),
+            total_out=Sum('amount', filter=Q(type='OUT')),
+    )
+    incoming = StockMovement.objects.filter(period, destination_stock_id=stock_id).aggregate(
+            total=Sum('destination_amount')
+    )
+    return (own['total_in'] or ZERO) - (own['total_out'] or ZERO) + (incoming['total'] or ZERO)
+
+
+def get_balance_at(stock, when):
+    """
+    Balance of a stock at a given time.
+
+    Reads the last checkpoint before that day and adds the movements of the day up
+    to `when`. Without an earlier checkpoint (the stock had no movement before), goes
+    back from the first checkpoint from that day on, undoing the movements between
+    `when` and its end of day. The current balance is only used when the stock has no
+    checkpoint at all.
+
+    Args:
+        stock (Stock): Stock
+        when (datetime): Moment (aware)
+
+    Returns:
+        Decimal
+    """
+    from .models import StockBalanceCheckpoint
+
+    day = timezone.localdate(when)
+    checkpoint = (StockBalanceCheckpoint.objects
+                  .filter(stock=stock, day__lt=day)
+                  .order_by('-day')
+                  .values('day', 'balance')
+                  .first())
+
+    if checkpoint:
+        return checkpoint['balance'] + net_change(stock.pk, after=_end_of_day(checkpoint['day']), until=when)
+
+    checkpoint = (StockBalanceCheckpoint.objects
+                  .filter(stock=stock, day__gte=day)
+                  .order_by('day')
+                  .values('day', 'balance')
+                  .first())
+    if checkpoint:
+        return checkpoint['balance'] - net_change(stock.pk, after=when, until=_end_of_day(checkpoint['day']))
+
+    return stock.amount - net_change(stock.pk, after=when)
+
+
+def get_balance_history(stock, days=90):
+    """
+    Daily closing balances of a stock over the last `days` days, for charts.
+
+    Days without movement carry the previous balance forward.
+
+    Returns:
+        list: [(date, Decimal balance)] oldest first
+    """
+    from .models import StockBalanceCheckpoint
+
+    today = timezone.localdate()
+    first_day = today - timedelta(days=days - 1)
+
+    checkpoints = dict(StockBalanceCheckpoint.objects
+                       .filter(stock=stock, day__gte=first_day, day__lte=today)
+                       .values_list('day', 'balance'))
+    opening = (StockBalanceCheckpoint.objects
+               .filter(stock=stock, day__lt=first_day)
+               .order_by('-day')
+               .values_list('balance', flat=True)
+               .first())
+
+    if opening is None:
+        if not checkpoints:
+            return [(first_day + timedelta(days=offset), stock.amount) for offset in range(days)]
+        # No movement before the window: go back from the first checkpoint of the window
+        first_checkpoint_day = min(checkpoints)
+        opening = checkpoints[first_checkpoint_day] - net_change(
+                stock.pk,
+                after=_end_of_day(first_checkpoint_day - timedelta(days=1)),
+                until=_end_of_day(first_checkpoint_day),
+        )
+
+    history = []
+    balance = opening
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        balance = checkpoints.get(day, balance)
+        history.append((day, balance))
+    return history
+
+
+def _fill_destination_amounts():
+    """Compute destination_amount for transfers saved before it was stored, at the rate of their time"""
+    from .models import CENT, StockMovement
+    from .rate_history import get_rates_as_of
+
+    movements = list(StockMovement.objects
+                     .filter(destination_stock__isnull=False, destination_amount__isnull=True)
+                     .select_related('stock', 'destination_stock'))
+    if not movements:
+        return 0
+
+    rates = get_rates_as_of(
+            (movement.stock.currency, movement.destination_stock.currency, movement.created_at)
+            for movement in movements
+    )
+    filled = []
+    for movement, rate in zip(movements, rates):
+        rate = movement.custom_exchange_rate or rate
+        if rate is None:
+            logger.warning(f"No rate for stock movement {movement.pk}, its destination amount stays unknown")
+            continue
+        movement.destination_amount = (movement.amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+        filled.append(movement)
+
+    StockMovement.objects.bulk_update(filled, ['destination_amount'], batch_size=1000)
+    return len(filled)
+
+
+def _daily_changes(stock_id):
+    """Net change and movement count of a stock per local day, from its movements"""
+    from .models import StockMovement
+
+    changes = defaultdict(lambda: ZERO)
+    counts = defaultdict(int)
+    own = (StockMovement.objects.filter(stock_id=stock_id).order_by()
+           .annotate(checkpoint_day=TruncDate('created_at'))
+           .values('checkpoint_day', 'type')
+           .annotate(total=Sum('amount'), count=Count('id')))
+    for row in own:
+        sign = 1 if row['type'] == 'IN' else -1
+        changes[row['checkpoint_day']] += sign * row['total']
+        counts[row['checkpoint_day']] += row['count']
+
+    incoming = (StockMovement.objects.filter(destination_stock_id=stock_id).order_by()
+                .annotate(checkpoint_day=TruncDate('created_at'))
+                .values('checkpoint_day')
+                .annotate(total=Sum('destination_amount'), count=Count('id')))
+    for row in incoming:
+        changes[row['checkpoint_day']] += row['total'] or ZERO
+        counts[row['checkpoint_day']] += row['count']
+
+    return changes, counts
+
+
+def find_checkpoint_drift(stocks=None):
+    """
+    Find where checkpoints stopped matching the movements and Stock.amount.
+
+    Checkpoints only follow StockMovement.save(): a balance changed another way (admin
+    edit, queryset update, SQL fix) shows up as a checkpoint that is not the previous
+    one plus the movements in between, or as a current balance that is not the last
+    checkpoint plus the movements since. The opening balance of a stock (its amount
+    before the first movement) is not checked.
+
+    Args:
+        stocks (iterable, optional): Stocks to check, all by default
+
+    Returns:
+        list: [{'stock', 'day' (first checkpoint off, None for the current balance),
+        'expected', 'stored'}], at most one entry per stock
+    """
+    from .models import Stock, StockBalanceCheckpoint
+
+    if stocks is None:
+        stocks = Stock.objects.all()
+
+    drifts = []
+    for stock in stocks:
+        stock.refresh_from_db(fields=['amount'])
+        changes, _counts = _daily_changes(stock.pk)
+        checkpoints = list(StockBalanceCheckpoint.objects.filter(stock=stock).order_by('day')
+                           .values_list('day', 'balance'))
+        if not checkpoints:
+            continue
+
+        drift = None
+        previous_day, balance = checkpoints[0]
+        for day, stored in checkpoints[1:]:
+            expected = balance + sum((change for change_day, change in changes.items()
+                                      if previous_day < change_day <= day), ZERO)
+            if stored != expected:
+                drift = {'stock': stock, 'day': day, 'expected': expected, 'stored': stored}
+                break
+            previous_day, balance = day, stored
+
+        if drift is None:
+            expected = balance + net_change(stock.pk, after=_end_of_day(previous_day))
+            if stock.amount != expected:
+                drift = {'stock': stock, 'day': None, 'expected': expected, 'stored': stock.amount}
+
+        if drift:
+            logger.warning(f"Stock {stock.pk} checkpoints drift from its movements "
+                           f"({drift['day'] or 'current balance'}): {drift['stored']} stored, "
+                           f"{drift['expected']} expected")
+            drifts.append(drift)
+
+    return drifts
+
+
+def backfill_checkpoints(stocks=None):
+    """
+    Rebuild the checkpoints of stocks from their movements.
+
+    Closing balances are replayed backwards from the current balance, so stocks
+    created with an initial amount come out right. Transfers saved before
+    destination_amount existed get it first, from the rate in force at their time.
+
+    Args:
+        stocks (iterable, optional): Stocks to rebuild, all by default
+
+    Returns:
+        tuple: (stocks rebuilt, checkpoint rows written)
+    """
+    from .models import Stock, StockBalanceCheckpoint
+
+    _fill_destination_amounts()
+
+    stock_ids = [stock.pk for stock in stocks] if stocks is not None else list(Stock.objects.values_list('pk', flat=True))
+    row_count = 0
+
+    for stock_id in stock_ids:
+        with transaction.atomic():
+            # Hold the stock row so no movement lands between the replay and the write
+            balance = Stock.objects.select_for_update().filter(pk=stock_id).values_list('amount', flat=True).get()
+
+            changes, counts = _daily_changes(stock_id)
+
+            checkpoints = []
+            for day in sorted(counts, reverse=True):
+                checkpoints.append(StockBalanceCheckpoint(
+                        stock_id=stock_id, day=day, balance=balance, movement_count=counts[day]
+                ))
+                balance -= changes[day]
+
+            StockBalanceCheckpoint.objects.filter(stock_id=stock_id).delete()
+            StockBalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+            row_count += len(checkpoints)
+
+    logger.info(f"Stock checkpoints rebuilt: {len(stock_ids)} stocks, {row_count} days")
+    return len(stock_ids), row_count
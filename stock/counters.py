@@ -0,0 +1,71 @@
+"""
+Movement counters of Stock.
+
+Stock.total_in, total_out and movement_count sum the stock's own movements (the
+figures stock_detail shows). StockMovement.save() increments them with F() in the
+same UPDATE as the balance, so reading them costs nothing as the ledger grows.
+verify_counters() recomputes them from StockMovement to catch drift from changes
+made outside save() (deletions, SQL fixes) and can repair it.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('total_in', 'total_out', 'movement_count')
+
+
+def compute_counters(stock_id):
+    """Counters of a stock recomputed from its movements"""
+    from .models import StockMovement
+
+    totals = StockMovement.objects.filter(stock_id=stock_id).aggregate(
+            total_in=Sum('amount', filter=Q(type='IN')),
+            total_out=Sum('amount', filter=Q(type='OUT')),
+            movement_count=Count('id'),
+    )
+    return {
+        'total_in': totals['total_in'] or Decimal('0'),
+        'total_out': totals['total_out'] or Decimal('0'),
+        'movement_count': totals['movement_count'],
+    }
+
+
+def verify_counters(stocks=None, repair=False):
+    """
+    Compare the stored counters of stocks with their movements.
+
+    Each stock is checked with its row locked, so a movement saved meanwhile cannot
+    be counted twice or missed by a repair.
+
+    Args:
+        stocks (iterable, optional): Stocks to check, all by default
+        repair (bool): Write the recomputed values when they differ
+
+    Returns:
+        list: One dict per wrong counter: {'stock', 'field', 'stored', 'expected'}
+    """
+    from .models import Stock
+
+    stock_ids = [stock.pk for stock in stocks] if stocks is not None else list(Stock.objects.values_list('pk', flat=True))
+    mismatches = []
+
+    for stock_id in stock_ids:
+        with transaction.atomic():
+            stock = Stock.objects.select_for_update().get(pk=stock_id)
+            expected = compute_counters(stock_id)
+            wrong = {field: value for field, value in expected.items() if getattr(stock, field) != value}
+            if not wrong:
+                continue
+
+            for field, value in wrong.items():
+                mismatches.append({'stock': stock, 'field': field, 'stored': getattr(stock, field), 'expected': value})
+
+            if repair:
+                Stock.objects.filter(pk=stock_id).update(**wrong)
+                logger.warning(f"Stock {stock_id} counters repaired: {', '.join(wrong)}")
+
+    return mismatches
@@ -101,11 +101,8 @@ class StockMovementForm(forms.ModelForm):
                 not cleaned_data.get('custom_exchange_rate')):
 
             # Check if there's an available exchange rate
-            from .models import ExchangeRate
-            rate_exists = ExchangeRate.objects.filter(
-                    from_currency=self.stock.currency,
-                    to_currency=destination_stock.currency
-            ).exists()
+            from .rates import get_current_rate
+            rate_exists = get_current_rate(self.stock.currency, destination_stock.currency) is not None
 
             if not rate_exists:
                 raise forms.ValidationError(
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.checkpoints import backfill_checkpoints, find_checkpoint_drift
+from stock.models import Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily balance checkpoints of the stocks from their movements. "
+        "Run it once after deploying the checkpoints, and after data fixes done outside the ORM. "
+        "Stocks whose balance changed outside StockMovement are reported first; "
+        "--check only reports them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, action='append', help="Stock id (repeatable), all stocks by default")
+        parser.add_argument('--check', action='store_true',
+                            help="Report the drift between checkpoints and balances without rebuilding")
+
+    def handle(self, *args, **options):
+        stocks = None
+        if options['stock']:
+            stocks = list(Stock.objects.filter(pk__in=options['stock']))
+            if len(stocks) != len(set(options['stock'])):
+                raise CommandError("Stock introuvable.")
+
+        drifts = find_checkpoint_drift(stocks)
+        for drift in drifts:
+            where = drift['day'] or "current balance"
+            self.stdout.write(self.style.WARNING(
+                f"Stock {drift['stock'].pk} ({drift['stock']}): {where} is {drift['stored']}, "
+                f"movements give {drift['expected']} (drift {drift['stored'] - drift['expected']})."
+            ))
+
+        if options['check']:
+            if drifts:
+                raise CommandError(f"{len(drifts)} stocks drift from their checkpoints, run without --check to rebuild.")
+            self.stdout.write(self.style.SUCCESS("Checkpoints match the stock balances."))
+            return
+
+        stock_count, rows = backfill_checkpoints(stocks)
+        self.stdout.write(self.style.SUCCESS(f"Checkpoints rebuilt: {stock_count} stocks, {rows} days."))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.counters import verify_counters
+from stock.models import Stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute total_in, total_out and movement_count of the stocks from their movements "
+        "and report the differences. With --repair, write the recomputed values."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, action='append', help="Stock id (repeatable), all stocks by default")
+        parser.add_argument('--repair', action='store_true', help="Fix the counters that differ")
+
+    def handle(self, *args, **options):
+        stocks = None
+        if options['stock']:
+            stocks = list(Stock.objects.filter(pk__in=options['stock']))
+            if len(stocks) != len(set(options['stock'])):
+                raise CommandError("Stock introuvable.")
+
+        mismatches = verify_counters(stocks, repair=options['repair'])
+
+        for mismatch in mismatches:
+            self.stdout.write(
+                    f"{mismatch['stock']} (#{mismatch['stock'].pk}) {mismatch['field']}: "
+                    f"stored {mismatch['stored']}, movements give {mismatch['expected']}"
+            )
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("All stock counters match their movements."))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f"{len(mismatches)} counters repaired."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(mismatches)} counters differ, run with --repair to fix them."))
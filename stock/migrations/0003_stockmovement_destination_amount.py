@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangerate',
+            name='active',
+            field=models.BooleanField(default=True, verbose_name='Actif'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['active', '-created_at'], name='stock_excha_active_7ac3ac_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='destination_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+    ]
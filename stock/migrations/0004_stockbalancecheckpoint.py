@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0003_stockmovement_destination_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Jour')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Solde de clôture')),
+                ('movement_count', models.IntegerField(default=0, verbose_name='Nombre de mouvements')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Mis à jour le')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='stock.stock', verbose_name='Stock')),
+            ],
+            options={
+                'verbose_name': 'Point de solde journalier',
+                'verbose_name_plural': 'Points de solde journaliers',
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('stock', 'day'), name='unique_stock_checkpoint_day')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['destination_stock', '-created_at'], name='stock_stock_destina_f1674b_idx'),
+        ),
+    ]
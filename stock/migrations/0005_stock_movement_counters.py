@@ -0,0 +1,47 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:20
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_counters(apps, schema_editor):
+    Stock = apps.get_model('stock', 'Stock')
+    StockMovement = apps.get_model('stock', 'StockMovement')
+
+    totals = (StockMovement.objects.order_by()
+              .values('stock_id')
+              .annotate(total_in=Sum('amount', filter=Q(type='IN')),
+                        total_out=Sum('amount', filter=Q(type='OUT')),
+                        movement_count=Count('id')))
+    for row in totals:
+        Stock.objects.filter(pk=row['stock_id']).update(
+                total_in=row['total_in'] or 0,
+                total_out=row['total_out'] or 0,
+                movement_count=row['movement_count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0004_stockbalancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='total_in',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='Total entrant'),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='total_out',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='Total sortant'),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='movement_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Nombre de mouvements'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import models, transaction
+from django.db.models import F
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -20,6 +24,8 @@ MOVEMENT_TYPES = [
     ('OUT', 'Sortie'),
 ]
 
+CENT = Decimal('0.01')
+
 
 class Stock(models.Model):
     """
@@ -32,6 +38,14 @@ class Stock(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Running totals of the stock's own movements, kept by StockMovement.save()
+    # (verify_stock_counters recomputes them)
+    total_in = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False,
+                                   verbose_name="Total entrant")
+    total_out = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False,
+                                    verbose_name="Total sortant")
+    movement_count = models.IntegerField(default=0, editable=False, verbose_name="Nombre de mouvements")
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -77,6 +91,10 @@ class StockMovement(models.Model):
     custom_exchange_rate = models.DecimalField(
             max_digits=10, decimal_places=4, null=True, blank=True
     )
+    # Amount credited to destination_stock, at the rate used when the movement was saved
+    destination_amount = models.DecimalField(
+            max_digits=12, decimal_places=2, null=True, blank=True, editable=False
+    )
 
     class Meta:
         ordering = ['-created_at']
@@ -84,6 +102,7 @@ class StockMovement(models.Model):
             models.Index(fields=['stock', '-created_at']),
             models.Index(fields=['type', '-created_at']),
             models.Index(fields=['created_by', '-created_at']),
+            models.Index(fields=['destination_stock', '-created_at']),
         ]
         verbose_name = "Stock Movement"
         verbose_name_plural = "Stock Movements"
@@ -100,16 +119,14 @@ class StockMovement(models.Model):
         if self.custom_exchange_rate:
             return self.custom_exchange_rate
 
-        # Otherwise, get latest known rate
-        rate = ExchangeRate.objects.filter(
-                from_currency=self.stock.currency,
-                to_currency=self.destination_stock.currency
-        ).order_by('-created_at').first()
+        # Otherwise, the current rate from the snapshot (see rates.py)
+        from .rates import get_current_rate
+        rate = get_current_rate(self.stock.currency, self.destination_stock.currency)
 
-        if not rate:
+        if rate is None:
             raise ValidationError("Aucun taux de change défini pour cette conversion.")
 
-        return rate.rate
+        return rate
 
     def clean(self):
         """Validation rules for stock movements"""
@@ -141,32 +158,54 @@ class StockMovement(models.Model):
                         raise ValidationError("Un taux de change est requis si les devises diffèrent.")
 
     def save(self, *args, **kwargs):
-        """Override save to update stock balances"""
+        """
+        Save the movement and apply it to the stock balances, in one transaction.
+
+        Balances are changed with F() updates (UPDATE ... SET amount = amount + x), never
+        from the in-memory Stock, so concurrent movements cannot overwrite each other.
+        An OUT debit is conditional on the balance still covering it; if another movement
+        got there first, ValidationError is raised and nothing is saved. Balances are only
+        changed when the movement is created, re-saving it does not apply it again.
+        """
         self.full_clean()  # Run validation
 
-        # Calculate the changes before saving
-        if self.type == 'IN':
-            stock_change = self.amount
-        elif self.type == 'OUT':
-            stock_change = -self.amount
-        else:
-            stock_change = 0
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
 
-        # Handle destination stock for transfers
-        destination_change = 0
         if self.destination_stock:
             rate_value = self.get_stock_transfer_rate()
-            destination_change = self.amount * rate_value
-
-        # Update stock balances
-        self.stock.amount += stock_change
-        self.stock.save()
-
+            self.destination_amount = (self.amount * rate_value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+        now = timezone.now()
+        with transaction.atomic():
+            if self.type == 'OUT':
+                debited = (Stock.objects
+                           .filter(pk=self.stock_id, amount__gte=self.amount)
+                           .update(amount=F('amount') - self.amount, total_out=F('total_out') + self.amount,
+                                   movement_count=F('movement_count') + 1, updated_at=now))
+                if not debited:
+                    raise ValidationError("Solde insuffisant pour cette transaction")
+            elif self.type == 'IN':
+                (Stock.objects
+                 .filter(pk=self.stock_id)
+                 .update(amount=F('amount') + self.amount, total_in=F('total_in') + self.amount,
+                         movement_count=F('movement_count') + 1, updated_at=now))
+
+            if self.destination_stock:
+                (Stock.objects
+                 .filter(pk=self.destination_stock_id)
+                 .update(amount=F('amount') + self.destination_amount, updated_at=now))
+
+            super().save(*args, **kwargs)
+
+            from .checkpoints import record_movement
+            record_movement(self)
+
+        # Callers show the new balances
+        self.stock.refresh_from_db(fields=['amount', 'total_in', 'total_out', 'movement_count', 'updated_at'])
         if self.destination_stock:
-            self.destination_stock.amount += destination_change
-            self.destination_stock.save()
-
-        super().save(*args, **kwargs)
+            self.destination_stock.refresh_from_db(fields=['amount', 'updated_at'])
 
     def __str__(self):
         base = f"{self.get_type_display()} de {self.amount} {self.stock.currency}"
@@ -175,6 +214,30 @@ class StockMovement(models.Model):
         return base
 
 
+class StockBalanceCheckpoint(models.Model):
+    """
+    Closing balance of a stock for each day it moved, written by StockMovement.save()
+    (see stock/checkpoints.py). Makes balances at a past date cheap to compute.
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='checkpoints', verbose_name="Stock")
+    day = models.DateField(verbose_name="Jour")
+    balance = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="Solde de clôture")
+    movement_count = models.IntegerField(default=0, verbose_name="Nombre de mouvements")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Mis à jour le")
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            # Also the (stock, day) index of the balance lookups
+            models.UniqueConstraint(fields=['stock', 'day'], name='unique_stock_checkpoint_day'),
+        ]
+        verbose_name = "Point de solde journalier"
+        verbose_name_plural = "Points de solde journaliers"
+
+    def __str__(self):
+        return f"{self.stock} au {self.day.strftime('%d/%m/%Y')}: {self.balance}"
+
+
 class ExchangeRate(models.Model):
     """
     Historical exchange rates between currencies
@@ -206,29 +269,23 @@ class ExchangeRate(models.Model):
     @classmethod
     def get_latest_rate(cls, from_currency, to_currency):
         """Get the latest active exchange rate for a currency pair"""
-        return cls.objects.filter(
-                from_currency=from_currency,
-                to_currency=to_currency,
-                active=True
-        ).first()
+        from .rates import get_rate_snapshot
+        row = get_rate_snapshot().get(from_currency, to_currency)
+        return cls.objects.filter(id=row['id']).first() if row else None
 
     @classmethod
     def get_current_rates_for_agent(cls):
         """Get current rates that agents should see (the latest active rate per pair)"""
-        from collections import OrderedDict
+        from .rates import get_rate_snapshot
 
-        rates = cls.objects.filter(active=True).order_by(
-                'from_currency', 'to_currency', '-created_at'
-        )
+        # The snapshot already knows which row is current for each pair
+        return cls.objects.filter(id__in=get_rate_snapshot().rate_ids()).order_by('from_currency', 'to_currency')
 
-        # Get latest rate per currency pair
-        latest_rates = OrderedDict()
-        for rate in rates:
-            key = (rate.from_currency, rate.to_currency)
-            if key not in latest_rates:
-                latest_rates[key] = rate
-
-        return latest_rates.values()
+    @classmethod
+    def get_rate_as_of(cls, from_currency, to_currency, when):
+        """Get the rate of a currency pair that was in force at a given time (see rate_history.py)"""
+        from .rate_history import get_rate_as_of
+        return get_rate_as_of(from_currency, to_currency, when)
 
     def __str__(self):
         status = " (Inactif)" if not self.active else ""
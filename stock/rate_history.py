@@ -0,0 +1,141 @@
+"""
+Exchange rates as of a past moment.
+
+The rates in force at a time follow the rules of the current snapshot (rates.py)
+applied to the rates that existed then: the latest active rate of each pair, and the
+cross-rate matrix (build_rate_matrix) filling the other pairs with inverse or
+triangulated rates.
+
+Only the active flag of today is stored, so the past is rebuilt from it: a rate
+replaced by a later one of its pair was in force until then, whatever its flag
+(creating or updating a rate deactivates the one it replaces). When the last rate of
+a pair is inactive, it was switched off by hand at an unknown time and is never used:
+the pair falls back to its latest active rate, if any, as the snapshot does. A
+lookup at the present therefore returns what get_conversion() returns.
+
+- RateHistory: every rate, loaded with one query, replayed in created_at order and
+  merged with the sorted lookups, so valuing a long report costs one query and one
+  pass (one matrix per distinct set of rates in force).
+- get_rate_as_of() / get_rates_as_of(): one or many lookups with a fresh history.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from .rates import build_rate_matrix
+
+logger = logging.getLogger(__name__)
+
+
+class RateHistory:
+    """
+    Every ExchangeRate, as the changes it made to the rates in force.
+
+    Rows are plain dicts ({'id', 'from_currency', 'to_currency', 'rate', 'active',
+    'created_at'}) in (created_at, id) order.
+    """
+
+    def __init__(self, rows, currencies=()):
+        self.currencies = list(currencies)
+
+        by_pair = defaultdict(list)
+        for row in rows:
+            by_pair[(row['from_currency'], row['to_currency'])].append(row)
+
+        # [(created_at, id, pair, row in force from then or None)]
+        self._changes = []
+        for pair, pair_rows in by_pair.items():
+            fallback = next((row for row in reversed(pair_rows) if row['active']), None)
+            for position, row in enumerate(pair_rows):
+                replaced = position < len(pair_rows) - 1
+                in_force = row if row['active'] or replaced else fallback
+                self._changes.append((row['created_at'], row['id'], pair, in_force))
+        self._changes.sort(key=lambda change: (change[0], change[1]))
+
+    @classmethod
+    def load(cls):
+        """All the rates, with one query"""
+        from .models import CURRENCY_CHOICES, ExchangeRate
+
+        rows = (ExchangeRate.objects
+                .order_by('created_at', 'id')
+                .values('id', 'from_currency', 'to_currency', 'rate', 'active', 'created_at'))
+        return cls(rows, currencies=[code for code, _label in CURRENCY_CHOICES])
+
+    def conversions_as_of(self, lookups):
+        """
+        Conversions in force for many (from_currency, to_currency, when) lookups.
+
+        Returns:
+            list: Conversion dict (see RateSnapshot.get_conversion) or None per lookup,
+            in the input order
+        """
+        lookups = list(lookups)
+        results = [None] * len(lookups)
+
+        pending = []
+        for position, (from_currency, to_currency, when) in enumerate(lookups):
+            if from_currency == to_currency:
+                results[position] = {'rate': Decimal('1'), 'source': 'identity', 'via': None,
+                                     'rate_ids': [], 'created_at': None}
+            elif when is not None:
+                pending.append((when, position))
+        pending.sort()
+
+        direct = {}
+        matrix = None
+        index = 0
+        for when, position in pending:
+            # Both sides are sorted: apply the changes made at or before this moment
+            while index < len(self._changes) and self._changes[index][0] <= when:
+                _created_at, _id, pair, row = self._changes[index]
+                if row is None:
+                    direct.pop(pair, None)
+                else:
+                    direct[pair] = {'id': row['id'], 'rate': row['rate'], 'created_at': row['created_at']}
+                matrix = None
+                index += 1
+
+            if matrix is None:
+                matrix = build_rate_matrix(direct, self.currencies)
+            from_currency, to_currency, _when = lookups[position]
+            results[position] = matrix.get((from_currency, to_currency))
+
+        return results
+
+    def rates_as_of(self, lookups):
+        """Rates in force for many (from_currency, to_currency, when) lookups: Decimal or None each"""
+        return [conversion['rate'] if conversion else None for conversion in self.conversions_as_of(lookups)]
+
+
+def get_rate_as_of(from_currency, to_currency, when):
+    """
+    Rate of a pair in force at a given time, triangulated if needed.
+
+    Args:
+        from_currency (str): Source currency code
+        to_currency (str): Destination currency code
+        when (datetime): Moment to value at (aware)
+
+    Returns:
+        Decimal or None: 1 for the same currency, None if no rate or path existed yet
+    """
+    if from_currency == to_currency:
+        return Decimal('1')
+    return RateHistory.load().rates_as_of([(from_currency, to_currency, when)])[0]
+
+
+def get_rates_as_of(lookups):
+    """
+    Rates in force for many (pair, time) lookups, with one query.
+
+    Args:
+        lookups: Iterable of (from_currency, to_currency, when) tuples
+
+    Returns:
+        list: Decimal or None per lookup, in the input order
+    """
+    lookups = list(lookups)
+    results = RateHistory.load().rates_as_of(lookups)
+    logger.debug(f"Resolved {len(lookups)} historical rates")
+    return results
@@ -0,0 +1,207 @@
+"""
+Snapshot of the current exchange rates.
+
+The snapshot holds the latest active ExchangeRate of every currency pair, and a
+cross-rate matrix filling the other pairs with inverse or one-hop triangulated rates
+(each entry records where it came from). It is built
+once per version token, stored in the shared cache for the other processes, and kept
+in process memory, so reading a rate costs a cache read (the version) and no query.
+ExchangeRate post_save/post_delete signals bump the token, which covers creation,
+updates, activation toggles and deletion.
+"""
+import logging
+import threading
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from users.utils import bump_cache_version, get_cache_version
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_RATE_VERSION_KEY = 'stock:exchange_rate_version'
+SNAPSHOT_CACHE_KEY = 'stock:exchange_rate_snapshot:{version}'
+SNAPSHOT_CACHE_TIMEOUT = 60 * 60 * 24
+DERIVED_RATE_PRECISION = Decimal('0.0000000001')  # Inverse / triangulated rates
+
+# Process-local state: (version, snapshot)
+_state = {'version': None, 'snapshot': None}
+_lock = threading.Lock()
+
+
+class RateSnapshot:
+    """
+    Latest active rate per (from_currency, to_currency), and the cross-rate matrix
+    derived from them.
+
+    Rows are plain dicts ({'id', 'rate', 'created_at'}) so the snapshot pickles small
+    and can be shared through the cache. The matrix is built with the snapshot, so it
+    is cached by the same version.
+    """
+
+    def __init__(self, rows, currencies=()):
+        self._rates = {}
+        for row in rows:
+            self._rates.setdefault((row['from_currency'], row['to_currency']), {
+                'id': row['id'],
+                'rate': row['rate'],
+                'created_at': row['created_at'],
+            })
+        self.matrix = build_rate_matrix(self._rates, currencies)
+
+    def get(self, from_currency, to_currency):
+        """The stored (direct) rate row of a pair, or None"""
+        return self._rates.get((from_currency, to_currency))
+
+    def get_conversion(self, from_currency, to_currency):
+        """
+        How to convert between two currencies, or None if no path exists.
+
+        Returns:
+            dict: {'rate', 'source' ('identity', 'direct', 'inverse' or 'triangulated'),
+                   'via' (intermediate currency or None), 'rate_ids', 'created_at' (oldest leg)}
+        """
+        if from_currency == to_currency:
+            return {'rate': Decimal('1'), 'source': 'identity', 'via': None, 'rate_ids': [], 'created_at': None}
+        return self.matrix.get((from_currency, to_currency))
+
+    def get_rate(self, from_currency, to_currency):
+        """The rate of a pair as a Decimal (direct, inverse or triangulated), or None"""
+        conversion = self.get_conversion(from_currency, to_currency)
+        return conversion['rate'] if conversion else None
+
+    def rate_ids(self):
+        return [row['id'] for row in self._rates.values()]
+
+    def pairs(self):
+        """{(from, to): rate} for every stored pair"""
+        return {pair: row['rate'] for pair, row in self._rates.items()}
+
+    def __len__(self):
+        return len(self._rates)
+
+
+def _derived(rate):
+    return rate.quantize(DERIVED_RATE_PRECISION)
+
+
+def build_rate_matrix(direct, currencies=()):
+    """
+    Cross rates for every ordered pair of currencies.
+
+    Each pair takes the first path available, in this order:
+    - direct: the stored rate
+    - inverse: 1 / the stored rate of the opposite pair
+    - triangulated: two direct or inverse legs through another currency, preferring
+      legs that are stored rates, then the intermediate currency code
+
+    Args:
+        direct: {(from, to): {'id', 'rate', 'created_at'}}
+        currencies: Currency codes to cover besides the ones in direct
+
+    Returns:
+        dict: {(from, to): conversion dict, see RateSnapshot.get_conversion}
+    """
+    codes = sorted(set(currencies) | {code for pair in direct for code in pair})
+
+    legs = {}
+    for (source, target), row in direct.items():
+        legs[(source, target)] = {
+            'rate': row['rate'], 'source': 'direct', 'via': None,
+            'rate_ids': [row['id']], 'created_at': row['created_at'],
+        }
+    for (source, target), row in direct.items():
+        if (target, source) not in legs and row['rate']:
+            legs[(target, source)] = {
+                'rate': _derived(1 / row['rate']), 'source': 'inverse', 'via': None,
+                'rate_ids': [row['id']], 'created_at': row['created_at'],
+            }
+
+    matrix = dict(legs)
+    for source in codes:
+        for target in codes:
+            if source == target or (source, target) in matrix:
+                continue
+
+            paths = [
+                (legs[(source, via)], legs[(via, target)], via)
+                for via in codes
+                if via not in (source, target) and (source, via) in legs and (via, target) in legs
+            ]
+            if not paths:
+                continue
+
+            first, second, via = min(paths, key=lambda path: (
+                (path[0]['source'] != 'direct') + (path[1]['source'] != 'direct'), path[2]
+            ))
+            matrix[(source, target)] = {
+                'rate': _derived(first['rate'] * second['rate']),
+                'source': 'triangulated',
+                'via': via,
+                'rate_ids': first['rate_ids'] + second['rate_ids'],
+                'created_at': min(first['created_at'], second['created_at']),
+            }
+
+    return matrix
+
+
+def _build_snapshot():
+    from .models import CURRENCY_CHOICES, ExchangeRate
+
+    rows = (ExchangeRate.objects
+            .filter(active=True)
+            .order_by('from_currency', 'to_currency', '-created_at', '-id')
+            .values('id', 'from_currency', 'to_currency', 'rate', 'created_at'))
+    return RateSnapshot(rows, currencies=[code for code, _label in CURRENCY_CHOICES])
+
+
+def get_exchange_rate_version():
+    """Version token of the rate snapshot; it changes whenever an ExchangeRate is saved or deleted"""
+    return get_cache_version(EXCHANGE_RATE_VERSION_KEY)
+
+
+def get_rate_snapshot():
+    """Get the rate snapshot, from process memory or the shared cache, rebuilding it if the version changed"""
+    version = get_exchange_rate_version()
+
+    snapshot = _state['snapshot']
+    if snapshot is not None and _state['version'] == version:
+        return snapshot
+
+    if connection.in_atomic_block:
+        # The transaction may still roll back: use a fresh snapshot without keeping it
+        return _build_snapshot()
+
+    with _lock:
+        if _state['snapshot'] is None or _state['version'] != version:
+            cache_key = SNAPSHOT_CACHE_KEY.format(version=version)
+            snapshot = cache.get(cache_key)
+            if snapshot is None:
+                snapshot = _build_snapshot()
+                cache.set(cache_key, snapshot, SNAPSHOT_CACHE_TIMEOUT)
+                logger.debug(f"Exchange rate snapshot rebuilt ({len(snapshot)} pairs)")
+            _state['snapshot'] = snapshot
+            _state['version'] = version
+
+        return _state['snapshot']
+
+
+def get_current_rate(from_currency, to_currency):
+    """Current rate of a pair as a Decimal, triangulated if needed (1 for the same currency), or None (no query)"""
+    return get_rate_snapshot().get_rate(from_currency, to_currency)
+
+
+def get_conversion(from_currency, to_currency):
+    """Current rate of a pair with where it came from (see RateSnapshot.get_conversion), or None (no query)"""
+    return get_rate_snapshot().get_conversion(from_currency, to_currency)
+
+
+def invalidate_rate_snapshot():
+    """
+    Drop this process's snapshot and bump the shared version once the change is committed.
+    The local drop lets code running in the same transaction see the change right away.
+    """
+    _state['snapshot'] = None
+    _state['version'] = None
+    transaction.on_commit(lambda: bump_cache_version(EXCHANGE_RATE_VERSION_KEY))
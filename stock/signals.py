@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ExchangeRate
+from .rates import invalidate_rate_snapshot
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def refresh_rate_snapshot(sender, instance, **kwargs):
+    """Rebuild the exchange rate snapshot whenever a rate is created, edited, toggled or deleted"""
+    invalidate_rate_snapshot()
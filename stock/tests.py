@@ -1,3 +1,281 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from users.models import User, UserActivity
+from users.signals import set_current_user
+from .checkpoints import backfill_checkpoints, find_checkpoint_drift, get_balance_at
+from .counters import verify_counters
+from .models import ExchangeRate, Stock, StockMovement
+from .rate_history import get_rates_as_of
+from .rates import get_conversion
+
+
+class StockBalanceConcurrencyTest(TransactionTestCase):
+    """Concurrent movements on the same stocks: balances must always equal the ledger"""
+
+    THREADS = 8
+    LOCK_RETRIES = 50
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.europe = Stock.objects.create(currency='EUR', location='EUROPE')
+        self.burundi = Stock.objects.create(currency='BIF', location='BURUNDI')
+
+    def _retry(self, action):
+        for attempt in range(self.LOCK_RETRIES):
+            try:
+                return action()
+            except OperationalError as e:
+                # The in-memory SQLite test database reports concurrent writers as
+                # "table is locked" instead of waiting: retry like a blocked writer would
+                if 'locked' not in str(e) or attempt == self.LOCK_RETRIES - 1:
+                    raise
+                time.sleep(0.01)
+
+    def _move(self, stock_id, type, amount, destination_id=None, rate=None):
+        """Save one movement from this thread's own (stale) copies of the stocks"""
+        movement = StockMovement(
+                stock=self._retry(lambda: Stock.objects.get(pk=stock_id)),
+                type=type,
+                amount=Decimal(amount),
+                destination_stock=self._retry(lambda: Stock.objects.get(pk=destination_id)) if destination_id else None,
+                custom_exchange_rate=rate,
+                created_by=self.manager
+        )
+        try:
+            # A retry after the commit (e.g. while refreshing the balances) does not apply it twice
+            self._retry(movement.save)
+            return True
+        except ValidationError:
+            return False
+
+    def _race(self, operations):
+        """Run one list of movements per thread, all threads released at the same moment"""
+        barrier = threading.Barrier(len(operations))
+        results = [None] * len(operations)
+
+        def worker(position):
+            try:
+                barrier.wait()
+                results[position] = [self._move(*operation) for operation in operations[position]]
+            except Exception as e:
+                results[position] = e
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(operations))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        self.assertEqual(errors, [])
+        return results
+
+    def _ledger_balance(self, stock):
+        def total(queryset, field):
+            return queryset.aggregate(total=Sum(field))['total'] or Decimal('0')
+
+        movements = StockMovement.objects.filter(stock=stock)
+        return (total(movements.filter(type='IN'), 'amount')
+                - total(movements.filter(type='OUT'), 'amount')
+                + total(StockMovement.objects.filter(destination_stock=stock), 'destination_amount'))
+
+    def assertBalancesMatchLedger(self):
+        for stock in (self.europe, self.burundi):
+            stock.refresh_from_db()
+            self.assertGreaterEqual(stock.amount, 0)
+            self.assertEqual(stock.amount, self._ledger_balance(stock))
+            self.assertEqual(verify_counters([stock]), [])
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        self._move(self.europe.pk, 'IN', '100.00')
+
+        results = self._race([[(self.europe.pk, 'OUT', '30.00')] for _ in range(self.THREADS)])
+
+        self.assertEqual(sum(result.count(True) for result in results), 3)
+        self.europe.refresh_from_db()
+        self.assertEqual(self.europe.amount, Decimal('10.00'))
+        self.assertEqual(StockMovement.objects.filter(type='OUT').count(), 3)
+        self.assertBalancesMatchLedger()
+
+    def test_mixed_movements_keep_balances_equal_to_ledger(self):
+        self._move(self.europe.pk, 'IN', '500.00')
+        self._move(self.burundi.pk, 'IN', '100000.00')
+
+        operations = []
+        for position in range(self.THREADS):
+            thread_operations = []
+            for step in range(10):
+                kind = (position + step) % 4
+                if kind == 0:
+                    thread_operations.append((self.europe.pk, 'IN', '12.35'))
+                elif kind == 1:
+                    thread_operations.append((self.europe.pk, 'OUT', '40.10'))
+                elif kind == 2:
+                    thread_operations.append((self.europe.pk, 'OUT', '25.00', self.burundi.pk, Decimal('3100.1234')))
+                else:
+                    thread_operations.append((self.burundi.pk, 'OUT', '9999.99'))
+            operations.append(thread_operations)
+
+        self._race(operations)
+
+        self.assertBalancesMatchLedger()
+
+    def test_resave_does_not_apply_movement_twice(self):
+        self._move(self.europe.pk, 'IN', '100.00')
+        movement = StockMovement.objects.get()
+
+        movement.reason = 'Corrigé'
+        movement.save()
+
+        self.europe.refresh_from_db()
+        self.assertEqual(self.europe.amount, Decimal('100.00'))
+
+    def test_verify_counters_repairs_drift(self):
+        self._move(self.europe.pk, 'IN', '100.00')
+        self._move(self.europe.pk, 'OUT', '40.00')
+        Stock.objects.filter(pk=self.europe.pk).update(total_in=0, movement_count=7)
+
+        mismatches = verify_counters([self.europe], repair=True)
+
+        self.assertEqual({mismatch['field'] for mismatch in mismatches}, {'total_in', 'movement_count'})
+        self.europe.refresh_from_db()
+        self.assertEqual(self.europe.total_in, Decimal('100.00'))
+        self.assertEqual(self.europe.total_out, Decimal('40.00'))
+        self.assertEqual(self.europe.movement_count, 2)
+        self.assertEqual(verify_counters([self.europe]), [])
+
+    def test_checkpoint_drift_is_reported_then_rebuilt(self):
+        self._move(self.europe.pk, 'IN', '100.00')
+        StockMovement.objects.update(created_at=timezone.now() - timedelta(days=1))
+        backfill_checkpoints([self.europe])
+        self.assertEqual(find_checkpoint_drift([self.europe]), [])
+
+        # An edit that bypasses StockMovement.save(), e.g. from the admin or a queryset
+        Stock.objects.filter(pk=self.europe.pk).update(amount=Decimal('130.00'))
+        drifts = find_checkpoint_drift([self.europe])
+        self.assertEqual([(drift['day'], drift['expected'], drift['stored']) for drift in drifts],
+                         [(None, Decimal('100.00'), Decimal('130.00'))])
+
+        # A later movement folds the edit into its own day's checkpoint: still reported
+        self._move(self.europe.pk, 'OUT', '10.00')
+        drifts = find_checkpoint_drift([self.europe])
+        self.assertEqual([(drift['day'], drift['expected'], drift['stored']) for drift in drifts],
+                         [(timezone.localdate(), Decimal('90.00'), Decimal('120.00'))])
+
+        backfill_checkpoints([self.europe])
+        self.assertEqual(find_checkpoint_drift([self.europe]), [])
+        self.assertEqual(get_balance_at(self.europe, timezone.now()), Decimal('120.00'))
+
+    def test_balance_before_the_first_checkpoint_goes_back_from_it(self):
+        now = timezone.now()
+        self._move(self.europe.pk, 'IN', '100.00')
+        self._move(self.europe.pk, 'IN', '50.00')
+        self._move(self.europe.pk, 'OUT', '30.00')
+        first, second, third = StockMovement.objects.order_by('pk')
+        StockMovement.objects.filter(pk=first.pk).update(created_at=now - timedelta(days=10, hours=1))
+        StockMovement.objects.filter(pk=second.pk).update(created_at=now - timedelta(days=10))
+        StockMovement.objects.filter(pk=third.pk).update(created_at=now - timedelta(days=2))
+        backfill_checkpoints([self.europe])
+
+        # A later change outside the movements does not move past balances
+        Stock.objects.filter(pk=self.europe.pk).update(amount=Decimal('999.00'))
+        self.europe.refresh_from_db()
+
+        between = now - timedelta(days=10, minutes=30)
+        self.assertEqual(get_balance_at(self.europe, between), Decimal('100.00'))
+        self.assertEqual(get_balance_at(self.europe, now - timedelta(days=5)), Decimal('150.00'))
+        self.assertEqual(get_balance_at(self.europe, now - timedelta(days=1)), Decimal('120.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            get_balance_at(self.europe, between)
+        # The movements are summed up to the checkpoint's end of day only, not up to now
+        sums = [query['sql'] for query in queries if 'SUM' in query['sql']]
+        self.assertTrue(sums)
+        self.assertTrue(all('"created_at" <=' in sql for sql in sums))
+
+
+class RateHistoryTest(TestCase):
+    """Historical rates follow the same selection rules as the current snapshot (rates.py)"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def _rate(self, from_currency, to_currency, rate, days_ago, active=True):
+        exchange_rate = ExchangeRate.objects.create(from_currency=from_currency, to_currency=to_currency,
+                                                    rate=Decimal(rate), active=active)
+        ExchangeRate.objects.filter(pk=exchange_rate.pk).update(created_at=self.now - timedelta(days=days_ago))
+        return exchange_rate
+
+    def test_replaced_switched_off_inverse_and_triangulated_rates(self):
+        self._rate('EUR', 'BIF', '3000', days_ago=10, active=False)  # Replaced 5 days ago
+        self._rate('EUR', 'BIF', '3100', days_ago=5)
+        self._rate('USD', 'EUR', '0.9', days_ago=8)
+        self._rate('USD', 'BIF', '2700', days_ago=3, active=False)  # Switched off by hand
+
+        def rates(days_ago):
+            when = self.now - timedelta(days=days_ago)
+            return get_rates_as_of([
+                ('EUR', 'BIF', when),
+                ('BIF', 'EUR', when),
+                ('USD', 'BIF', when),
+                ('EUR', 'EUR', when),
+            ])
+
+        self.assertEqual(rates(11), [None, None, None, Decimal('1')])
+        self.assertEqual(rates(9), [Decimal('3000'), Decimal('0.0003333333'), None, Decimal('1')])
+        # USD -> BIF through EUR, the switched-off direct rate is never used
+        self.assertEqual(rates(1), [Decimal('3100'), Decimal('0.0003225806'), Decimal('2790.0000000000'),
+                                    Decimal('1')])
+
+    def test_present_matches_the_current_snapshot(self):
+        self._rate('EUR', 'USD', '1.10', days_ago=4)
+        self._rate('EUR', 'USD', '1.05', days_ago=2, active=False)  # Switched off: 1.10 is current again
+        self._rate('BIF', 'USD', '0.00035', days_ago=1)
+
+        pairs = [(source, target) for source in ('EUR', 'BIF', 'USD') for target in ('EUR', 'BIF', 'USD')]
+        historical = get_rates_as_of((source, target, timezone.now()) for source, target in pairs)
+        current = [get_conversion(source, target) for source, target in pairs]
+
+        self.assertEqual(historical, [conversion['rate'] if conversion else None for conversion in current])
+
+
+@override_settings(AUDIT_BACKGROUND_WRITES=False)
+class StockAuditTrailTest(TestCase):
+    """A transfer between stocks shows on both stocks' audit trails"""
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.europe = Stock.objects.create(currency='EUR', location='EUROPE', amount=Decimal('500.00'))
+        self.burundi = Stock.objects.create(currency='BIF', location='BURUNDI')
+        set_current_user(self.manager)
+        self.addCleanup(set_current_user, None)
+
+    def test_incoming_transfer_is_on_the_destination_trail(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            StockMovement(stock=self.europe, type='OUT', amount=Decimal('100.00'), destination_stock=self.burundi,
+                          custom_exchange_rate=Decimal('3000'), created_by=self.manager).save()
+
+        activity = UserActivity.objects.get(action='stock_stockmovement_created')
+        self.assertEqual((activity.entity_type, activity.entity_id), ('stock.Stock', self.europe.pk))
+        self.assertEqual((activity.related_entity_type, activity.related_entity_id), ('stock.Stock', self.burundi.pk))
+
+        with CaptureQueriesContext(connection) as queries:
+            trail = list(UserActivity.objects.for_entity(self.burundi))
+        self.assertIn(activity, trail)
+        self.assertIn(activity, UserActivity.objects.for_entity(self.europe))
+        # Entity columns only: no JSON lookup, no subquery on the movements
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('details', queries[0]['sql'].split('WHERE')[1])
+        self.assertNotIn('stock_stockmovement', queries[0]['sql'])
@@ -7,11 +7,13 @@ from django.http import HttpResponseForbidden, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError
 from django.db.models import Sum, Q, Count
-from django.db import models
 from django.utils import timezone
 from .models import CURRENCY_CHOICES, Stock, StockMovement, ExchangeRate
 from .forms import StockForm, StockMovementForm, ExchangeRateForm, MoneyDepositForm
-from users.models import log_user_activity
+from .checkpoints import get_balance_history
+from users.models import UserActivity, log_user_activity
+
+BALANCE_HISTORY_DAYS = 90
 
 
 @login_required
@@ -45,19 +47,21 @@ def stock_detail(request, stock_id):
         return HttpResponseForbidden("Access denied")
 
     stock = get_object_or_404(Stock, id=stock_id)
-    movements = StockMovement.objects.filter(stock=stock).order_by('-created_at')[:20]
+    movements = (StockMovement.objects.filter(stock=stock)
+                 .select_related('created_by', 'destination_stock')
+                 .order_by('-created_at')[:20])
 
-    # Calculate movement stats
-    movement_stats = StockMovement.objects.filter(stock=stock).aggregate(
-            total_in=Sum('amount', filter=Q(type='IN')),
-            total_out=Sum('amount', filter=Q(type='OUT')),
-            movement_count=models.Count('id')
-    )
+    # Daily closing balances from the checkpoints (see checkpoints.py)
+    balance_history = get_balance_history(stock, days=BALANCE_HISTORY_DAYS)
 
     context = {
         'stock': stock,
         'movements': movements,
-        'movement_stats': movement_stats,
+        'balance_history': {
+            'labels': [day.strftime('%d/%m') for day, _balance in balance_history],
+            'balances': [float(balance) for _day, balance in balance_history],
+        },
+        'audit_trail': UserActivity.objects.for_entity(stock),
     }
 
     return render(request, 'stock/stock_detail.html', context)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Transfer, CommissionConfig, CommissionDistribution
+from .models import AutoPromotionTask, Transfer, CommissionConfig, CommissionDistribution, CommissionRollup
+from .search import search_transfers
 
 
 class CommissionDistributionInline(admin.StackedInline):
@@ -23,6 +24,15 @@ class TransferAdmin(admin.ModelAdmin):
     search_fields = ('beneficiary_name', 'beneficiary_phone', 'agent__username')
     readonly_fields = ('created_at', 'updated_at')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Beneficiary fields go through the search index instead of LIKE '%term%' scans,
+        # agents (a small table joined in) keep the partial, case-insensitive match
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return (search_transfers(queryset, search_term)
+                | queryset.filter(agent__username__icontains=search_term)), False
+
     fieldsets = (
         ('Transfer Details', {
             'fields': ('beneficiary_name', 'beneficiary_phone', 'method', 'amount',
@@ -113,3 +123,40 @@ class CommissionDistributionAdmin(admin.ModelAdmin):
         return f"#{obj.transfer.id}"
 
     transfer_id.short_description = "Transfer"
+
+
+@admin.register(CommissionRollup)
+class CommissionRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        'day', 'agent', 'currency', 'distribution_count', 'total_commission',
+        'declaring_agent_amount', 'manager_amount', 'updated_at'
+    )
+
+    list_filter = ('currency', 'day')
+    search_fields = ('agent__username',)
+    readonly_fields = (
+        'day', 'agent', 'currency', 'distribution_count', 'total_commission',
+        'declaring_agent_amount', 'manager_amount', 'updated_at'
+    )
+
+    def has_add_permission(self, request):
+        # Rows are maintained from CommissionDistribution (see rebuild_commission_rollup)
+        return False
+
+
+@admin.register(AutoPromotionTask)
+class AutoPromotionTaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'commission_config', 'status', 'processed_count', 'total_count',
+        'promoted_count', 'failed_count', 'triggered_by', 'created_at', 'finished_at'
+    )
+
+    list_filter = ('status', 'created_at')
+    readonly_fields = (
+        'commission_config', 'triggered_by', 'status', 'total_count', 'processed_count', 'promoted_count',
+        'failed_count', 'failed_transfers', 'error', 'created_at', 'started_at', 'finished_at'
+    )
+
+    def has_add_permission(self, request):
+        # Tasks are only created by the auto-promotion signal
+        return False
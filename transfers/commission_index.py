@@ -0,0 +1,162 @@
+"""
+In-memory index of active commission brackets.
+
+Every process keeps the active CommissionConfig rows sorted by currency and min_amount,
+and answers "which config applies to this amount" with a bisect instead of a query.
+The index is rebuilt when the version token in the cache changes; CommissionConfig
+post_save/post_delete signals bump that token.
+"""
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+
+from users.utils import bump_cache_version, get_cache_version
+
+logger = logging.getLogger(__name__)
+
+COMMISSION_CONFIG_VERSION_KEY = 'transfers:commission_config_version'
+CENT = Decimal('0.01')
+
+# Process-local state: (version, index)
+_state = {'version': None, 'index': None}
+_lock = threading.Lock()
+
+
+class CommissionBracketIndex:
+    """
+    Active commission configs grouped by currency, sorted by (min_amount, id).
+
+    For each currency we keep the sorted min_amounts and a running maximum of
+    max_amount. The first config (in min_amount order) covering an amount is the first
+    position where the running maximum reaches the amount - the same row that
+    CommissionConfig.objects.filter(...).first() returns.
+    """
+
+    def __init__(self, configs):
+        self.configs = sorted(configs, key=lambda c: (c.currency, c.min_amount, c.id))
+        self._brackets = {}
+
+        for config in self.configs:
+            bracket = self._brackets.setdefault(config.currency, {'configs': [], 'mins': [], 'max_reach': []})
+            reach = bracket['max_reach'][-1] if bracket['max_reach'] else None
+
+            bracket['configs'].append(config)
+            bracket['mins'].append(config.min_amount)
+            bracket['max_reach'].append(config.max_amount if reach is None else max(reach, config.max_amount))
+
+    def find(self, currency, amount, manager_id=None):
+        """
+        Get the first active config for a currency covering the amount.
+
+        Args:
+            currency (str): Currency code
+            amount (Decimal): Transfer amount
+            manager_id (int, optional): Restrict to configs owned by this manager
+
+        Returns:
+            CommissionConfig or None
+        """
+        bracket = self._brackets.get(currency)
+        amount = _to_decimal(amount)
+        if not bracket or amount is None:
+            return None
+
+        # Configs that start at or below the amount
+        end = bisect_right(bracket['mins'], amount)
+        # First of them whose range reaches the amount
+        start = bisect_left(bracket['max_reach'], amount, hi=end)
+
+        for position in range(start, end):
+            config = bracket['configs'][position]
+            if config.max_amount < amount:
+                continue
+            if manager_id is not None and config.manager_id != manager_id:
+                continue
+            return config
+
+        return None
+
+    def bracket_table(self):
+        """
+        Every active config as a JSON-ready bracket, in lookup order.
+        The first bracket of a currency covering an amount is the one find() returns
+        (without a manager filter), so clients can resolve previews locally.
+        """
+        return [describe_bracket(config) for config in self.configs]
+
+    def __len__(self):
+        return len(self.configs)
+
+
+def describe_bracket(config):
+    """Range of a config and how its fixed commission is split, amounts as strings"""
+    agent_amount = config.commission_amount * config.agent_share / 100
+    return {
+        'id': config.id,
+        'currency': config.currency,
+        'min_amount': str(config.min_amount),
+        'max_amount': str(config.max_amount),
+        'total_commission': str(config.commission_amount),
+        'agent_amount': str(agent_amount.quantize(CENT)),
+        'manager_amount': str((config.commission_amount - agent_amount).quantize(CENT)),
+        'agent_share_percent': str(config.agent_share),
+    }
+
+
+def _to_decimal(amount):
+    if isinstance(amount, Decimal):
+        return amount
+    try:
+        return Decimal(str(amount))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def _build_index():
+    from .models import CommissionConfig
+
+    return CommissionBracketIndex(CommissionConfig.objects.filter(active=True))
+
+
+def get_commission_index():
+    """Get the bracket index for this process, rebuilding it if the version changed"""
+    version = get_commission_version()
+
+    index = _state['index']
+    if index is not None and _state['version'] == version:
+        return index
+
+    if connection.in_atomic_block:
+        # The transaction may still roll back: use a fresh index without keeping it
+        return _build_index()
+
+    with _lock:
+        if _state['index'] is None or _state['version'] != version:
+            _state['index'] = _build_index()
+            _state['version'] = version
+            logger.debug(f"Commission bracket index rebuilt ({len(_state['index'])} active configs)")
+
+        return _state['index']
+
+
+def get_commission_version():
+    """Version token of the active configs; it changes whenever a config is saved or deleted"""
+    return get_cache_version(COMMISSION_CONFIG_VERSION_KEY)
+
+
+def find_commission_config(currency, amount, manager_id=None):
+    """Get the applicable active commission config for a currency and amount (no query)"""
+    return get_commission_index().find(currency, amount, manager_id=manager_id)
+
+
+def invalidate_commission_index():
+    """
+    Drop this process's index and bump the shared version once the change is committed.
+    The local drop lets code running in the same transaction see the change right away.
+    """
+    _state['index'] = None
+    _state['version'] = None
+    transaction.on_commit(lambda: bump_cache_version(COMMISSION_CONFIG_VERSION_KEY))
@@ -0,0 +1,253 @@
+"""
+Incremental daily commission rollup.
+
+CommissionRollup keeps one row per (day, agent, currency) with the summed commission
+amounts. Rows are adjusted with F() increments when distributions are created or
+deleted, so commissions_overview reads a few hundred small rows instead of grouping
+the whole CommissionDistribution table. Weeks, months and years are built from the
+daily rows. Deleting transfers subtracts their distributions with one grouped query
+per deletion; a deleted agent's rows go with it.
+
+Days are local dates (settings.TIME_ZONE), the same buckets TruncDay used.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncMonth, TruncWeek, TruncYear
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_FIELDS = ('total_commission', 'declaring_agent_amount', 'manager_amount')
+
+PERIOD_TRUNC = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+_suspended = threading.local()
+
+
+@contextmanager
+def rollup_signals_suspended():
+    """Make the CommissionDistribution signal receivers skip the rollup (caller adjusts it itself)"""
+    previous = getattr(_suspended, 'active', False)
+    _suspended.active = True
+    try:
+        yield
+    finally:
+        _suspended.active = previous
+
+
+def rollup_signals_active():
+    return not getattr(_suspended, 'active', False)
+
+
+def _empty_bucket():
+    return {'distribution_count': 0, **{field: Decimal('0') for field in AMOUNT_FIELDS}}
+
+
+def _bucket_distributions(distributions):
+    """Group distributions in memory by (day, agent_id, currency)"""
+    buckets = {}
+    for distribution in distributions:
+        key = (
+            timezone.localdate(distribution.created_at),
+            distribution.agent_id,
+            distribution.transfer.sent_currency,
+        )
+        bucket = buckets.setdefault(key, _empty_bucket())
+        bucket['distribution_count'] += 1
+        for field in AMOUNT_FIELDS:
+            bucket[field] += getattr(distribution, field)
+    return buckets
+
+
+def _bucket_queryset(queryset):
+    """Group a CommissionDistribution queryset by (day, agent_id, currency) in the database"""
+    rows = (
+        queryset.order_by()
+        .annotate(rollup_day=TruncDate('created_at'))
+        .values('rollup_day', 'agent_id', 'transfer__sent_currency')
+        .annotate(
+                rollup_count=Count('id'),
+                **{f'rollup_{field}': Sum(field) for field in AMOUNT_FIELDS}
+        )
+    )
+    return {
+        (row['rollup_day'], row['agent_id'], row['transfer__sent_currency']): {
+            'distribution_count': row['rollup_count'],
+            **{field: row[f'rollup_{field}'] or Decimal('0') for field in AMOUNT_FIELDS},
+        }
+        for row in rows
+    }
+
+
+def _apply_buckets(buckets, sign):
+    """Add (sign=1) or subtract (sign=-1) bucket totals from the rollup rows"""
+    from .models import CommissionRollup
+
+    if not buckets:
+        return
+
+    with transaction.atomic():
+        for (day, agent_id, currency), totals in buckets.items():
+            rows = CommissionRollup.objects.filter(day=day, agent_id=agent_id, currency=currency)
+            increments = {field: F(field) + sign * value for field, value in totals.items()}
+
+            if rows.update(**increments, updated_at=timezone.now()):
+                if sign < 0:
+                    rows.filter(distribution_count__lte=0).delete()
+                continue
+
+            if sign < 0:
+                logger.warning(f"Commission rollup bucket {day}/{agent_id}/{currency} missing while removing, "
+                               f"run rebuild_commission_rollup")
+                continue
+
+            try:
+                with transaction.atomic():
+                    CommissionRollup.objects.create(day=day, agent_id=agent_id, currency=currency, **totals)
+            except IntegrityError:
+                # Created concurrently: fall back to the increment
+                rows.update(**increments, updated_at=timezone.now())
+
+
+def record_distributions(distributions):
+    """Add newly created distributions to the rollup (for bulk_create paths, which send no signals)"""
+    _apply_buckets(_bucket_distributions(distributions), 1)
+
+
+def remove_distributions(distributions):
+    """Subtract deleted distributions from the rollup"""
+    _apply_buckets(_bucket_distributions(distributions), -1)
+
+
+CASCADE_STATE = '_commission_rollup_cascade'
+
+
+def _cascade_state(origin):
+    """What the deletion started from `origin` already took out of the rollup, kept on the origin itself"""
+    state = getattr(origin, CASCADE_STATE, None)
+    if state is None:
+        state = {'distribution_ids': set(), 'agent_ids': set(), 'transfer_ids': set(), 'whole_origin': False}
+        setattr(origin, CASCADE_STATE, state)
+    return state
+
+
+def remove_cascaded_transfer(transfer, origin):
+    """
+    pre_delete of a Transfer: subtract the distributions the deletion cascades to.
+
+    A queryset deletion is handled once for all its transfers with one grouped
+    query; the distributions' own post_delete then skips them.
+    """
+    from django.db.models import QuerySet
+
+    from .models import CommissionDistribution, Transfer
+
+    if origin is None:
+        return  # No deletion context: the distributions' post_delete handles them one by one
+
+    state = _cascade_state(origin)
+    if state['whole_origin'] or transfer.pk in state['transfer_ids']:
+        return
+
+    if isinstance(origin, QuerySet) and origin.model is Transfer:
+        distributions = CommissionDistribution.objects.filter(transfer__in=origin)
+        state['whole_origin'] = True
+    else:
+        distributions = CommissionDistribution.objects.filter(transfer=transfer)
+        state['transfer_ids'].add(transfer.pk)
+
+    distributions = distributions.exclude(pk__in=state['distribution_ids'])
+    state['distribution_ids'].update(distributions.values_list('pk', flat=True))
+    _apply_buckets(_bucket_queryset(distributions), -1)
+
+
+def skip_cascaded_agent(agent, origin):
+    """pre_delete of a User: the agent's rollup rows are deleted with it, its distributions need no subtraction"""
+    if origin is not None:
+        _cascade_state(origin)['agent_ids'].add(agent.pk)
+
+
+def remove_deleted_distribution(distribution, origin):
+    """post_delete of a CommissionDistribution not already handled by its deletion's cascade"""
+    state = getattr(origin, CASCADE_STATE, None)
+    if state and (distribution.pk in state['distribution_ids'] or distribution.agent_id in state['agent_ids']):
+        return
+    remove_distributions([distribution])
+
+
+def delete_distributions(queryset):
+    """
+    Delete distributions and subtract them from the rollup with one grouped query,
+    instead of one rollup update per deleted row.
+
+    Returns:
+        int: Number of distributions deleted
+    """
+    with transaction.atomic():
+        buckets = _bucket_queryset(queryset)
+        count = sum(bucket['distribution_count'] for bucket in buckets.values())
+
+        with rollup_signals_suspended():
+            queryset.delete()
+
+        _apply_buckets(buckets, -1)
+
+    return count
+
+
+def rebuild_rollup():
+    """
+    Recompute every rollup row from CommissionDistribution.
+
+    Returns:
+        int: Number of rollup rows written
+    """
+    from .models import CommissionDistribution, CommissionRollup
+
+    with transaction.atomic():
+        buckets = _bucket_queryset(CommissionDistribution.objects.all())
+        CommissionRollup.objects.all().delete()
+        CommissionRollup.objects.bulk_create(
+                [
+                    CommissionRollup(day=day, agent_id=agent_id, currency=currency, **totals)
+                    for (day, agent_id, currency), totals in buckets.items()
+                ],
+                batch_size=1000
+        )
+
+    return len(buckets)
+
+
+def rollup_by_period(queryset, period):
+    """
+    Aggregate daily rollup rows into periods.
+
+    Args:
+        queryset (QuerySet): CommissionRollup rows to aggregate
+        period (str): 'day', 'week', 'month' or 'year' (defaults to month)
+
+    Returns:
+        QuerySet: values with `period` and the summed amount fields
+    """
+    trunc_function = PERIOD_TRUNC.get(period, TruncMonth)
+    return (
+        queryset
+        .annotate(period=trunc_function('day'))
+        .values('period')
+        .annotate(
+                total_agent=Sum('declaring_agent_amount'),
+                total_manager=Sum('manager_amount'),
+                total_commissions=Sum('total_commission'),
+                count=Sum('distribution_count'),
+        )
+    )
@@ -0,0 +1,87 @@
+"""
+Duplicate transfer detection.
+
+Every transfer stores a fingerprint: a SHA-256 of (agent, beneficiary phone digits,
+amount, sent currency, method). Finding a probable duplicate is then a single lookup
+on the (fingerprint, -created_at) index, limited to the last
+TRANSFER_DUPLICATE_WINDOW_SECONDS.
+
+Client retries are handled separately with an idempotency key (Idempotency-Key
+header or the hidden field of the create form), unique per agent: a retried request
+returns the transfer created by the first one.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .search import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+def transfer_fingerprint(agent_id, beneficiary_phone, amount, currency, method):
+    """Hex SHA-256 of the fields that make two transfers 'the same'"""
+    amount = Decimal(amount).quantize(Decimal('0.01')) if amount is not None else ''
+    parts = (agent_id or '', normalize_phone(beneficiary_phone), amount, currency or '', method or '')
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def set_fingerprint(transfer):
+    """Fill transfer.fingerprint from its fields (no save)"""
+    transfer.fingerprint = transfer_fingerprint(
+            transfer.agent_id, transfer.beneficiary_phone, transfer.amount,
+            transfer.sent_currency, transfer.method
+    )
+
+
+def find_recent_duplicate(transfer, window_seconds=None):
+    """
+    The latest non-canceled transfer with the same fingerprint inside the window.
+
+    Args:
+        transfer: Unsaved transfer (agent and form fields set)
+        window_seconds (int, optional): Defaults to TRANSFER_DUPLICATE_WINDOW_SECONDS
+
+    Returns:
+        Transfer or None
+    """
+    from .models import Transfer
+
+    if window_seconds is None:
+        window_seconds = getattr(settings, 'TRANSFER_DUPLICATE_WINDOW_SECONDS', 600)
+    if window_seconds <= 0:
+        return None
+
+    set_fingerprint(transfer)
+    return (Transfer.objects
+            .filter(fingerprint=transfer.fingerprint,
+                    created_at__gte=timezone.now() - timedelta(seconds=window_seconds))
+            .exclude(status='CANCELED')
+            .order_by('-created_at')
+            .first())
+
+
+def get_idempotency_key(request):
+    """The request's idempotency key (header first, then form field), or None"""
+    key = (request.META.get(IDEMPOTENCY_HEADER) or request.POST.get(IDEMPOTENCY_FIELD) or '').strip()
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        # Keep long client keys distinct instead of truncating them
+        key = hashlib.sha256(key.encode()).hexdigest()
+    return key or None
+
+
+def find_idempotent_transfer(agent, key):
+    """The transfer an earlier request with this key created for this agent, or None"""
+    from .models import Transfer
+
+    if not key:
+        return None
+    return Transfer.objects.filter(agent=agent, idempotency_key=key).first()
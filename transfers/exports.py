@@ -0,0 +1,252 @@
+"""
+Streaming exports of transfers and commission distributions (CSV or JSON Lines).
+
+Rows are read with values_list(...).iterator(chunk_size=...) and written one at a time,
+so memory stays flat whatever the size of the export. Used by the export_data view
+and the export_transfers management command.
+
+CSV cells starting like a spreadsheet formula (=, +, -, @) are prefixed with a quote
+so opening the export never runs them, plain numbers and phone numbers excepted;
+JSON Lines keeps the values as they are.
+"""
+import csv
+import datetime
+import json
+import re
+from decimal import ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import CURRENCY_CHOICES, TRANSFER_STATUS
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Export kind -> model name, (column header, field path) pairs and the fields the filters apply to
+EXPORT_KINDS = {
+    'transfers': {
+        'model': 'Transfer',
+        'columns': [
+            ('id', 'id'),
+            ('reference_id', 'reference_id'),
+            ('created_at', 'created_at'),
+            ('status', 'status'),
+            ('agent', 'agent__username'),
+            ('beneficiary_name', 'beneficiary_name'),
+            ('beneficiary_phone', 'beneficiary_phone'),
+            ('method', 'method'),
+            ('amount', 'amount'),
+            ('sent_currency', 'sent_currency'),
+            ('received_currency', 'received_currency'),
+            ('validated_by', 'validated_by__username'),
+            ('validated_at', 'validated_at'),
+            ('executed_by', 'executed_by__username'),
+            ('executed_at', 'executed_at'),
+        ],
+        # Extra column: the amount in received_currency at the rate in force when the transfer was created
+        'valuation': ('received_amount', 'amount', 'sent_currency', 'received_currency', 'created_at'),
+        'status_field': 'status',
+        'currency_field': 'sent_currency',
+    },
+    'commissions': {
+        'model': 'CommissionDistribution',
+        'columns': [
+            ('id', 'id'),
+            ('created_at', 'created_at'),
+            ('transfer_reference_id', 'transfer__reference_id'),
+            ('transfer_status', 'transfer__status'),
+            ('agent', 'agent__username'),
+            ('transfer_amount', 'transfer__amount'),
+            ('currency', 'transfer__sent_currency'),
+            ('total_commission', 'total_commission'),
+            ('declaring_agent_amount', 'declaring_agent_amount'),
+            ('manager_amount', 'manager_amount'),
+            ('config_used_id', 'config_used_id'),
+        ],
+        'status_field': 'transfer__status',
+        'currency_field': 'transfer__sent_currency',
+    },
+}
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"Date invalide pour {name}: {value} (format attendu AAAA-MM-JJ)")
+
+
+def parse_export_filters(params):
+    """
+    Validate export filters from a GET QueryDict or a plain dict.
+
+    Accepted keys: date_from, date_to (YYYY-MM-DD, inclusive), status, agent (user id), currency.
+
+    Raises:
+        ValidationError: If a filter value is invalid
+    """
+    filters = {}
+
+    for name in ('date_from', 'date_to'):
+        if params.get(name):
+            filters[name] = _parse_date(params.get(name), name)
+
+    if filters.get('date_from') and filters.get('date_to') and filters['date_from'] > filters['date_to']:
+        raise ValidationError("La date de début doit précéder la date de fin.")
+
+    status = params.get('status')
+    if status:
+        if status not in dict(TRANSFER_STATUS):
+            raise ValidationError(f"Statut invalide: {status}")
+        filters['status'] = status
+
+    currency = params.get('currency')
+    if currency:
+        if currency not in dict(CURRENCY_CHOICES):
+            raise ValidationError(f"Devise invalide: {currency}")
+        filters['currency'] = currency
+
+    agent = params.get('agent')
+    if agent:
+        try:
+            filters['agent_id'] = int(agent)
+        except (TypeError, ValueError):
+            raise ValidationError(f"Agent invalide: {agent}")
+
+    return filters
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def build_export_rows(kind, filters):
+    """
+    Get the export headers and a lazily evaluated values_list queryset.
+
+    Date filters become created_at ranges (not __date lookups) so the created_at indexes apply.
+
+    Returns:
+        tuple: (headers, queryset of tuples)
+    """
+    from . import models
+
+    spec = EXPORT_KINDS[kind]
+    queryset = getattr(models, spec['model']).objects.all()
+
+    if filters.get('date_from'):
+        queryset = queryset.filter(created_at__gte=_day_start(filters['date_from']))
+    if filters.get('date_to'):
+        queryset = queryset.filter(created_at__lt=_day_start(filters['date_to'] + datetime.timedelta(days=1)))
+    if filters.get('status'):
+        queryset = queryset.filter(**{spec['status_field']: filters['status']})
+    if filters.get('currency'):
+        queryset = queryset.filter(**{spec['currency_field']: filters['currency']})
+    if filters.get('agent_id'):
+        queryset = queryset.filter(agent_id=filters['agent_id'])
+
+    headers = [header for header, _field in spec['columns']]
+    fields = [field for _header, field in spec['columns']]
+    rows = queryset.order_by('created_at', 'id').values_list(*fields)
+
+    if spec.get('valuation'):
+        header, *value_fields = spec['valuation']
+        rows = _ValuedRows(rows, [fields.index(field) for field in value_fields])
+        headers.append(header)
+
+    return headers, rows
+
+
+class _ValuedRows:
+    """
+    values_list rows with one more value: the amount converted at the rate in force
+    at the row's time (stock/rate_history.py). The rates are read once per export
+    and merged with each chunk, which comes in created_at order.
+    """
+
+    def __init__(self, rows, positions):
+        self.rows = rows
+        self.positions = positions  # amount, from currency, to currency, time
+
+    def iterator(self, chunk_size):
+        from stock.rate_history import RateHistory
+
+        history = RateHistory.load()
+        amount, from_currency, to_currency, when = self.positions
+
+        chunk = []
+        for row in self.rows.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) < chunk_size:
+                continue
+            yield from self._valued(history, chunk, amount, from_currency, to_currency, when)
+            chunk = []
+        yield from self._valued(history, chunk, amount, from_currency, to_currency, when)
+
+    @staticmethod
+    def _valued(history, chunk, amount, from_currency, to_currency, when):
+        from stock.models import CENT
+
+        rates = history.rates_as_of((row[from_currency], row[to_currency], row[when]) for row in chunk)
+        for row, rate in zip(chunk, rates):
+            value = (row[amount] * rate).quantize(CENT, rounding=ROUND_HALF_UP) if rate is not None else None
+            yield row + (value,)
+
+
+# Spreadsheets run a cell starting with these as a formula (CSV injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# ... except plain numbers and phone numbers (+25761234567, -12.50), kept as they are for re-imports
+PLAIN_NUMBER = re.compile(r'^[+-]?[\d\s.]+$')
+
+
+def _csv_value(value):
+    """Export value for a CSV cell: text that a spreadsheet would evaluate is prefixed with '"""
+    value = _export_value(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not PLAIN_NUMBER.match(value):
+        return "'" + value
+    return value
+
+
+def _export_value(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).isoformat() if timezone.is_aware(value) else value.isoformat()
+    if value is None:
+        return ''
+    return value
+
+
+class _EchoBuffer:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def iter_export_lines(headers, rows, export_format='csv', chunk_size=None):
+    """
+    Yield the export one line at a time.
+
+    Args:
+        headers (list): Column names
+        rows (QuerySet): values_list queryset from build_export_rows
+        export_format (str): 'csv' or 'jsonl'
+        chunk_size (int, optional): Rows fetched per database round trip
+
+    Yields:
+        str: One CSV or JSON line, newline included
+    """
+    chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+    if export_format == 'jsonl':
+        for row in rows.iterator(chunk_size=chunk_size):
+            record = {header: _export_value(value) if value is not None else None
+                      for header, value in zip(headers, row)}
+            yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+        return
+
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(headers)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield writer.writerow([_csv_value(value) for value in row])
@@ -0,0 +1,216 @@
+"""
+Bulk transfer import from CSV.
+
+The file is parsed row by row and processed in batches: each row goes through
+TransferForm, the commission bracket index is read once per batch to choose
+PENDING or DRAFT (same rule as create_transfer), reference IDs are reserved for
+the whole batch in one sequence update, and transfers, their search trigrams and
+their audit rows are written with one bulk_create each.
+"""
+import csv
+import io
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = ('beneficiary_name', 'beneficiary_phone', 'method', 'amount',
+                  'sent_currency', 'received_currency', 'comment')
+REQUIRED_COLUMNS = ('beneficiary_name', 'beneficiary_phone', 'method', 'amount',
+                    'sent_currency', 'received_currency')
+
+
+class TransferImportError(Exception):
+    """The file as a whole cannot be imported (bad header, too many rows...)"""
+
+
+def _open_text(file_obj):
+    """Wrap an uploaded / binary file for csv without reading it into memory"""
+    if isinstance(file_obj, io.TextIOBase):
+        return file_obj
+    return io.TextIOWrapper(file_obj, encoding='utf-8-sig', newline='')
+
+
+def _iter_batches(reader, batch_size, max_rows):
+    """Yield lists of (line number, row dict) from a DictReader"""
+    batch = []
+    for count, row in enumerate(reader, start=1):
+        if max_rows and count > max_rows:
+            raise TransferImportError(f"Le fichier dépasse la limite de {max_rows} lignes.")
+        batch.append((reader.line_num, row))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _form_errors(form):
+    return [f"{field}: {', '.join(errors)}" if field != '__all__' else ', '.join(errors)
+            for field, errors in form.errors.items()]
+
+
+def _assign_reference_ids(transfers):
+    """
+    Give each transfer a reserved reference ID that no stored transfer uses.
+
+    IDs from the sequence never repeat each other, but legacy random IDs can be
+    anywhere in the space: the taken ones are replaced by fresh IDs, like
+    Transfer.save() retries on a reference_id collision.
+    """
+    from .models import REFERENCE_ID_MAX_ATTEMPTS, Transfer
+    from .reference_ids import generate_reference_ids
+
+    pending = list(transfers)
+    for _attempt in range(REFERENCE_ID_MAX_ATTEMPTS):
+        for transfer, reference_id in zip(pending, generate_reference_ids(len(pending))):
+            transfer.reference_id = reference_id
+
+        taken = set(Transfer.objects.filter(reference_id__in=[transfer.reference_id for transfer in pending])
+                    .values_list('reference_id', flat=True))
+        if not taken:
+            return
+        logger.warning(f"{len(taken)} generated reference IDs already used by legacy transfers, drawing new ones")
+        pending = [transfer for transfer in pending if transfer.reference_id in taken]
+
+    raise TransferImportError(
+            f"Impossible de générer des références uniques après {REFERENCE_ID_MAX_ATTEMPTS} tentatives."
+    )
+
+
+def _import_batch(batch, agent, ip_address):
+    """Validate and insert one batch, returns the report rows"""
+    from users.models import UserActivity
+    from users.signals import build_model_save_activity
+    from .commission_index import get_commission_index
+    from .duplicates import set_fingerprint
+    from .forms import TransferForm
+    from .models import Transfer
+    from .search import index_transfers, set_search_fields
+
+    report = []
+    valid = []
+    index = get_commission_index()
+
+    for line_number, row in batch:
+        data = {column: (row.get(column) or '').strip() for column in IMPORT_COLUMNS}
+        form = TransferForm(data=data)
+        if not form.is_valid():
+            report.append({'line': line_number, 'success': False, 'errors': _form_errors(form)})
+            continue
+
+        transfer = form.save(commit=False)
+        transfer.agent = agent
+        transfer.status = 'PENDING' if index.find(transfer.sent_currency, transfer.amount) else 'DRAFT'
+        set_search_fields(transfer)
+        set_fingerprint(transfer)
+        valid.append((line_number, transfer))
+
+    if not valid:
+        return report
+
+    _assign_reference_ids(transfer for _line, transfer in valid)
+
+    with transaction.atomic():
+        transfers = Transfer.objects.bulk_create([transfer for _line, transfer in valid])
+        index_transfers(transfers)
+
+        activities = []
+        for transfer in transfers:
+            activities.append(build_model_save_activity(transfer, created=True))
+            activities.append(UserActivity(
+                    user=agent,
+                    action='transfer_created' if transfer.status == 'PENDING' else 'transfer_created_as_draft',
+                    details={
+                        'transfer_id': transfer.id,
+                        'reference_id': transfer.reference_id,
+                        'beneficiary': transfer.beneficiary_name,
+                        'amount': str(transfer.amount),
+                        'currency': transfer.sent_currency,
+                        'status': transfer.status,
+                        'commission_config_available': transfer.status == 'PENDING',
+                        'imported': True
+                    },
+                    ip_address=ip_address
+            ))
+        UserActivity.objects.bulk_create([activity for activity in activities if activity])
+
+    for line_number, transfer in valid:
+        report.append({
+            'line': line_number,
+            'success': True,
+            'transfer_id': transfer.id,
+            'reference_id': transfer.reference_id,
+            'status': transfer.status,
+        })
+
+    return report
+
+
+def import_transfers_csv(file_obj, agent, ip_address=None, batch_size=None, max_rows=None):
+    """
+    Import transfers for an agent from a CSV file.
+
+    The header must contain the TransferForm fields (comment is optional). Invalid rows
+    are reported and skipped, valid ones are imported; see the per-row report.
+
+    Args:
+        file_obj: Binary or text file (e.g. request.FILES['file'])
+        agent (User): Agent the transfers are declared for
+        ip_address (str, optional): Stored on the activity rows
+        batch_size (int, optional): Rows validated and inserted together
+        max_rows (int, optional): Reject files with more data rows
+
+    Returns:
+        dict: {'rows': [per-row report sorted by line], 'created', 'pending', 'drafts', 'failed'}
+
+    Raises:
+        TransferImportError: If the file cannot be read as a transfer CSV
+    """
+    from users.services import invalidate_dashboard_cache
+    from .reference_ids import discard_reserved_block
+
+    batch_size = batch_size or getattr(settings, 'TRANSFER_IMPORT_BATCH_SIZE', 1000)
+
+    try:
+        reader = csv.DictReader(_open_text(file_obj))
+        header = [column.strip() for column in (reader.fieldnames or [])]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise TransferImportError(f"Fichier CSV illisible: {e}")
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise TransferImportError(f"Colonnes manquantes: {', '.join(missing)}")
+    reader.fieldnames = header
+
+    rows = []
+    try:
+        # One transaction for the file: a file-level error (e.g. too many rows) imports nothing
+        with transaction.atomic():
+            for batch in _iter_batches(reader, batch_size, max_rows):
+                rows.extend(_import_batch(batch, agent, ip_address))
+    except (TransferImportError, UnicodeDecodeError, csv.Error) as e:
+        # The sequence reservation was rolled back with everything else
+        discard_reserved_block()
+        if isinstance(e, TransferImportError):
+            raise
+        raise TransferImportError(f"Fichier CSV illisible: {e}")
+
+    if rows:
+        # bulk_create sends no signals
+        invalidate_dashboard_cache('transfers')
+
+    created = [row for row in rows if row['success']]
+    result = {
+        'rows': sorted(rows, key=lambda row: row['line']),
+        'created': len(created),
+        'pending': sum(1 for row in created if row['status'] == 'PENDING'),
+        'drafts': sum(1 for row in created if row['status'] == 'DRAFT'),
+        'failed': len(rows) - len(created),
+    }
+
+    logger.info(f"Transfer import for {agent.username}: {result['created']} created "
+                f"({result['drafts']} drafts), {result['failed']} rejected")
+    return result
@@ -0,0 +1,90 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from transfers.models import Transfer
+from transfers.reference_ids import generate_reference_ids
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the cost of Transfer.save() (reference ID generation included) as the transfers "
+        "table grows. Everything runs in one transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--existing', type=int, default=1_000_000,
+                            help="Number of existing transfers to reach (default: 1,000,000)")
+        parser.add_argument('--checkpoints', type=int, default=4,
+                            help="Number of measurement points, spaced by powers of 10 up to --existing")
+        parser.add_argument('--samples', type=int, default=500,
+                            help="Transfer.save() calls measured at each checkpoint")
+        parser.add_argument('--batch-size', type=int, default=10_000,
+                            help="bulk_create batch size used to fill the table")
+
+    def handle(self, *args, **options):
+        existing = options['existing']
+        samples = options['samples']
+        batch_size = options['batch_size']
+
+        checkpoints = sorted({0, existing} | {
+            existing // (10 ** power) for power in range(1, options['checkpoints'])
+        })
+
+        self.stdout.write(f"{'existing':>12} {'avg save (ms)':>14} {'p95 (ms)':>10} {'queries/save':>13}")
+
+        try:
+            with transaction.atomic():
+                inserted = Transfer.objects.count()
+                for checkpoint in checkpoints:
+                    inserted = self._fill(inserted, checkpoint, batch_size)
+                    avg_ms, p95_ms, queries = self._measure(samples)
+                    inserted += samples
+                    self.stdout.write(f"{inserted - samples:>12,} {avg_ms:>14.3f} {p95_ms:>10.3f} {queries:>13.2f}")
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        self.stdout.write(self.style.SUCCESS("Benchmark finished, all rows rolled back."))
+
+    def _fill(self, current, target, batch_size):
+        while current < target:
+            size = min(batch_size, target - current)
+            Transfer.objects.bulk_create([
+                Transfer(reference_id=reference_id, **self._transfer_fields())
+                for reference_id in generate_reference_ids(size)
+            ])
+            current += size
+        return current
+
+    def _measure(self, samples):
+        durations = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(samples):
+                transfer = Transfer(**self._transfer_fields())
+                started = time.perf_counter()
+                transfer.save()
+                durations.append((time.perf_counter() - started) * 1000)
+
+        durations.sort()
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        return sum(durations) / len(durations), p95, len(queries) / samples
+
+    @staticmethod
+    def _transfer_fields():
+        return {
+            'beneficiary_name': 'Benchmark',
+            'beneficiary_phone': '+25700000000',
+            'method': 'CASH',
+            'amount': Decimal('100.00'),
+            'sent_currency': 'EUR',
+            'received_currency': 'BIF',
+            'status': 'DRAFT',
+        }
@@ -0,0 +1,56 @@
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from transfers.exports import EXPORT_FORMATS, EXPORT_KINDS, build_export_rows, iter_export_lines, parse_export_filters
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream transfers or commission distributions to CSV / JSON Lines. "
+        "Rows are read in chunks, so memory use does not grow with the export size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORT_KINDS), help="What to export")
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', '-o', default='-', help="Output file (default: stdout)")
+        parser.add_argument('--date-from', help="First day included (YYYY-MM-DD)")
+        parser.add_argument('--date-to', help="Last day included (YYYY-MM-DD)")
+        parser.add_argument('--status', help="Transfer status (e.g. COMPLETED)")
+        parser.add_argument('--agent', help="Agent user id")
+        parser.add_argument('--currency', help="Sent currency (EUR, BIF, USD)")
+        parser.add_argument('--chunk-size', type=int, default=None, help="Rows fetched per database round trip")
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters({
+                'date_from': options['date_from'],
+                'date_to': options['date_to'],
+                'status': options['status'],
+                'agent': options['agent'],
+                'currency': options['currency'],
+            })
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+        headers, rows = build_export_rows(options['kind'], filters)
+        lines = iter_export_lines(headers, rows, options['export_format'], options['chunk_size'])
+
+        if options['output'] == '-':
+            output = sys.stdout
+            written = self._write(lines, output)
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                written = self._write(lines, output)
+
+        self.stderr.write(self.style.SUCCESS(f"{written} lines written."))
+
+    @staticmethod
+    def _write(lines, output):
+        written = 0
+        for line in lines:
+            output.write(line)
+            written += 1
+        return written
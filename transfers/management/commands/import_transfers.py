@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transfers.imports import TransferImportError, import_transfers_csv
+from users.models import User
+from users.signals import set_current_user
+
+
+class Command(BaseCommand):
+    help = "Import transfers from a CSV file (TransferForm columns), declared for the given agent."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file to import")
+        parser.add_argument('--agent', required=True, help="Username of the agent declaring the transfers")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows validated and inserted together")
+
+    def handle(self, *args, **options):
+        try:
+            agent = User.objects.get(username=options['agent'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['agent']}")
+
+        # Attribute the audit trail to the agent, as the web import does
+        set_current_user(agent)
+        try:
+            with open(options['path'], 'rb') as csv_file:
+                result = import_transfers_csv(csv_file, agent, batch_size=options['batch_size'])
+        except TransferImportError as e:
+            raise CommandError(str(e))
+        finally:
+            set_current_user(None)
+
+        for row in result['rows']:
+            if not row['success']:
+                self.stderr.write(f"Line {row['line']}: {'; '.join(row['errors'])}")
+
+        self.stdout.write(self.style.SUCCESS(
+                f"{result['created']} transfers imported ({result['pending']} pending, {result['drafts']} drafts), "
+                f"{result['failed']} rows rejected."
+        ))
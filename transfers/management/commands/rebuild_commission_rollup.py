@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from transfers.commission_rollup import rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily CommissionRollup table from CommissionDistribution. "
+        "Runs in one transaction; use it after data fixes done outside the ORM."
+    )
+
+    def handle(self, *args, **options):
+        rows = rebuild_rollup()
+        self.stdout.write(self.style.SUCCESS(f"Commission rollup rebuilt: {rows} daily rows."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from transfers.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the normalized beneficiary columns and the search trigram table of every transfer. "
+        "Run it once after deploying the search columns, and after data fixes done outside the ORM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Transfers per transaction")
+
+    def handle(self, *args, **options):
+        transfers, trigrams = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt: {transfers} transfers, {trigrams} trigrams."))
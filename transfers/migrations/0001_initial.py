@@ -0,0 +1,128 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommissionConfig',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Montant minimum')),
+                ('max_amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Montant maximum')),
+                ('commission_amount', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Montant de commission')),
+                ('agent_share', models.DecimalField(decimal_places=2, max_digits=5, verbose_name='Part agent (%)')),
+                ('currency', models.CharField(choices=[('EUR', 'Euro'), ('BIF', 'Franc Burundais'), ('USD', 'Dollars')], max_length=3, verbose_name='Devise')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Créé le')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Modifié le')),
+                ('active', models.BooleanField(default=True, verbose_name='Actif')),
+                ('manager', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Manager')),
+            ],
+            options={
+                'verbose_name': 'Configuration de Commission',
+                'verbose_name_plural': 'Configurations de Commission',
+                'ordering': ['currency', 'min_amount'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Transfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_id', models.CharField(editable=False, max_length=9, unique=True, verbose_name='Référence')),
+                ('beneficiary_name', models.CharField(max_length=100, verbose_name='Nom du bénéficiaire')),
+                ('beneficiary_phone', models.CharField(max_length=20, verbose_name='Téléphone du bénéficiaire')),
+                ('method', models.CharField(choices=[('CASH', 'Cash'), ('LUMICASH', 'Lumicash'), ('ECOCASH', 'Ecocash')], max_length=50, verbose_name='Méthode de retrait')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Montant')),
+                ('sent_currency', models.CharField(choices=[('EUR', 'Euro'), ('BIF', 'Franc Burundais'), ('USD', 'Dollars')], max_length=3, verbose_name='Devise envoyée')),
+                ('received_currency', models.CharField(choices=[('EUR', 'Euro'), ('BIF', 'Franc Burundais'), ('USD', 'Dollars')], max_length=3, verbose_name='Devise reçue')),
+                ('comment', models.TextField(blank=True, null=True, verbose_name='Commentaire')),
+                ('status', models.CharField(choices=[('DRAFT', 'Brouillon'), ('PENDING', 'En attente'), ('VALIDATED', 'Validé'), ('COMPLETED', 'Complété'), ('CANCELED', 'Annulé')], default='DRAFT', max_length=10, verbose_name='Statut')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Créé le')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Modifié le')),
+                ('validated_at', models.DateTimeField(blank=True, null=True, verbose_name='Validé le')),
+                ('validation_comment', models.TextField(blank=True, null=True, verbose_name='Commentaire de validation')),
+                ('executed_at', models.DateTimeField(blank=True, null=True, verbose_name='Exécuté le')),
+                ('execution_comment', models.TextField(blank=True, null=True, verbose_name="Commentaire d'exécution")),
+                ('agent', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transfers_made', to=settings.AUTH_USER_MODEL, verbose_name='Agent')),
+                ('executed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='executed_transfers', to=settings.AUTH_USER_MODEL, verbose_name='Exécuté par')),
+                ('validated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='validated_transfers', to=settings.AUTH_USER_MODEL, verbose_name='Validé par')),
+            ],
+            options={
+                'verbose_name': 'Transfer',
+                'verbose_name_plural': 'Transfers',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CommissionDistribution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_commission', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Commission totale')),
+                ('declaring_agent_amount', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Montant agent')),
+                ('manager_amount', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Montant manager')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Créé le')),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commission_earnings', to=settings.AUTH_USER_MODEL, verbose_name='Agent')),
+                ('config_used', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='transfers.commissionconfig', verbose_name='Configuration utilisée')),
+                ('transfer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='commission', to='transfers.transfer', verbose_name='Transfer')),
+            ],
+            options={
+                'verbose_name': 'Distribution de Commission',
+                'verbose_name_plural': 'Distributions de Commission',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='commissionconfig',
+            constraint=models.CheckConstraint(condition=models.Q(('agent_share__gte', 0), ('agent_share__lte', 100)), name='valid_agent_share'),
+        ),
+        migrations.AddConstraint(
+            model_name='commissionconfig',
+            constraint=models.CheckConstraint(condition=models.Q(('commission_amount__gte', 0.01)), name='valid_commission_amount'),
+        ),
+        migrations.AddConstraint(
+            model_name='commissionconfig',
+            constraint=models.CheckConstraint(condition=models.Q(('min_amount__lte', models.F('max_amount'))), name='valid_amount_range'),
+        ),
+        migrations.AddConstraint(
+            model_name='commissionconfig',
+            constraint=models.UniqueConstraint(condition=models.Q(('active', True)), fields=('manager', 'min_amount', 'max_amount', 'currency'), name='unique_active_config_range'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['reference_id'], name='transfers_t_referen_bd4b5b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['status', '-created_at'], name='transfers_t_status_848455_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['agent', '-created_at'], name='transfers_t_agent_i_cf672f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['validated_by', '-created_at'], name='transfers_t_validat_f5f418_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commissiondistribution',
+            index=models.Index(fields=['agent', '-created_at'], name='transfers_c_agent_i_871603_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commissiondistribution',
+            index=models.Index(fields=['-created_at'], name='transfers_c_created_b12c7f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commissiondistribution',
+            index=models.Index(fields=['transfer'], name='transfers_c_transfe_af8082_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0002_referencesequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoPromotionTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('QUEUED', 'En file'), ('RUNNING', 'En cours'), ('COMPLETED', 'Terminé'), ('FAILED', 'Échoué')], default='QUEUED', max_length=10, verbose_name='Statut')),
+                ('total_count', models.PositiveIntegerField(default=0, verbose_name='Transferts trouvés')),
+                ('processed_count', models.PositiveIntegerField(default=0, verbose_name='Transferts traités')),
+                ('promoted_count', models.PositiveIntegerField(default=0, verbose_name='Transferts promus')),
+                ('failed_count', models.PositiveIntegerField(default=0, verbose_name='Échecs')),
+                ('failed_transfers', models.JSONField(blank=True, default=list, verbose_name='Transferts en échec')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Erreur')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Créé le')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Démarré le')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Terminé le')),
+                ('commission_config', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='promotion_tasks', to='transfers.commissionconfig', verbose_name='Configuration de commission')),
+                ('triggered_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Déclenché par')),
+            ],
+            options={
+                'verbose_name': "Tâche d'auto-promotion",
+                'verbose_name_plural': "Tâches d'auto-promotion",
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['commission_config', '-created_at'], name='transfers_a_commiss_e60e22_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0003_autopromotiontask'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommissionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Jour')),
+                ('currency', models.CharField(choices=[('EUR', 'Euro'), ('BIF', 'Franc Burundais'), ('USD', 'Dollars')], max_length=3, verbose_name='Devise')),
+                ('distribution_count', models.IntegerField(default=0, verbose_name='Nombre de commissions')),
+                ('total_commission', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Commission totale')),
+                ('declaring_agent_amount', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Montant agent')),
+                ('manager_amount', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Montant manager')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Mis à jour le')),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commission_rollups', to=settings.AUTH_USER_MODEL, verbose_name='Agent')),
+            ],
+            options={
+                'verbose_name': 'Cumul journalier de commissions',
+                'verbose_name_plural': 'Cumuls journaliers de commissions',
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['agent', '-day'], name='transfers_c_agent_i_129792_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'agent', 'currency'), name='unique_commission_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BACKFILL_CHUNK_SIZE = 2000
+
+# Frozen copy of the transfers.search normalization as of this migration: later
+# changes to the live rules must not change what this backfill did
+_APOSTROPHES = re.compile(r"['’`]")
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_NON_DIGIT = re.compile(r'\D+')
+
+
+def normalize_name(value):
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+    return _NON_ALNUM.sub(' ', _APOSTROPHES.sub('', folded)).strip()
+
+
+def normalize_phone(value):
+    if not value:
+        return ''
+    return _NON_DIGIT.sub('', str(value))
+
+
+def name_trigrams(search_name):
+    padded = ' ' + search_name
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def fill_search_index(apps, schema_editor):
+    Transfer = apps.get_model('transfers', 'Transfer')
+    TransferSearchTrigram = apps.get_model('transfers', 'TransferSearchTrigram')
+
+    # Keyset over the primary key: bounded memory whatever the table size
+    last_id = 0
+    while True:
+        transfers = list(Transfer.objects.filter(pk__gt=last_id)
+                         .order_by('pk')
+                         .only('pk', 'beneficiary_name', 'beneficiary_phone')[:BACKFILL_CHUNK_SIZE])
+        if not transfers:
+            break
+
+        grams = []
+        for transfer in transfers:
+            transfer.search_name = normalize_name(transfer.beneficiary_name)
+            transfer.search_phone = normalize_phone(transfer.beneficiary_phone)
+            transfer.search_phone_reversed = transfer.search_phone[::-1]
+            grams.extend(TransferSearchTrigram(transfer_id=transfer.pk, trigram=gram)
+                         for gram in name_trigrams(transfer.search_name))
+        Transfer.objects.bulk_update(transfers, ['search_name', 'search_phone', 'search_phone_reversed'])
+        TransferSearchTrigram.objects.bulk_create(grams, batch_size=1000)
+        last_id = transfers[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0004_commissionrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferSearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3, verbose_name='Trigramme')),
+            ],
+            options={
+                'verbose_name': 'Trigramme de recherche',
+                'verbose_name_plural': 'Trigrammes de recherche',
+            },
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Nom normalisé'),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='search_phone',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20, verbose_name='Téléphone normalisé'),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='search_phone_reversed',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20, verbose_name='Téléphone normalisé inversé'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['-created_at', '-id'], name='transfers_t_created_b60830_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['search_name'], name='transfers_t_search__fdf0e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['search_phone'], name='transfers_t_search__289356_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['search_phone_reversed'], name='transfers_t_search__ca7199_idx'),
+        ),
+        migrations.AddField(
+            model_name='transfersearchtrigram',
+            name='transfer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_trigrams', to='transfers.transfer', verbose_name='Transfert'),
+        ),
+        migrations.AddIndex(
+            model_name='transfersearchtrigram',
+            index=models.Index(fields=['trigram', 'transfer'], name='transfers_t_trigram_617840_idx'),
+        ),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
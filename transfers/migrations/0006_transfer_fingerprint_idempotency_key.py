@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0005_transfer_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64, verbose_name='Empreinte'),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name="Clé d'idempotence"),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['fingerprint', '-created_at'], name='transfers_t_fingerp_fcbf9a_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='transfer',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('agent', 'idempotency_key'), name='unique_transfer_idempotency_key'),
+        ),
+    ]
@@ -1,11 +1,14 @@
-import random
-
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .duplicates import set_fingerprint
+from .reference_ids import discard_reserved_block, generate_reference_id
+from .search import set_search_fields
+
 User = get_user_model()
 
 CURRENCY_CHOICES = [
@@ -28,29 +31,30 @@ TRANSFER_STATUS = [
     ('CANCELED', 'Annulé'),
 ]
 
+PROMOTION_TASK_STATUS = [
+    ('QUEUED', 'En file'),
+    ('RUNNING', 'En cours'),
+    ('COMPLETED', 'Terminé'),
+    ('FAILED', 'Échoué'),
+]
 
-def _generate_reference_id():
-    """Generate unique reference ID in format NNNN-AAAA (numbers-letters)"""
-    numbers = '23456789'  # Exclude 0,1 for clarity
-    letters = 'ABCDEFGHJKLMNPQRSTUVWXYZ'  # Exclude I,O for clarity
 
-    max_attempts = 100  # Safety net to avoid infinite loops
-    attempts = 0
+REFERENCE_ID_MAX_ATTEMPTS = 5  # Safety net against collisions with legacy random IDs
 
-    while attempts < max_attempts:
-        # 4 numbers + dash + 4 letters = 2M9L-XK7P format
-        num_part = ''.join(random.choices(numbers, k=4))
-        letter_part = ''.join(random.choices(letters, k=4))
-        ref_id = f"{num_part}-{letter_part}"
 
-        # Check uniqueness
-        if not Transfer.objects.filter(reference_id=ref_id).exists():
-            return ref_id
+class ReferenceSequence(models.Model):
+    """
+    Database-backed counter feeding the reference ID permutation (see reference_ids.py)
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
 
-        attempts += 1
+    class Meta:
+        verbose_name = "Séquence de référence"
+        verbose_name_plural = "Séquences de référence"
 
-    # If we somehow can't generate a unique ID, raise an exception
-    raise ValidationError("Unable to generate unique reference ID after 100 attempts")
+    def __str__(self):
+        return f"{self.name}: {self.value}"
 
 
 class Transfer(models.Model):
@@ -96,25 +100,71 @@ class Transfer(models.Model):
     executed_at = models.DateTimeField(null=True, blank=True, verbose_name="Exécuté le")
     execution_comment = models.TextField(blank=True, null=True, verbose_name="Commentaire d'exécution")
 
+    # Normalized copies of the beneficiary fields for indexed search (see search.py)
+    search_name = models.CharField(max_length=100, blank=True, default='', editable=False,
+                                   verbose_name="Nom normalisé")
+    search_phone = models.CharField(max_length=20, blank=True, default='', editable=False,
+                                    verbose_name="Téléphone normalisé")
+    search_phone_reversed = models.CharField(max_length=20, blank=True, default='', editable=False,
+                                             verbose_name="Téléphone normalisé inversé")
+
+    # Duplicate detection (see duplicates.py)
+    fingerprint = models.CharField(max_length=64, blank=True, default='', editable=False,
+                                   verbose_name="Empreinte")
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False,
+                                       verbose_name="Clé d'idempotence")
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['reference_id']),
+            models.Index(fields=['-created_at', '-id']),
             models.Index(fields=['status', '-created_at']),
             models.Index(fields=['agent', '-created_at']),
             models.Index(fields=['validated_by', '-created_at']),
+            models.Index(fields=['search_name']),
+            models.Index(fields=['search_phone']),
+            models.Index(fields=['search_phone_reversed']),
+            models.Index(fields=['fingerprint', '-created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                    fields=['agent', 'idempotency_key'],
+                    condition=Q(idempotency_key__isnull=False),
+                    name='unique_transfer_idempotency_key'
+            ),
         ]
         verbose_name = "Transfer"
         verbose_name_plural = "Transfers"
 
     def save(self, *args, **kwargs):
-        if not self.reference_id:
-            self.reference_id = _generate_reference_id()
-        super().save(*args, **kwargs)
+        set_fingerprint(self)
+        indexed_name = self.search_name
+        set_search_fields(self)
+        # Read by the post_save signal that rewrites the search trigrams
+        self._search_changed = self._state.adding or indexed_name != self.search_name
+
+        if self.reference_id:
+            return super().save(*args, **kwargs)
+
+        # Generated IDs never repeat; the unique constraint only catches legacy random IDs
+        for attempt in range(REFERENCE_ID_MAX_ATTEMPTS):
+            self.reference_id = generate_reference_id()
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError as e:
+                if 'reference_id' not in str(e):
+                    raise
+                self.reference_id = ''
+                discard_reserved_block()
+
+        raise ValidationError(f"Unable to generate unique reference ID after {REFERENCE_ID_MAX_ATTEMPTS} attempts")
 
     def clean(self):
         """Validation rules for transfers"""
-        if self.amount <= 0:
+        # amount is None when its own field failed validation (e.g. "abc" in an import)
+        if self.amount is not None and self.amount <= 0:
             raise ValidationError("Le montant doit être positif.")
 
         # Business rule validations
@@ -130,6 +180,52 @@ class Transfer(models.Model):
         """Check if the user can execute this transfer"""
         return user.is_manager() and self.status == 'VALIDATED'
 
+    def transition(self, from_status, to_status, **fields):
+        """
+        Compare-and-set status change: UPDATE ... WHERE id = ? AND status = from_status.
+
+        Only the status, updated_at and the given columns are written, and no save signal
+        is sent (callers log the business action themselves). Of several concurrent
+        requests for the same transition exactly one wins.
+
+        Args:
+            from_status (str): Status the transfer must still have
+            to_status (str): New status
+            **fields: Other columns to write with the transition (e.g. validated_by)
+
+        Returns:
+            bool: True if this call made the transition. Otherwise the instance's status
+            is refreshed from the database so callers can report it.
+        """
+        values = {'status': to_status, 'updated_at': timezone.now(), **fields}
+        won = Transfer.objects.filter(pk=self.pk, status=from_status).update(**values) == 1
+
+        if won:
+            for field, value in values.items():
+                setattr(self, field, value)
+
+            from users.services import invalidate_dashboard_cache
+            invalidate_dashboard_cache('transfers')
+        else:
+            self.refresh_from_db(fields=['status'])
+
+        return won
+
+    def validate(self, user, comment=''):
+        """PENDING -> VALIDATED, see transition()"""
+        return self.transition('PENDING', 'VALIDATED', validated_by=user, validated_at=timezone.now(),
+                               validation_comment=comment)
+
+    def reject(self, user, comment=''):
+        """PENDING -> CANCELED, see transition()"""
+        return self.transition('PENDING', 'CANCELED', validated_by=user, validated_at=timezone.now(),
+                               validation_comment=comment)
+
+    def execute(self, user, comment=''):
+        """VALIDATED -> COMPLETED, see transition()"""
+        return self.transition('VALIDATED', 'COMPLETED', executed_by=user, executed_at=timezone.now(),
+                               execution_comment=comment)
+
     def can_be_promoted_by(self, user):
         """Check if the user can promote transfer from DRAFT to PENDING"""
         # Agents can promote their own drafts, managers can promote any drafts
@@ -141,14 +237,15 @@ class Transfer(models.Model):
 
         return self.agent == user
 
+    def get_commission_config(self, manager_id=None):
+        """Get the active commission config applying to this transfer (served from the bracket index)"""
+        from .commission_index import find_commission_config
+
+        return find_commission_config(self.sent_currency, self.amount, manager_id=manager_id)
+
     def has_commission_config_available(self):
         """Check if commission config exists for this transfer"""
-        return CommissionConfig.objects.filter(
-                currency=self.sent_currency,
-                min_amount__lte=self.amount,
-                max_amount__gte=self.amount,
-                active=True
-        ).exists()
+        return self.get_commission_config() is not None
 
     def promote_to_pending(self, promoted_by=None):
         """Promote transfer from DRAFT to PENDING if commission config available"""
@@ -159,16 +256,8 @@ class Transfer(models.Model):
                     )
             )
 
-        if not self.has_commission_config_available():
-            raise ValidationError(_("Aucune configration de commission dispo pour ce transfert"))
-
         # Get the commission config for this transfer
-        commission_config = CommissionConfig.objects.filter(
-                currency=self.sent_currency,
-                min_amount__lte=self.amount,
-                max_amount__gte=self.amount,
-                active=True
-        ).first()
+        commission_config = self.get_commission_config()
 
         if not commission_config:
             raise ValidationError(_("Aucune configration de commission dispo pour ce transfert"))
@@ -370,3 +459,115 @@ class CommissionDistribution(models.Model):
 
     def __str__(self):
         return f"Commission Transfer {self.transfer.reference_id} - Agent: {self.declaring_agent_amount}, Manager: {self.manager_amount}"
+
+
+class CommissionRollup(models.Model):
+    """
+    Daily commission totals per agent and currency, maintained incrementally
+    from CommissionDistribution creations and deletions (see transfers/commission_rollup.py)
+    """
+    day = models.DateField(verbose_name="Jour")
+    agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='commission_rollups', verbose_name="Agent")
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, verbose_name="Devise")
+
+    distribution_count = models.IntegerField(default=0, verbose_name="Nombre de commissions")
+    total_commission = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name="Commission totale")
+    declaring_agent_amount = models.DecimalField(max_digits=14, decimal_places=4, default=0,
+                                                 verbose_name="Montant agent")
+    manager_amount = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name="Montant manager")
+
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Mis à jour le")
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'agent', 'currency'], name='unique_commission_rollup_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['agent', '-day']),
+        ]
+        verbose_name = "Cumul journalier de commissions"
+        verbose_name_plural = "Cumuls journaliers de commissions"
+
+    def __str__(self):
+        return f"{self.day} {self.agent} {self.currency}: {self.total_commission}"
+
+
+class TransferSearchTrigram(models.Model):
+    """
+    One distinct 3-character gram of a transfer's normalized beneficiary name (see search.py)
+    """
+    transfer = models.ForeignKey(Transfer, on_delete=models.CASCADE, related_name='search_trigrams',
+                                 verbose_name="Transfert")
+    trigram = models.CharField(max_length=3, verbose_name="Trigramme")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trigram', 'transfer']),
+        ]
+        verbose_name = "Trigramme de recherche"
+        verbose_name_plural = "Trigrammes de recherche"
+
+    def __str__(self):
+        return f"{self.trigram} -> {self.transfer_id}"
+
+
+class AutoPromotionTask(models.Model):
+    """
+    Progress of a background auto-promotion run, started when a CommissionConfig is created or activated
+    """
+    commission_config = models.ForeignKey(CommissionConfig, on_delete=models.CASCADE, related_name='promotion_tasks',
+                                          verbose_name="Configuration de commission")
+    triggered_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                     verbose_name="Déclenché par")
+    status = models.CharField(max_length=10, choices=PROMOTION_TASK_STATUS, default='QUEUED', verbose_name="Statut")
+
+    total_count = models.PositiveIntegerField(default=0, verbose_name="Transferts trouvés")
+    processed_count = models.PositiveIntegerField(default=0, verbose_name="Transferts traités")
+    promoted_count = models.PositiveIntegerField(default=0, verbose_name="Transferts promus")
+    failed_count = models.PositiveIntegerField(default=0, verbose_name="Échecs")
+    failed_transfers = models.JSONField(default=list, blank=True, verbose_name="Transferts en échec")
+    error = models.TextField(blank=True, null=True, verbose_name="Erreur")
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Créé le")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Démarré le")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Terminé le")
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['commission_config', '-created_at']),
+        ]
+        verbose_name = "Tâche d'auto-promotion"
+        verbose_name_plural = "Tâches d'auto-promotion"
+
+    @property
+    def is_finished(self):
+        return self.status in ('COMPLETED', 'FAILED')
+
+    @property
+    def progress_percent(self):
+        """Share of matching drafts already processed"""
+        if self.is_finished:
+            return 100
+        if not self.total_count:
+            return 0
+        return min(100, int(self.processed_count * 100 / self.total_count))
+
+    def as_status_dict(self):
+        """Status payload for AJAX polling"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'total': self.total_count,
+            'processed': self.processed_count,
+            'promoted': self.promoted_count,
+            'failed': self.failed_count,
+            'progress_percent': self.progress_percent,
+            'error': self.error,
+            'finished': self.is_finished,
+        }
+
+    def __str__(self):
+        return f"Auto-promotion config {self.commission_config_id} - {self.get_status_display()} ({self.processed_count}/{self.total_count})"
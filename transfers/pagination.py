@@ -0,0 +1,139 @@
+"""
+Keyset (cursor) pagination for transfer lists.
+
+Pages are ordered by (-created_at, -id) and each page starts right after the last row
+of the previous one, so fetching page 500 costs the same as page 1 and no COUNT(*) is
+ever run. Cursors are signed, opaque tokens carrying the boundary row's (created_at, id).
+"""
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'transfers.pagination.cursor'
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def _make_token(row, direction):
+    return signing.dumps({'c': row.created_at.isoformat(), 'i': row.id, 'd': direction}, salt=CURSOR_SALT)
+
+
+def _read_token(token):
+    """Decode a cursor token, returns (created_at, id, direction) or None if invalid"""
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        direction = data['d'] if data['d'] in (NEXT, PREVIOUS) else NEXT
+        return datetime.datetime.fromisoformat(data['c']), int(data['i']), direction
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+def get_page_size(request):
+    """Page size from the `page_size` GET parameter, bounded by settings"""
+    default = getattr(settings, 'TRANSFERS_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'TRANSFERS_MAX_PAGE_SIZE', 200)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+class KeysetPage:
+    """One page of rows plus the tokens to reach its neighbours"""
+
+    def __init__(self, items, next_token=None, prev_token=None, page_size=None):
+        self.items = items
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.page_size = page_size
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_token is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_prev
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def paginate_by_keyset(queryset, token=None, page_size=50):
+    """
+    Get one page of a queryset ordered by (-created_at, -id).
+
+    Only page_size + 1 rows are fetched: the extra row tells whether there is a page
+    beyond this one. Invalid or tampered tokens fall back to the first page.
+
+    Args:
+        queryset (QuerySet): Rows with created_at and id fields (any existing ordering is replaced)
+        token (str, optional): Cursor token from a previous page
+        page_size (int): Rows per page
+
+    Returns:
+        KeysetPage: The rows of the page and the next/prev tokens
+    """
+    cursor = _read_token(token)
+
+    if cursor is None:
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return KeysetPage(
+                rows,
+                next_token=_make_token(rows[-1], NEXT) if has_more else None,
+                page_size=page_size
+        )
+
+    created_at, row_id, direction = cursor
+
+    if direction == NEXT:
+        # Rows strictly older than the cursor row
+        rows = list(
+                queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=row_id))
+                .order_by('-created_at', '-id')[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return KeysetPage(
+                rows,
+                next_token=_make_token(rows[-1], NEXT) if has_more and rows else None,
+                prev_token=_make_token(rows[0], PREVIOUS) if rows else None,
+                page_size=page_size
+        )
+
+    # Rows strictly newer than the cursor row, walked backwards then put back in display order
+    rows = list(
+            queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=row_id))
+            .order_by('created_at', 'id')[:page_size + 1]
+    )
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    rows.reverse()
+    return KeysetPage(
+            rows,
+            next_token=_make_token(rows[-1], NEXT) if rows else None,
+            prev_token=_make_token(rows[0], PREVIOUS) if has_more and rows else None,
+            page_size=page_size
+    )
+
+
+def paginate_request(request, queryset):
+    """Paginate a queryset with the `cursor` and `page_size` GET parameters"""
+    return paginate_by_keyset(queryset, request.GET.get('cursor'), get_page_size(request))
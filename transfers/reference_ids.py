@@ -0,0 +1,144 @@
+"""
+Reference ID generation for transfers.
+
+Reference IDs look like 2M9L-XK7P: 4 digits from '23456789' and 4 letters from
+'ABCDEFGHJKLMNPQRSTUVWXYZ', a keyspace of 8^4 * 24^4 (~1.36 billion) values.
+
+Instead of drawing random IDs and checking each one against the database, we number
+transfers with a database-backed sequence and map each number through a keyed
+permutation of the keyspace (a mixed-radix Feistel network). Distinct numbers always
+give distinct IDs, so no lookup is needed; the unique constraint on
+Transfer.reference_id stays as the safety net for IDs issued by the old random
+generator.
+"""
+import hashlib
+import hmac
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+NUMBERS = '23456789'  # Exclude 0,1 for clarity
+LETTERS = 'ABCDEFGHJKLMNPQRSTUVWXYZ'  # Exclude I,O for clarity
+
+NUMBERS_SPACE = len(NUMBERS) ** 4  # 4096
+LETTERS_SPACE = len(LETTERS) ** 4  # 331776
+KEYSPACE = NUMBERS_SPACE * LETTERS_SPACE
+
+FEISTEL_ROUNDS = 8  # Must stay even so both halves end up in their own radix
+SEQUENCE_NAME = 'transfer_reference'
+
+# Process-local block of reserved sequence numbers: [next, end)
+_block = {'next': 0, 'end': 0}
+_lock = threading.Lock()
+
+
+def _round_value(key, round_number, value, modulus):
+    digest = hmac.new(key, f'{round_number}:{value}'.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], 'big') % modulus
+
+
+def permute(number, key=None):
+    """
+    Map a sequence number to a position in the reference keyspace.
+    The mapping is a bijection on [0, KEYSPACE) for a given key.
+
+    Args:
+        number (int): Sequence number
+        key (bytes, optional): Permutation key, defaults to settings.TRANSFER_REFERENCE_KEY
+
+    Returns:
+        tuple: (numbers_part, letters_part) with 0 <= numbers_part < 4096 and 0 <= letters_part < 331776
+    """
+    key = key if key is not None else _get_key()
+    number %= KEYSPACE
+
+    # Each round turns (a mod m, b mod n) into (b mod n, a + F(b) mod m), swapping the radices
+    left, right = number // LETTERS_SPACE, number % LETTERS_SPACE
+    moduli = (NUMBERS_SPACE, LETTERS_SPACE)
+
+    for round_number in range(FEISTEL_ROUNDS):
+        left_modulus = moduli[round_number % 2]
+        left, right = right, (left + _round_value(key, round_number, right, left_modulus)) % left_modulus
+
+    return left, right
+
+
+def format_reference_id(numbers_part, letters_part):
+    """Format the two keyspace coordinates as NNNN-AAAA"""
+    digits = []
+    for _ in range(4):
+        numbers_part, index = divmod(numbers_part, len(NUMBERS))
+        digits.append(NUMBERS[index])
+
+    letters = []
+    for _ in range(4):
+        letters_part, index = divmod(letters_part, len(LETTERS))
+        letters.append(LETTERS[index])
+
+    return f"{''.join(reversed(digits))}-{''.join(reversed(letters))}"
+
+
+def _get_key():
+    key = getattr(settings, 'TRANSFER_REFERENCE_KEY', None) or settings.SECRET_KEY or ''
+    return key.encode() if isinstance(key, str) else key
+
+
+def _reserve_block(size):
+    """Reserve `size` sequence numbers with a single conditional increment"""
+    from .models import ReferenceSequence
+
+    with transaction.atomic():
+        updated = ReferenceSequence.objects.filter(name=SEQUENCE_NAME).update(value=F('value') + size)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    ReferenceSequence.objects.create(name=SEQUENCE_NAME, value=size)
+            except IntegrityError:
+                # Another process created the row first
+                ReferenceSequence.objects.filter(name=SEQUENCE_NAME).update(value=F('value') + size)
+
+        end = ReferenceSequence.objects.filter(name=SEQUENCE_NAME).values_list('value', flat=True).get()
+
+    return end - size, end
+
+
+def next_sequence_numbers(count=1):
+    """
+    Take `count` sequence numbers, reserving a new block from the database when the
+    local one runs out.
+
+    Returns:
+        list: Sequence numbers, unique across processes
+    """
+    block_size = max(getattr(settings, 'TRANSFER_REFERENCE_BLOCK_SIZE', 20), 1)
+    numbers = []
+
+    with _lock:
+        while len(numbers) < count:
+            if _block['next'] >= _block['end']:
+                _block['next'], _block['end'] = _reserve_block(max(block_size, count - len(numbers)))
+
+            take = min(count - len(numbers), _block['end'] - _block['next'])
+            numbers.extend(range(_block['next'], _block['next'] + take))
+            _block['next'] += take
+
+    return numbers
+
+
+def discard_reserved_block():
+    """Forget the local block (e.g. after a collision, in case its reservation was rolled back)"""
+    with _lock:
+        _block['next'] = _block['end'] = 0
+
+
+def generate_reference_ids(count):
+    """Generate `count` unique reference IDs without querying the transfers table"""
+    key = _get_key()
+    return [format_reference_id(*permute(number, key)) for number in next_sequence_numbers(count)]
+
+
+def generate_reference_id():
+    """Generate one unique reference ID in format NNNN-AAAA (numbers-letters)"""
+    return generate_reference_ids(1)[0]
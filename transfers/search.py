@@ -0,0 +1,212 @@
+"""
+Indexed beneficiary search.
+
+Each transfer keeps normalized, indexed copies of its beneficiary fields:
+search_name (accents folded, lowercase, punctuation collapsed to single spaces),
+search_phone (digits only) and search_phone_reversed (the same digits backwards,
+so "ends with" is also a prefix). A query is matched in three ways:
+
+- Prefix: a range scan on the column (term <= value < term + U+FFFF). This form uses
+  the B-tree index on every backend; LIKE 'x%' does not on SQLite. Phones match on
+  their first or last digits.
+- Name substring: TransferSearchTrigram stores the distinct 3-character grams of
+  search_name, padded with a leading space so ' ni' marks a word starting with 'ni'
+  and two-character queries can match any word. Candidates are the transfers having
+  the two rarest grams of the term, then checked with a contains on the column, so
+  a gram coincidence never becomes a false match. Digits have too few grams to
+  narrow anything, so phones are not in the trigram table.
+- Dense terms: every index path starts with a probe counting at most
+  DENSE_PROBE_LIMIT entries. A term that reaches it (and, for substrings, is short
+  enough that every gram is used) matches a large share of the table; it is then
+  tested while walking the newest transfers, which fills a page after a few hundred
+  rows instead of collecting and sorting every match.
+
+Transfer.save() fills the columns and a post_save signal rewrites the grams. Bulk
+paths call set_search_fields() before bulk_create and index_transfers() after it.
+"""
+import logging
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_SIZE = 3
+PREFIX_UPPER_BOUND = '\uffff'
+QUERY_TRIGRAMS = 2  # Candidates are verified anyway, the two rarest grams are enough to narrow them
+DENSE_PROBE_LIMIT = 5000
+
+_APOSTROPHES = re.compile(r"['’`]")
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_NON_DIGIT = re.compile(r'\D+')
+_LETTER = re.compile(r'[^\W\d_]')
+
+
+def normalize_name(value):
+    """'  Jean-Éric N'DAYÉ ' -> 'jean eric ndaye'"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+    return _NON_ALNUM.sub(' ', _APOSTROPHES.sub('', folded)).strip()
+
+
+def normalize_phone(value):
+    """'+257 79-12 34 56' -> '25779123456'"""
+    if not value:
+        return ''
+    return _NON_DIGIT.sub('', str(value))
+
+
+def trigrams(value):
+    """Distinct 3-character grams of a normalized value"""
+    return {value[i:i + TRIGRAM_SIZE] for i in range(len(value) - TRIGRAM_SIZE + 1)}
+
+
+def name_trigrams(search_name):
+    return trigrams(' ' + search_name)
+
+
+def set_search_fields(transfer):
+    """Fill the normalized columns from the beneficiary fields (no save)"""
+    transfer.search_name = normalize_name(transfer.beneficiary_name)
+    transfer.search_phone = normalize_phone(transfer.beneficiary_phone)
+    transfer.search_phone_reversed = transfer.search_phone[::-1]
+
+
+def index_transfers(transfers, replace=False):
+    """
+    Write the trigram rows of the given (saved) transfers.
+
+    Args:
+        transfers: Transfers with search_name filled
+        replace (bool): Delete their existing rows first (edits)
+
+    Returns:
+        int: Number of trigram rows written
+    """
+    from .models import TransferSearchTrigram
+
+    rows = [
+        TransferSearchTrigram(transfer_id=transfer.pk, trigram=gram)
+        for transfer in transfers
+        for gram in name_trigrams(transfer.search_name)
+    ]
+    with transaction.atomic():
+        if replace:
+            TransferSearchTrigram.objects.filter(transfer_id__in=[transfer.pk for transfer in transfers]).delete()
+        TransferSearchTrigram.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _is_dense(queryset):
+    # No ordering: the probe must stop after DENSE_PROBE_LIMIT index entries, not sort every match
+    return queryset.order_by()[:DENSE_PROBE_LIMIT].count() >= DENSE_PROBE_LIMIT
+
+
+def _prefix_q(field, term):
+    """Rows whose column starts with term: index range when selective, tested row by row when dense"""
+    from .models import Transfer
+
+    range_q = Q(**{f'{field}__gte': term, f'{field}__lt': term + PREFIX_UPPER_BOUND})
+    if _is_dense(Transfer.objects.filter(range_q)):
+        return Q(**{f'{field}__startswith': term})
+    return range_q
+
+
+def _name_substring_q(term):
+    """Rows whose search_name contains term, narrowed through the two rarest grams when selective"""
+    from .models import TransferSearchTrigram
+
+    frequency = {
+        gram: TransferSearchTrigram.objects.filter(trigram=gram)[:DENSE_PROBE_LIMIT].count()
+        for gram in sorted(trigrams(term))
+    }
+    grams = sorted(frequency, key=lambda gram: frequency[gram])[:QUERY_TRIGRAMS]
+
+    # A short term of common grams is dense; a longer one can still combine them into a rare term
+    if len(frequency) <= QUERY_TRIGRAMS and frequency[grams[0]] >= DENSE_PROBE_LIMIT:
+        return Q(search_name__contains=term)
+
+    candidates = (TransferSearchTrigram.objects
+                  .filter(trigram__in=grams)
+                  .values('transfer_id')
+                  .annotate(hits=Count('id'))
+                  .filter(hits=len(grams))
+                  .values('transfer_id'))
+    return Q(pk__in=candidates, search_name__contains=term)
+
+
+def search_transfers(queryset, query):
+    """
+    Filter a Transfer queryset on beneficiary name or phone.
+
+    The whole name can match from the first character, any word of it from two
+    characters and any substring from three. A query without letters is also matched
+    against the first and last digits of the phone: '+257 79' and '79 12 34 56' both
+    find '+257 79 12 34 56'.
+
+    Args:
+        queryset: Transfer queryset (already scoped to the user)
+        query (str): Raw search text
+
+    Returns:
+        QuerySet: The filtered queryset (unchanged if the query normalizes to nothing)
+    """
+    name_term = normalize_name(query)
+    phone_term = normalize_phone(query) if not _LETTER.search(query or '') else ''
+
+    if not name_term and not phone_term:
+        return queryset
+
+    condition = Q()
+    if name_term:
+        condition |= _prefix_q('search_name', name_term)
+        if len(name_term) >= TRIGRAM_SIZE:
+            condition |= _name_substring_q(name_term)
+        elif len(name_term) == TRIGRAM_SIZE - 1:
+            condition |= _name_substring_q(' ' + name_term)
+
+    if phone_term:
+        condition |= _prefix_q('search_phone', phone_term)
+        condition |= _prefix_q('search_phone_reversed', phone_term[::-1])
+
+    return queryset.filter(condition)
+
+
+def rebuild_search_index(batch_size=2000):
+    """
+    Recompute the normalized columns and trigram rows of every transfer.
+
+    Used after adding the columns (existing rows are empty) or after updates done
+    outside the ORM. Works in id order, one transaction per batch.
+
+    Returns:
+        tuple: (transfers indexed, trigram rows written)
+    """
+    from .models import Transfer, TransferSearchTrigram
+
+    transfer_count = 0
+    trigram_count = 0
+    last_id = 0
+
+    TransferSearchTrigram.objects.all().delete()
+    while True:
+        batch = list(Transfer.objects.filter(pk__gt=last_id).order_by('pk')
+                     .only('pk', 'beneficiary_name', 'beneficiary_phone')[:batch_size])
+        if not batch:
+            break
+
+        with transaction.atomic():
+            for transfer in batch:
+                set_search_fields(transfer)
+            Transfer.objects.bulk_update(batch, ['search_name', 'search_phone', 'search_phone_reversed'])
+            trigram_count += index_transfers(batch)
+
+        transfer_count += len(batch)
+        last_id = batch[-1].pk
+
+    logger.info(f"Transfer search index rebuilt: {transfer_count} transfers, {trigram_count} trigrams")
+    return transfer_count, trigram_count
@@ -1,5 +1,7 @@
 import logging
 
+from django.utils.translation import gettext_lazy as _
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +20,127 @@ def find_promotable_draft_transfers(commission_config):
     ).select_related('agent')
 
 
+# full_clean() options for the distributions the bulk paths create: same field and model
+# validation as CommissionDistribution.save(), without the per-row queries for what the
+# batch already checked set-based (locked transfers, loaded agents and configs, existing
+# distributions). The database still enforces those constraints on insert.
+DISTRIBUTION_CLEAN_OPTIONS = {'exclude': ['transfer', 'agent', 'config_used'], 'validate_unique': False}
+
+
+def bulk_promote_to_pending(transfer_ids, audit_action=None, audit_details=None):
+    """
+    Set-based equivalent of Transfer.promote_to_pending for many drafts at once.
+
+    In a single transaction: one conditional UPDATE ... WHERE status='DRAFT', one
+    bulk_create of commission distributions and one bulk_create of audit rows.
+    The audit rows are the ones the per-row path writes through the post_save
+    signal (transfer updated, commission created), plus an optional
+    `audit_action` row per transfer with details from `audit_details(transfer, config)`.
+
+    Returns:
+        dict: {'promoted': [(transfer, config), ...], 'failed': [{'id', 'reference_id', 'error'}, ...]}
+    """
+    from django.db import transaction
+    from django.utils import timezone
+
+    from users.models import UserActivity
+    from users.services import invalidate_dashboard_cache
+    from users.signals import build_activity, build_model_save_activity
+    from .commission_index import get_commission_index
+    from .commission_rollup import record_distributions
+    from .models import CommissionDistribution, Transfer
+
+    results = {'promoted': [], 'failed': []}
+    if not transfer_ids:
+        return results
+
+    with transaction.atomic():
+        transfers = list(
+                Transfer.objects.select_for_update(of=('self',))
+                .filter(id__in=transfer_ids, status='DRAFT')
+                .select_related('agent')
+        )
+        index = get_commission_index()
+
+        promotable = {}
+        for transfer in transfers:
+            commission_config = index.find(transfer.sent_currency, transfer.amount)
+            if not commission_config:
+                error = _("Aucune configration de commission dispo pour ce transfert")
+            elif not transfer.agent:
+                error = "Transfer has no agent to assign the commission to"
+            else:
+                promotable[transfer.id] = (transfer, commission_config)
+                continue
+
+            results['failed'].append({
+                'id': transfer.id,
+                'reference_id': transfer.reference_id,
+                'error': str(error)
+            })
+
+        if not promotable:
+            return results
+
+        now = timezone.now()
+        updated = Transfer.objects.filter(id__in=promotable, status='DRAFT').update(status='PENDING', updated_at=now)
+
+        if updated != len(promotable):
+            # Some rows changed status since we read them: keep only the ones we promoted
+            won = set(Transfer.objects.filter(
+                    id__in=promotable, status='PENDING', updated_at=now
+            ).values_list('id', flat=True))
+            for transfer_id in set(promotable) - won:
+                transfer, _config = promotable.pop(transfer_id)
+                results['failed'].append({
+                    'id': transfer.id,
+                    'reference_id': transfer.reference_id,
+                    'error': 'Transfer is no longer a draft'
+                })
+
+        # Avoid creating duplicate commissions
+        with_commission = set(CommissionDistribution.objects.filter(
+                transfer_id__in=promotable
+        ).values_list('transfer_id', flat=True))
+
+        distributions = []
+        activities = []
+        for transfer, commission_config in promotable.values():
+            transfer.status = 'PENDING'
+            transfer.updated_at = now
+            activities.append(build_model_save_activity(transfer, created=False))
+
+            if transfer.id not in with_commission:
+                commission_data = CommissionDistribution.calculate_commission(transfer, commission_config)
+                distribution = CommissionDistribution(
+                        transfer=transfer,
+                        agent=transfer.agent,
+                        config_used=commission_config,
+                        **commission_data
+                )
+                distribution.full_clean(**DISTRIBUTION_CLEAN_OPTIONS)
+                distributions.append(distribution)
+
+            if audit_action:
+                details = audit_details(transfer, commission_config) if audit_details else {}
+                activities.append(build_activity(audit_action, details))
+
+            results['promoted'].append((transfer, commission_config))
+
+        distributions = CommissionDistribution.objects.bulk_create(distributions)
+        record_distributions(distributions)
+        activities.extend(build_model_save_activity(distribution, created=True) for distribution in distributions)
+
+        activities = [activity for activity in activities if activity]
+        if activities:
+            UserActivity.objects.bulk_create(activities)
+
+        # update() and bulk_create() send no signals
+        invalidate_dashboard_cache('transfers', 'commissions')
+
+    return results
+
+
 def bulk_promote_draft_transfers(commission_config, promoted_by_user=None):
     """
     Manually promote all draft transfers that match a commission config.
@@ -25,30 +148,22 @@ def bulk_promote_draft_transfers(commission_config, promoted_by_user=None):
     """
     from users.models import log_user_activity
 
-    matching_transfers = find_promotable_draft_transfers(commission_config)
+    transfer_ids = list(find_promotable_draft_transfers(commission_config).values_list('id', flat=True))
+    promotion = bulk_promote_to_pending(transfer_ids)
 
     results = {
-        'total_found': len(matching_transfers),
-        'promoted': [],
-        'failed': []
-    }
-
-    for transfer in matching_transfers:
-        try:
-            transfer.promote_to_pending(promoted_by=promoted_by_user)
-            results['promoted'].append({
+        'total_found': len(transfer_ids),
+        'promoted': [
+            {
                 'id': transfer.id,
                 'reference_id': transfer.reference_id,
                 'amount': transfer.amount,
                 'agent': transfer.agent.username if transfer.agent else 'No agent'
-            })
-
-        except Exception as e:
-            results['failed'].append({
-                'id': transfer.id,
-                'reference_id': getattr(transfer, 'reference_id', f'T{transfer.id}'),
-                'error': str(e)
-            })
+            }
+            for transfer, _config in promotion['promoted']
+        ],
+        'failed': promotion['failed']
+    }
 
     # Log the manual bulk promotion
     if promoted_by_user:
@@ -68,6 +183,140 @@ def bulk_promote_draft_transfers(commission_config, promoted_by_user=None):
     return results
 
 
+# Batch action -> (required status, new status, activity action, (user, timestamp, comment) columns)
+BATCH_TRANSITIONS = {
+    'validate': ('PENDING', 'VALIDATED', 'transfer_validated',
+                 ('validated_by', 'validated_at', 'validation_comment')),
+    'reject': ('PENDING', 'CANCELED', 'transfer_rejected',
+               ('validated_by', 'validated_at', 'validation_comment')),
+    'execute': ('VALIDATED', 'COMPLETED', 'transfer_executed',
+                ('executed_by', 'executed_at', 'execution_comment')),
+}
+
+
+def bulk_transition_transfers(transfer_ids, action, user, comment='', ip_address=None):
+    """
+    Set-based equivalent of validate_transfer / execute_transfer for many transfers.
+
+    In a single transaction: one conditional UPDATE ... WHERE status=<required status>,
+    one bulk_create of commission distributions (validation only, using the validating
+    manager's configs like create_commission_for_transfer) and one bulk_create of the
+    activity rows the per-transfer views write.
+
+    Args:
+        transfer_ids (list): Transfers to update
+        action (str): 'validate', 'reject' or 'execute'
+        user (User): Manager performing the action
+        comment (str): Validation / execution comment applied to every transfer
+        ip_address (str, optional): Stored on the activity rows
+
+    Returns:
+        dict: {transfer_id: {'success': bool, 'status': str, 'error': str (on failure)}}
+    """
+    from django.db import transaction
+    from django.utils import timezone
+
+    from users.models import UserActivity
+    from users.services import invalidate_dashboard_cache
+    from .commission_index import get_commission_index
+    from .commission_rollup import record_distributions
+    from .models import CommissionDistribution, Transfer
+
+    if action not in BATCH_TRANSITIONS:
+        raise ValueError(f"Unknown batch action: {action}")
+
+    from_status, to_status, activity_action, (by_field, at_field, comment_field) = BATCH_TRANSITIONS[action]
+    transfer_ids = list(dict.fromkeys(transfer_ids))  # Keep order, drop duplicates
+    results = {}
+
+    with transaction.atomic():
+        transfers = {
+            transfer.id: transfer
+            for transfer in Transfer.objects.select_for_update(of=('self',))
+            .filter(id__in=transfer_ids)
+            .select_related('agent')
+        }
+
+        candidates = []
+        for transfer_id in transfer_ids:
+            transfer = transfers.get(transfer_id)
+            if transfer is None:
+                results[transfer_id] = {'success': False, 'status': None, 'error': 'Transfer not found'}
+            elif transfer.status != from_status:
+                results[transfer_id] = {
+                    'success': False,
+                    'status': transfer.status,
+                    'error': f'Current status: {transfer.get_status_display()}. Required status: {from_status}.'
+                }
+            else:
+                candidates.append(transfer_id)
+
+        if not candidates:
+            return results
+
+        now = timezone.now()
+        values = {'status': to_status, 'updated_at': now, by_field: user, at_field: now, comment_field: comment}
+        updated = Transfer.objects.filter(id__in=candidates, status=from_status).update(**values)
+
+        won = candidates
+        if updated != len(candidates):
+            # Some rows changed status since we read them: keep only the ones we updated
+            updated_ids = set(Transfer.objects.filter(
+                    id__in=candidates, status=to_status, updated_at=now
+            ).values_list('id', flat=True))
+            won = [transfer_id for transfer_id in candidates if transfer_id in updated_ids]
+            for transfer_id in set(candidates) - updated_ids:
+                results[transfer_id] = {'success': False, 'status': None,
+                                        'error': 'Transfer was updated by another request'}
+
+        distributions = []
+        activities = []
+
+        if action == 'validate':
+            index = get_commission_index()
+            with_commission = set(CommissionDistribution.objects.filter(
+                    transfer_id__in=won
+            ).values_list('transfer_id', flat=True))
+
+        for transfer_id in won:
+            transfer = transfers[transfer_id]
+            for field, value in values.items():
+                setattr(transfer, field, value)
+
+            if action == 'validate' and transfer.id not in with_commission and transfer.agent:
+                config = index.find(transfer.sent_currency, transfer.amount, manager_id=user.id)
+                commission_data = CommissionDistribution.calculate_commission(transfer, config)
+                if commission_data:
+                    distribution = CommissionDistribution(
+                            transfer=transfer,
+                            agent=transfer.agent,
+                            config_used=config,
+                            **commission_data
+                    )
+                    distribution.full_clean(**DISTRIBUTION_CLEAN_OPTIONS)
+                    distributions.append(distribution)
+
+            details = {'transfer_id': transfer.id, 'beneficiary': transfer.beneficiary_name, 'batch': True}
+            if action == 'reject':
+                details['reason'] = comment
+            elif action == 'execute':
+                details.update({'amount': str(transfer.amount), 'currency': transfer.sent_currency})
+            activities.append(UserActivity(user=user, action=activity_action, details=details, ip_address=ip_address))
+
+            results[transfer_id] = {'success': True, 'status': to_status}
+
+        if distributions:
+            distributions = CommissionDistribution.objects.bulk_create(distributions)
+            record_distributions(distributions)
+        UserActivity.objects.bulk_create(activities)
+
+        # update() and bulk_create() send no signals
+        invalidate_dashboard_cache('transfers', 'commissions')
+
+    logger.info(f"Batch {action} by {user.username}: {len(won)}/{len(transfer_ids)} transfers updated")
+    return results
+
+
 def notify_managers_of_draft_transfer(transfer, agent):
     """
     Service function to notify managers about draft transfer creation.
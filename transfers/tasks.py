@@ -0,0 +1,186 @@
+"""
+Background tasks for transfers, run by django-q2.
+"""
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from users.audit import audit_batch
+
+logger = logging.getLogger(__name__)
+
+# Check django-q2 availability once at module load
+try:
+    from django_q.tasks import async_task
+
+    DJANGO_Q_AVAILABLE = True
+except ImportError:
+    async_task = None
+    DJANGO_Q_AVAILABLE = False
+
+
+def enqueue_auto_promotion(task_id: int) -> None:
+    """
+    Queue the auto-promotion run for an AutoPromotionTask.
+    Falls back to running inline if django-q2 is not available.
+    """
+    if DJANGO_Q_AVAILABLE:
+        try:
+            async_task('transfers.tasks.run_auto_promotion', task_id, task_name=f'auto-promotion-{task_id}')
+            return
+        except Exception as e:
+            logger.error(f"Failed to queue auto-promotion task {task_id}, running inline: {e}", exc_info=True)
+
+    run_auto_promotion(task_id)
+
+
+def _save_progress(task, *fields):
+    """Persist task fields with a plain UPDATE (no save signals, no audit noise)"""
+    from .models import AutoPromotionTask
+
+    AutoPromotionTask.objects.filter(pk=task.pk).update(**{field: getattr(task, field) for field in fields})
+
+
+@audit_batch()  # Written in bulk when the task ends: workers are not covered by the request batch
+def run_auto_promotion(task_id: int) -> dict:
+    """
+    Promote the DRAFT transfers matching a commission config, in fixed-size chunks.
+    Progress is saved on the AutoPromotionTask after every chunk so it can be polled.
+
+    Args:
+        task_id (int): AutoPromotionTask to run
+
+    Returns:
+        dict: Final status of the task
+    """
+    from users.signals import get_current_user, safe_log_activity, set_current_user
+    from .models import AutoPromotionTask, Transfer
+    from .services import bulk_promote_to_pending, notify_agents_of_auto_promotion
+
+    task = AutoPromotionTask.objects.select_related('commission_config__manager', 'triggered_by').get(id=task_id)
+    config = task.commission_config
+    chunk_size = getattr(settings, 'AUTO_PROMOTION_CHUNK_SIZE', 500)
+
+    # Attribute the audit trail to the manager who saved the config
+    previous_user = get_current_user()
+    set_current_user(task.triggered_by)
+
+    try:
+        matching_transfers = Transfer.objects.filter(
+                status='DRAFT',
+                sent_currency=config.currency,
+                amount__gte=config.min_amount,
+                amount__lte=config.max_amount
+        )
+
+        task.status = 'RUNNING'
+        task.started_at = timezone.now()
+        task.total_count = matching_transfers.count()
+        _save_progress(task, 'status', 'started_at', 'total_count')
+
+        promoted_transfers_data = []  # Collect data for email notifications
+        last_id = 0
+
+        while True:
+            chunk_ids = list(
+                    matching_transfers.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not chunk_ids:
+                break
+            last_id = chunk_ids[-1]
+
+            results = bulk_promote_to_pending(
+                    chunk_ids,
+                    audit_action='auto_promoted',
+                    audit_details=lambda transfer, used_config: {
+                        'transfer_id': transfer.id,
+                        'reference_id': transfer.reference_id,
+                        'commission_config_id': config.id,
+                        'amount': str(transfer.amount),
+                        'currency': transfer.sent_currency,
+                        'agent_username': transfer.agent.username if transfer.agent else 'No agent',
+                        'config_manager': config.manager.username,
+                        'from_status': 'DRAFT',
+                        'to_status': 'PENDING'
+                    }
+            )
+
+            for transfer, _used_config in results['promoted']:
+                promoted_transfers_data.append({
+                    'id': transfer.id,
+                    'reference_id': transfer.reference_id,
+                    'amount': str(transfer.amount),
+                    'beneficiary': transfer.beneficiary_name,
+                    'agent': transfer.agent.username if transfer.agent else 'No agent'
+                })
+
+            for failure in results['failed']:
+                logger.warning(f"Failed to auto-promote transfer {failure['id']}: {failure['error']}")
+
+            task.processed_count += len(chunk_ids)
+            task.promoted_count += len(results['promoted'])
+            task.failed_count += len(results['failed'])
+            task.failed_transfers.extend(results['failed'])
+            _save_progress(task, 'processed_count', 'promoted_count', 'failed_count', 'failed_transfers')
+
+        # Send email notifications to agents if transfers were promoted
+        if promoted_transfers_data:
+            try:
+                notify_agents_of_auto_promotion(promoted_transfers_data, config.id)
+            except Exception as e:
+                # Don't break the promotion if email fails
+                logger.warning(f"Email notification failed for auto-promotion: {e}")
+
+        # Log summary of the auto-promotion batch
+        if task.promoted_count > 0 or task.failed_count:
+            safe_log_activity(
+                    'auto_promotion_batch',
+                    {
+                        'commission_config_id': config.id,
+                        'config_manager': config.manager.username,
+                        'currency': config.currency,
+                        'min_amount': str(config.min_amount),
+                        'max_amount': str(config.max_amount),
+                        'promoted_count': task.promoted_count,
+                        'failed_count': task.failed_count,
+                        'failed_transfers': task.failed_transfers,
+                        'email_notifications_sent': len(promoted_transfers_data) > 0,  # Track email status
+                        'promotion_task_id': task.id
+                    }
+            )
+
+        task.status = 'COMPLETED'
+        task.finished_at = timezone.now()
+        _save_progress(task, 'status', 'finished_at')
+
+        if task.promoted_count > 0:
+            logger.info(f"Auto-promoted {task.promoted_count} transfers due to commission config {config.id}")
+
+        if task.failed_count:
+            logger.warning(f"Failed to auto-promote {task.failed_count} transfers for config {config.id}")
+
+    except Exception as e:
+        # Never let auto-promotion break commission config creation
+        logger.error(f"Auto-promotion failed for commission config {config.id}: {e}", exc_info=True)
+
+        task.status = 'FAILED'
+        task.error = str(e)
+        task.finished_at = timezone.now()
+        _save_progress(task, 'status', 'error', 'finished_at')
+
+        # Log the failure for troubleshooting
+        safe_log_activity(
+                'auto_promotion_failed',
+                {
+                    'commission_config_id': config.id,
+                    'config_manager': config.manager.username,
+                    'error': str(e),
+                    'promotion_task_id': task.id
+                }
+        )
+
+    finally:
+        set_current_user(previous_user)
+
+    return task.as_status_dict()
@@ -1,3 +1,822 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import threading
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from stock.models import ExchangeRate
+from users.models import User, UserActivity
+from users.signals import set_current_user
+from .commission_index import CommissionBracketIndex, find_commission_config
+from .commission_rollup import AMOUNT_FIELDS, _bucket_queryset
+from .exports import build_export_rows, iter_export_lines
+from .imports import TransferImportError, import_transfers_csv
+from . import commission_index, reference_ids
+from .models import CommissionConfig, CommissionDistribution, CommissionRollup, Transfer, TransferSearchTrigram
+from .pagination import paginate_by_keyset
+from .search import search_transfers
+from .services import bulk_promote_to_pending
+
+
+class TransferTransitionConcurrencyTest(TransactionTestCase):
+    """Concurrent requests for the same status transition: exactly one must win"""
+
+    THREADS = 8
+    LOCK_RETRIES = 50
+
+    def setUp(self):
+        self.managers = [
+            User.objects.create(username=f'manager{i}', email=f'manager{i}@example.com', user_type='manager')
+            for i in range(self.THREADS)
+        ]
+        self.transfer = Transfer(
+                beneficiary_name='Beneficiary',
+                beneficiary_phone='+25700000000',
+                method='CASH',
+                amount=Decimal('100.00'),
+                sent_currency='EUR',
+                received_currency='BIF',
+                status='PENDING'
+        )
+        self.transfer.save()
+
+    def _race(self, make_transition):
+        """Run make_transition(transfer, manager) from THREADS threads released at the same moment"""
+        barrier = threading.Barrier(self.THREADS)
+        results = [None] * self.THREADS
+
+        def worker(position):
+            try:
+                transfer = Transfer.objects.get(pk=self.transfer.pk)  # Each thread holds its own stale copy
+                barrier.wait()
+                for attempt in range(self.LOCK_RETRIES):
+                    try:
+                        results[position] = make_transition(transfer, self.managers[position])
+                        break
+                    except OperationalError as e:
+                        # The in-memory SQLite test database reports concurrent writers as
+                        # "table is locked" instead of waiting: retry like a blocked writer would
+                        if 'locked' not in str(e) or attempt == self.LOCK_RETRIES - 1:
+                            raise
+                        time.sleep(0.01)
+            except Exception as e:
+                results[position] = e
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        self.assertEqual(errors, [])
+        return results
+
+    def test_validate_wins_exactly_once(self):
+        results = self._race(lambda transfer, manager: transfer.validate(manager, 'ok'))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), self.THREADS - 1)
+
+        self.transfer.refresh_from_db()
+        winner = self.managers[results.index(True)]
+        self.assertEqual(self.transfer.status, 'VALIDATED')
+        self.assertEqual(self.transfer.validated_by, winner)
+
+    def test_validate_and_reject_race(self):
+        results = self._race(
+                lambda transfer, manager: transfer.validate(manager) if manager.pk % 2 else transfer.reject(manager)
+        )
+
+        self.assertEqual(results.count(True), 1)
+        self.transfer.refresh_from_db()
+        self.assertIn(self.transfer.status, ('VALIDATED', 'CANCELED'))
+
+    def test_execute_wins_exactly_once(self):
+        self.assertTrue(self.transfer.validate(self.managers[0]))
+
+        results = self._race(lambda transfer, manager: transfer.execute(manager, 'done'))
+
+        self.assertEqual(results.count(True), 1)
+        self.transfer.refresh_from_db()
+        self.assertEqual(self.transfer.status, 'COMPLETED')
+        self.assertEqual(self.transfer.executed_by, self.managers[results.index(True)])
+
+    def test_lost_transition_refreshes_status(self):
+        stale = Transfer.objects.get(pk=self.transfer.pk)
+        self.assertTrue(self.transfer.reject(self.managers[0]))
+
+        self.assertFalse(stale.validate(self.managers[1]))
+        self.assertEqual(stale.status, 'CANCELED')
+
+
+@override_settings(AUDIT_BACKGROUND_WRITES=False)
+class BulkPromotionParityTest(TestCase):
+    """bulk_promote_to_pending must leave the same state and audit trail as promote_to_pending per row"""
+
+    AMOUNTS = ('100.00', '250.00', '999.99')
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.agent = User.objects.create(username='agent', email='agent@example.com', user_type='agent')
+        CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('1000.00'),
+                commission_amount=Decimal('12.5000'), agent_share=Decimal('40.00')
+        )
+        set_current_user(self.manager)
+        self.addCleanup(set_current_user, None)
+
+    def _drafts(self):
+        drafts = []
+        for position, amount in enumerate(self.AMOUNTS):
+            transfer = Transfer(
+                    beneficiary_name=f'Beneficiary {position}',
+                    beneficiary_phone=f'+2570000000{position}',
+                    method='CASH',
+                    amount=Decimal(amount),
+                    sent_currency='EUR',
+                    received_currency='BIF',
+                    agent=self.agent,
+                    status='DRAFT'
+            )
+            transfer.save()
+            drafts.append(transfer)
+        # Only the promotion's audit rows are compared
+        UserActivity.objects.filter(entity_type='transfers.Transfer',
+                                    entity_id__in=[draft.pk for draft in drafts]).delete()
+        return drafts
+
+    def _promotion_state(self, transfers):
+        """Statuses, distributions and audit rows of transfers, without their ids"""
+        ids = [transfer.pk for transfer in transfers]
+        statuses = list(Transfer.objects.filter(pk__in=ids).order_by('pk').values_list('status', flat=True))
+        distributions = list(CommissionDistribution.objects.filter(transfer_id__in=ids).order_by('transfer_id')
+                             .values_list('agent_id', 'config_used_id', 'total_commission',
+                                          'declaring_agent_amount', 'manager_amount'))
+        activities = sorted(
+                (activity.user_id, activity.action, activity.entity_type,
+                 sorted((key, str(value)) for key, value in activity.details.items()
+                        if key not in ('object_id', 'transfer_id', 'reference_id')))
+                for activity in UserActivity.objects.filter(entity_type='transfers.Transfer', entity_id__in=ids)
+        )
+        return statuses, distributions, activities
+
+    def test_bulk_and_per_row_promotion_match(self):
+        per_row = self._drafts()
+        with self.captureOnCommitCallbacks(execute=True):
+            for transfer in per_row:
+                transfer.promote_to_pending()
+
+        bulk = self._drafts()
+        with self.captureOnCommitCallbacks(execute=True):
+            results = bulk_promote_to_pending([transfer.pk for transfer in bulk])
+
+        self.assertEqual(results['failed'], [])
+        expected = self._promotion_state(per_row)
+        self.assertEqual(expected[0], ['PENDING'] * len(self.AMOUNTS))
+        self.assertEqual(len(expected[1]), len(self.AMOUNTS))
+        self.assertTrue(expected[2])
+        self.assertEqual(self._promotion_state(bulk), expected)
+
+
+class TransferExportTest(TestCase):
+    """Streaming transfer exports (exports.py)"""
+
+    def setUp(self):
+        self.agent = User.objects.create(username='agent', email='agent@example.com', user_type='agent')
+        self.now = timezone.now()
+
+    def _transfer(self, amount, days_ago, **fields):
+        transfer = Transfer(**{
+            'beneficiary_name': 'Beneficiary', 'beneficiary_phone': '+25700000000', 'method': 'CASH',
+            'amount': Decimal(amount), 'sent_currency': 'EUR', 'received_currency': 'BIF', 'agent': self.agent,
+            **fields,
+        })
+        transfer.save()
+        Transfer.objects.filter(pk=transfer.pk).update(created_at=self.now - timedelta(days=days_ago))
+        return transfer
+
+    def _rate(self, rate, days_ago, active=True):
+        exchange_rate = ExchangeRate.objects.create(from_currency='EUR', to_currency='BIF', rate=Decimal(rate),
+                                                    active=active)
+        ExchangeRate.objects.filter(pk=exchange_rate.pk).update(created_at=self.now - timedelta(days=days_ago))
+
+    def _export(self, export_format='csv'):
+        headers, rows = build_export_rows('transfers', {})
+        return list(iter_export_lines(headers, rows, export_format, chunk_size=2))
+
+    def test_received_amount_uses_the_rate_of_the_transfer_time(self):
+        self._rate('3000', days_ago=10, active=False)
+        self._rate('3100', days_ago=5)
+        self._transfer('10.00', days_ago=12)
+        self._transfer('10.00', days_ago=7)
+        self._transfer('20.00', days_ago=3)
+
+        with self.assertNumQueries(2):  # The rates, then the transfers (one cursor read in chunks)
+            lines = self._export()
+
+        self.assertTrue(lines[0].rstrip().endswith(',received_amount'))
+        self.assertEqual([line.rstrip().rsplit(',', 1)[1] for line in lines[1:]], ['', '30000.00', '62000.00'])
+
+    def test_csv_cells_are_not_spreadsheet_formulas(self):
+        formula = self._transfer('10.00', days_ago=2, beneficiary_name='=HYPERLINK("http://example.com")')
+        plain = self._transfer('10.00', days_ago=1, beneficiary_name='-12.50', beneficiary_phone='+257 61 23 45 67')
+        Transfer.objects.filter(pk=plain.pk).update(amount=Decimal('-5.00'))  # A correction row
+
+        rows = {int(row['id']): row for row in csv.DictReader(self._export())}
+        self.assertEqual(rows[formula.pk]['beneficiary_name'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(rows[formula.pk]['beneficiary_phone'], '+25700000000')
+        # Numbers and phones round-trip unchanged
+        self.assertEqual((rows[plain.pk]['beneficiary_name'], rows[plain.pk]['beneficiary_phone'],
+                          rows[plain.pk]['amount']), ('-12.50', '+257 61 23 45 67', '-5.00'))
+
+        # JSON Lines is not opened by spreadsheets: values stay as they are
+        self.assertIn('"beneficiary_name": "=HYPERLINK(\\"http://example.com\\")"', self._export('jsonl')[0])
+
+
+class TransferSearchBackfillTest(TransactionTestCase):
+    """Migration 0005 indexes the transfers that existed before the search columns"""
+
+    before = [('transfers', '0004_commissionrollup')]
+    after = [('transfers', '0005_transfer_search')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        self.latest = executor.loader.graph.leaf_nodes('transfers')
+        executor.migrate(self.before)
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(self.latest))
+
+    def test_transfer_created_before_indexing_is_found(self):
+        old_apps = MigrationExecutor(connection).loader.project_state(self.before).apps
+        old_apps.get_model('transfers', 'Transfer').objects.create(
+                reference_id='OLD000001', beneficiary_name="Jean-Éric N'Dayé", beneficiary_phone='+257 79 12 34 56',
+                method='CASH', amount=Decimal('50.00'), sent_currency='EUR', received_currency='BIF',
+                status='COMPLETED'
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        new_apps = executor.loader.project_state(self.after).apps
+        transfer = new_apps.get_model('transfers', 'Transfer').objects.get(reference_id='OLD000001')
+        self.assertEqual((transfer.search_name, transfer.search_phone), ('jean eric ndaye', '25779123456'))
+
+        MigrationExecutor(connection).migrate(self.latest)
+        for query in ('ndaye', 'eric', '+257 79', '34 56'):
+            self.assertEqual(list(search_transfers(Transfer.objects.all(), query).values_list('reference_id', flat=True)),
+                             ['OLD000001'], query)
+
+
+class CommissionRollupCascadeTest(TestCase):
+    """Deleting transfers or agents keeps the rollup equal to a fresh aggregate"""
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.agents = [User.objects.create(username=f'agent{position}', email=f'agent{position}@example.com',
+                                           user_type='agent') for position in range(2)]
+        self.config = CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('1000.00'),
+                commission_amount=Decimal('10.0000'), agent_share=Decimal('40.00')
+        )
+        self.transfers = []
+        for position in range(6):
+            agent = self.agents[position % 2]
+            transfer = Transfer.objects.create(
+                    beneficiary_name=f'Beneficiary {position}', beneficiary_phone=f'+2570000000{position}',
+                    method='CASH', amount=Decimal('100.00'), sent_currency='EUR', received_currency='BIF',
+                    agent=agent, status='PENDING'
+            )
+            CommissionDistribution.objects.create(
+                    transfer=transfer, agent=agent, config_used=self.config, total_commission=Decimal('10.0000'),
+                    declaring_agent_amount=Decimal('4.0000'), manager_amount=Decimal('6.0000')
+            )
+            self.transfers.append(transfer)
+
+    def assertRollupIsFresh(self):
+        rollup = {
+            (row.day, row.agent_id, row.currency): {
+                'distribution_count': row.distribution_count, **{field: getattr(row, field) for field in AMOUNT_FIELDS}
+            }
+            for row in CommissionRollup.objects.all()
+        }
+        self.assertEqual(rollup, _bucket_queryset(CommissionDistribution.objects.all()))
+
+    def test_transfer_and_agent_deletions(self):
+        self.assertRollupIsFresh()
+
+        with self.assertNoLogs('transfers.commission_rollup', 'WARNING'):
+            self.transfers[0].delete()
+            self.assertRollupIsFresh()
+
+            # Both distributions are in the same bucket: one grouped read, one rollup update
+            with CaptureQueriesContext(connection) as queries:
+                Transfer.objects.filter(pk__in=[self.transfers[2].pk, self.transfers[4].pk]).delete()
+            self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "transfers_commissionrollup"')]), 1)
+            self.assertRollupIsFresh()
+
+            self.agents[1].delete()
+            self.assertRollupIsFresh()
+
+        self.assertFalse(CommissionRollup.objects.exists())
+
+
+@override_settings(AUDIT_BACKGROUND_WRITES=False)
+class BatchTransitionTest(TestCase):
+    """POST /transfers/batch/ (bulk_transition_transfers): per-row results in one transaction"""
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.agent = User.objects.create(username='agent', email='agent@example.com', user_type='agent')
+        CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('1000.00'),
+                commission_amount=Decimal('12.5000'), agent_share=Decimal('40.00')
+        )
+        self.pending = [self._transfer('PENDING') for _position in range(2)]
+        self.draft = self._transfer('DRAFT')
+        self.client.force_login(self.manager)
+
+    def _transfer(self, status):
+        return Transfer.objects.create(beneficiary_name='Beneficiary', beneficiary_phone='+25700000000',
+                                       method='CASH', amount=Decimal('100.00'), sent_currency='EUR',
+                                       received_currency='BIF', agent=self.agent, status=status)
+
+    def _post(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('batch_transition_transfers'), json.dumps(data),
+                                    content_type='application/json')
+
+    def test_mixed_valid_and_invalid_ids_report_per_row(self):
+        missing_id = Transfer.objects.order_by('-pk').first().pk + 100
+        ids = [transfer.pk for transfer in self.pending] + [self.draft.pk, missing_id]
+
+        response = self._post(action='validate', transfer_ids=ids)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['succeeded'], data['failed']), (2, 2))
+        for transfer in self.pending:
+            self.assertEqual(data['results'][str(transfer.pk)], {'success': True, 'status': 'VALIDATED'})
+        self.assertEqual(data['results'][str(self.draft.pk)]['status'], 'DRAFT')
+        self.assertIn('Required status: PENDING', data['results'][str(self.draft.pk)]['error'])
+        self.assertEqual(data['results'][str(missing_id)], {'success': False, 'status': None,
+                                                            'error': 'Transfer not found'})
+
+        self.assertEqual(set(Transfer.objects.filter(status='VALIDATED').values_list('pk', flat=True)),
+                         {transfer.pk for transfer in self.pending})
+        self.assertEqual(CommissionDistribution.objects.filter(transfer__in=self.pending).count(), 2)
+        self.assertEqual(UserActivity.objects.filter(action='transfer_validated').count(), 2)
+
+        # A second run finds nothing left to validate
+        data = self._post(action='validate', transfer_ids=ids[:2]).json()
+        self.assertEqual((data['success'], data['failed']), (False, 2))
+        self.assertEqual(CommissionDistribution.objects.count(), 2)
+
+    @override_settings(TRANSFER_BATCH_MAX_SIZE=2)
+    def test_batch_size_is_capped(self):
+        response = self._post(action='validate', transfer_ids=[transfer.pk for transfer in self.pending]
+                              + [self.draft.pk])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('max 2', response.json()['error'])
+        self.assertFalse(Transfer.objects.filter(status='VALIDATED').exists())
+
+    def test_invalid_requests(self):
+        self.assertEqual(self._post(action='archive', transfer_ids=[self.draft.pk]).status_code, 400)
+        self.assertEqual(self._post(action='validate', transfer_ids=[]).status_code, 400)
+        self.assertEqual(self._post(action='validate', transfer_ids=['x']).status_code, 400)
+        # Rejections need a reason
+        self.assertEqual(self._post(action='reject', transfer_ids=[self.pending[0].pk]).status_code, 400)
+        self.assertEqual(self._post(action='reject', transfer_ids=[self.pending[0].pk],
+                                    comment='Doublon').json()['results'][str(self.pending[0].pk)]['status'],
+                         'CANCELED')
+
+    def test_agents_are_refused(self):
+        self.client.force_login(self.agent)
+
+        response = self._post(action='validate', transfer_ids=[transfer.pk for transfer in self.pending])
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Transfer.objects.filter(status='VALIDATED').exists())
+
+
+class TransferImportTest(TestCase):
+    """CSV import (imports.py): bulk_create must leave the same rows as Transfer.save()"""
+
+    HEADER = 'beneficiary_name,beneficiary_phone,method,amount,sent_currency,received_currency,comment\n'
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.agent = User.objects.create(username='agent', email='agent@example.com', user_type='agent')
+        CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('1000.00'),
+                commission_amount=Decimal('12.5000'), agent_share=Decimal('40.00')
+        )
+
+    def _csv(self, *lines, header=HEADER):
+        return io.BytesIO((header + ''.join(line + '\n' for line in lines)).encode('utf-8'))
+
+    def _import(self, *lines, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_transfers_csv(self._csv(*lines), self.agent, **options)
+
+    def test_missing_columns_are_rejected(self):
+        with self.assertRaisesMessage(TransferImportError, 'Colonnes manquantes: amount'):
+            import_transfers_csv(self._csv('Jean,+25700000000,CASH,EUR,BIF',
+                                           header='beneficiary_name,beneficiary_phone,method,sent_currency,'
+                                                  'received_currency\n'), self.agent)
+        self.assertFalse(Transfer.objects.exists())
+
+    def test_header_is_trimmed_and_comment_optional(self):
+        header = ' beneficiary_name , beneficiary_phone,method,amount,sent_currency,received_currency\n'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = import_transfers_csv(self._csv('Jean,+25700000000,CASH,10.00,EUR,BIF', header=header),
+                                          self.agent)
+
+        self.assertEqual(result['created'], 1)
+
+    def test_row_cap_imports_nothing(self):
+        lines = [f'Beneficiary {position},+2570000000{position},CASH,10.00,EUR,BIF,' for position in range(3)]
+
+        with self.assertRaisesMessage(TransferImportError, 'limite de 2 lignes'):
+            self._import(*lines, batch_size=1, max_rows=2)
+
+        self.assertFalse(Transfer.objects.exists())
+        self.assertEqual(self._import(*lines[:2], max_rows=2)['created'], 2)
+
+    @override_settings(TRANSFER_IMPORT_MAX_ROWS=1)
+    def test_view_applies_the_row_cap(self):
+        self.client.force_login(self.agent)
+        upload = self._csv('Jean,+25700000000,CASH,10.00,EUR,BIF,', 'Marie,+25700000001,CASH,10.00,EUR,BIF,')
+        upload.name = 'transfers.csv'
+
+        response = self.client.post(reverse('import_transfers'), {'file': upload})
+
+        self.assertContains(response, 'limite de 1 lignes')
+        self.assertFalse(Transfer.objects.exists())
+
+    def test_invalid_rows_are_reported_valid_rows_of_the_batch_imported(self):
+        result = self._import(
+                'Jean Ndayi,+25700000001,CASH,100.00,EUR,BIF,',
+                'Bad amount,+25700000002,CASH,abc,EUR,BIF,',
+                'Marie,+25700000003,CASH,2000.00,EUR,BIF,Hors barème',
+                'Bad method,+25700000004,PIGEON,10.00,EUR,BIF,',
+                batch_size=2,
+        )
+
+        self.assertEqual((result['created'], result['pending'], result['drafts'], result['failed']), (2, 1, 1, 2))
+        self.assertEqual([(row['line'], row['success']) for row in result['rows']],
+                         [(2, True), (3, False), (4, True), (5, False)])
+        self.assertTrue(any(error.startswith('amount:') for error in result['rows'][1]['errors']))
+        self.assertTrue(any(error.startswith('method:') for error in result['rows'][3]['errors']))
+
+        # What Transfer.save() would have filled, although bulk_create does not call it
+        jean = Transfer.objects.get(pk=result['rows'][0]['transfer_id'])
+        self.assertEqual((jean.status, jean.agent, jean.reference_id), ('PENDING', self.agent,
+                                                                         result['rows'][0]['reference_id']))
+        self.assertEqual((jean.search_name, jean.search_phone), ('jean ndayi', '25700000001'))
+        self.assertTrue(jean.fingerprint)
+        self.assertTrue(TransferSearchTrigram.objects.filter(transfer=jean).exists())
+        self.assertEqual(Transfer.objects.get(beneficiary_name='Marie').status, 'DRAFT')
+        self.assertEqual(UserActivity.objects.filter(details__imported=True).count(), 2)
+
+    def test_reference_ids_taken_by_legacy_transfers_are_redrawn(self):
+        legacy = Transfer.objects.create(beneficiary_name='Legacy', beneficiary_phone='+25700000009', method='CASH',
+                                         amount=Decimal('10.00'), sent_currency='EUR', received_currency='BIF',
+                                         agent=self.agent)
+        generate = reference_ids.generate_reference_ids
+        draws = []
+
+        def colliding(count):
+            ids = generate(count)
+            if not draws:
+                ids[0] = legacy.reference_id
+            draws.append(count)
+            return ids
+
+        with mock.patch.object(reference_ids, 'generate_reference_ids', colliding):
+            result = self._import('Jean,+25700000001,CASH,10.00,EUR,BIF,', 'Marie,+25700000002,CASH,10.00,EUR,BIF,')
+
+        # Only the colliding transfer was drawn again
+        self.assertEqual(draws, [2, 1])
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(len(set(Transfer.objects.values_list('reference_id', flat=True))), 3)
+
+        with mock.patch.object(reference_ids, 'generate_reference_ids', lambda count: [legacy.reference_id] * count):
+            with self.assertRaisesMessage(TransferImportError, 'références uniques'):
+                self._import('Paul,+25700000003,CASH,10.00,EUR,BIF,')
+        self.assertEqual(Transfer.objects.count(), 3)
+
+    def test_command_reports_rejected_lines(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as csv_file:
+            csv_file.write(self._csv('Jean,+25700000001,CASH,10.00,EUR,BIF,', 'Bad,+25700000002,CASH,x,EUR,BIF,')
+                           .getvalue())
+            csv_file.flush()
+            stdout, stderr = io.StringIO(), io.StringIO()
+
+            call_command('import_transfers', csv_file.name, agent='agent', stdout=stdout, stderr=stderr)
+
+            self.assertIn('1 transfers imported', stdout.getvalue())
+            self.assertIn('Line 3: amount', stderr.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('import_transfers', csv_file.name, agent='nobody')
+
+
+@override_settings(AUDIT_BACKGROUND_WRITES=False, TRANSFER_DUPLICATE_WINDOW_SECONDS=600)
+class DuplicateTransferTest(TestCase):
+    """create_transfer: duplicate confirmation (fingerprint window) and idempotent retries"""
+
+    DATA = {
+        'beneficiary_name': 'Jean Ndayi',
+        'beneficiary_phone': '+257 79 12 34 56',
+        'method': 'CASH',
+        'amount': '100.00',
+        'sent_currency': 'EUR',
+        'received_currency': 'BIF',
+    }
+
+    def setUp(self):
+        self.agent = User.objects.create(username='agent', email='agent@example.com', user_type='agent')
+        CommissionConfig.objects.create(
+                manager=User.objects.create(username='manager', email='manager@example.com', user_type='manager'),
+                currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('1000.00'),
+                commission_amount=Decimal('12.5000'), agent_share=Decimal('40.00')
+        )
+        self.client.force_login(self.agent)
+
+    def _submit(self, headers=None, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('create_transfer'), {**self.DATA, **extra}, headers=headers or {})
+
+    def test_second_submit_in_the_window_asks_for_confirmation(self):
+        self._submit()
+        first = Transfer.objects.get()
+
+        # Same transfer, written differently
+        response = self._submit(beneficiary_phone='+25779123456', amount='100')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, first.reference_id)
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.assertTrue(UserActivity.objects.filter(action='transfer_duplicate_blocked',
+                                                    details__duplicate_of=first.pk).exists())
+
+        self._submit(confirm_duplicate='1')
+        self.assertEqual(Transfer.objects.count(), 2)
+
+    def test_outside_the_window_or_canceled_is_not_a_duplicate(self):
+        self._submit()
+        Transfer.objects.update(created_at=timezone.now() - timedelta(seconds=601))
+        self._submit()
+        self.assertEqual(Transfer.objects.count(), 2)
+
+        Transfer.objects.update(status='CANCELED')
+        self._submit()
+        self.assertEqual(Transfer.objects.count(), 3)
+
+    @override_settings(TRANSFER_DUPLICATE_WINDOW_SECONDS=0)
+    def test_zero_window_disables_the_check(self):
+        self._submit()
+        self._submit()
+
+        self.assertEqual(Transfer.objects.count(), 2)
+        self.assertFalse(UserActivity.objects.filter(action='transfer_duplicate_blocked').exists())
+
+    def test_reused_idempotency_key_returns_the_first_transfer(self):
+        first_response = self._submit(headers={'Idempotency-Key': 'retry-1'})
+        first = Transfer.objects.get()
+        self.assertEqual(first.idempotency_key, 'retry-1')
+
+        # A retry is not a duplicate to confirm: it gets the same transfer, even with confirmation
+        for response in (self._submit(headers={'Idempotency-Key': 'retry-1'}),
+                         self._submit(idempotency_key='retry-1', confirm_duplicate='1')):
+            self.assertRedirects(response, reverse('transfer_detail', args=[first.pk]), fetch_redirect_response=False)
+        self.assertRedirects(first_response, reverse('transfer_detail', args=[first.pk]), fetch_redirect_response=False)
+        self.assertEqual(Transfer.objects.count(), 1)
+
+        # Keys are per agent
+        other = User.objects.create(username='other', email='other@example.com', user_type='agent')
+        self.client.force_login(other)
+        self._submit(headers={'Idempotency-Key': 'retry-1'})
+        self.assertEqual(Transfer.objects.filter(agent=other).count(), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CommissionPreviewTest(TestCase):
+    """commission_previews: ETag revalidation against the config version, and the item cap"""
+
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.config = CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('1000.00'),
+                commission_amount=Decimal('12.5000'), agent_share=Decimal('40.00')
+        )
+        self.client.force_login(self.manager)
+        self.url = reverse('commission_previews')
+        self.query = {'amount': ['100', '5000'], 'currency': ['EUR', 'EUR']}
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.client.get(self.url, self.query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([preview['config_found'] for preview in response.json()['previews']], [True, False])
+        etag = response['ETag']
+
+        revalidated = self.client.get(self.url, self.query, headers={'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+
+    def test_config_change_alters_the_etag(self):
+        etag = self.client.get(self.url, self.query)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.config.max_amount = Decimal('9000.00')
+            self.config.save()
+
+        response = self.client.get(self.url, self.query, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([preview['config_found'] for preview in response.json()['previews']], [True, True])
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.config.delete()
+        self.assertEqual(self.client.get(self.url, self.query, headers={'If-None-Match': etag}).status_code, 200)
+
+    @override_settings(COMMISSION_PREVIEW_MAX_ITEMS=2)
+    def test_item_cap(self):
+        self.assertEqual(self.client.get(self.url, self.query).status_code, 200)
+
+        response = self.client.get(self.url, {'amount': ['1', '2', '3'], 'currency': ['EUR'] * 3})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Maximum 2 montants par requête.')
+
+
+class CommissionBracketIndexTest(TestCase):
+    """CommissionBracketIndex.find gives the row the CommissionConfig query would"""
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+
+    def _config(self, currency, min_amount, max_amount, active=True, manager=None):
+        return CommissionConfig.objects.create(
+                manager=manager or self.manager, currency=currency, active=active,
+                min_amount=Decimal(min_amount), max_amount=Decimal(max_amount),
+                commission_amount=Decimal('5.0000'), agent_share=Decimal('40.00')
+        )
+
+    def _query(self, currency, amount, manager_id=None):
+        configs = CommissionConfig.objects.filter(active=True, currency=currency,
+                                                  min_amount__lte=amount, max_amount__gte=amount)
+        if manager_id is not None:
+            configs = configs.filter(manager_id=manager_id)
+        return configs.first()
+
+    def test_edges_and_gaps(self):
+        low = self._config('EUR', '1.00', '100.00')
+        high = self._config('EUR', '101.00', '500.00')
+        index = CommissionBracketIndex(CommissionConfig.objects.filter(active=True))
+
+        cases = {
+            '0.99': None, '1.00': low, '100.00': low,
+            '100.50': None,  # Between two brackets
+            '101.00': high, '500.00': high, '500.01': None,
+        }
+        for amount, expected in cases.items():
+            with self.subTest(amount=amount):
+                self.assertEqual(index.find('EUR', Decimal(amount)), expected)
+                self.assertEqual(index.find('EUR', Decimal(amount)), self._query('EUR', Decimal(amount)))
+
+        # Strings and numbers are accepted, garbage is not
+        self.assertEqual(index.find('EUR', '100'), low)
+        self.assertEqual(index.find('EUR', 250), high)
+        self.assertIsNone(index.find('EUR', 'abc'))
+
+    def test_overlapping_brackets_follow_the_query_order(self):
+        other = User.objects.create(username='other', email='other@example.com', user_type='manager')
+        wide = self._config('EUR', '1.00', '1000.00')
+        narrow = self._config('EUR', '10.00', '20.00', manager=other)
+        index = CommissionBracketIndex(CommissionConfig.objects.filter(active=True))
+
+        self.assertEqual(index.find('EUR', Decimal('15')), wide)
+        self.assertEqual(index.find('EUR', Decimal('15'), manager_id=other.id), narrow)
+        self.assertEqual(index.find('EUR', Decimal('15'), manager_id=other.id),
+                         self._query('EUR', Decimal('15'), manager_id=other.id))
+        self.assertIsNone(index.find('EUR', Decimal('500'), manager_id=other.id))
+
+    def test_inactive_configs_and_other_currencies_are_ignored(self):
+        self._config('EUR', '1.00', '100.00', active=False)
+        usd = self._config('USD', '1.00', '100.00')
+
+        self.assertIsNone(find_commission_config('EUR', Decimal('50')))
+        self.assertEqual(find_commission_config('USD', Decimal('50')), usd)
+        self.assertIsNone(find_commission_config('BIF', Decimal('50')))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CommissionIndexInvalidationTest(TransactionTestCase):
+    """The process index is kept between requests and rebuilt when a config is saved or deleted"""
+
+    def setUp(self):
+        cache.clear()
+        commission_index.invalidate_commission_index()
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.config = CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('100.00'),
+                commission_amount=Decimal('5.0000'), agent_share=Decimal('40.00')
+        )
+
+    def tearDown(self):
+        commission_index.invalidate_commission_index()
+
+    def test_saves_and_deletes_rebuild_the_index(self):
+        self.assertEqual(find_commission_config('EUR', Decimal('50')), self.config)
+        index = commission_index.get_commission_index()
+        version = commission_index.get_commission_version()
+
+        # Without a signal nothing tells the index: it is kept as is
+        CommissionConfig.objects.filter(pk=self.config.pk).update(max_amount=Decimal('10.00'))
+        self.assertIs(commission_index.get_commission_index(), index)
+        self.assertEqual(find_commission_config('EUR', Decimal('50')), self.config)
+
+        self.config.max_amount = Decimal('40.00')
+        self.config.save()
+        self.assertNotEqual(commission_index.get_commission_version(), version)
+        self.assertIsNot(commission_index.get_commission_index(), index)
+        self.assertIsNone(find_commission_config('EUR', Decimal('50')))
+        self.assertEqual(find_commission_config('EUR', Decimal('40')), self.config)
+
+        self.config.active = False
+        self.config.save()
+        self.assertIsNone(find_commission_config('EUR', Decimal('40')))
+
+        replacement = CommissionConfig.objects.create(
+                manager=self.manager, currency='EUR', min_amount=Decimal('1.00'), max_amount=Decimal('100.00'),
+                commission_amount=Decimal('7.0000'), agent_share=Decimal('40.00')
+        )
+        self.assertEqual(find_commission_config('EUR', Decimal('50')), replacement)
+
+        replacement.delete()
+        self.assertIsNone(find_commission_config('EUR', Decimal('50')))
+
+
+class KeysetPaginationTest(TestCase):
+    """Keyset pages: no row skipped or repeated when created_at ties, bounded page size"""
+
+    def setUp(self):
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        for position in range(7):
+            Transfer.objects.create(beneficiary_name=f'Beneficiary {position}', beneficiary_phone='+25700000000',
+                                    method='CASH', amount=Decimal('100.00'), sent_currency='EUR',
+                                    received_currency='BIF', status='DRAFT')
+        # Only the id tells the rows apart, and the ties straddle the page boundaries
+        now = timezone.now()
+        ids = list(Transfer.objects.order_by('id').values_list('id', flat=True))
+        Transfer.objects.filter(id__in=ids[:5]).update(created_at=now - timedelta(hours=1))
+        Transfer.objects.filter(id__in=ids[5:]).update(created_at=now)
+
+    def test_pages_are_stable_when_created_at_ties(self):
+        expected = list(Transfer.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        queryset = Transfer.objects.all()
+
+        pages = [paginate_by_keyset(queryset, page_size=2)]
+        while pages[-1].has_next and len(pages) < 10:
+            pages.append(paginate_by_keyset(queryset, pages[-1].next_token, page_size=2))
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual([row.id for page in pages for row in page], expected)
+        self.assertFalse(pages[0].has_prev)
+
+        # Walking back gives the same pages
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = paginate_by_keyset(queryset, page.prev_token, page_size=2)
+            self.assertEqual([row.id for row in page], [row.id for row in previous])
+        self.assertFalse(page.has_prev)
+
+    @override_settings(TRANSFERS_PAGE_SIZE=2, TRANSFERS_MAX_PAGE_SIZE=3)
+    def test_page_size_is_clamped(self):
+        self.client.force_login(self.manager)
+        url = reverse('transfer_list')
+
+        cases = {None: 2, '1': 1, '3': 3, '1000': 3, '0': 1, '-5': 1, 'abc': 2}
+        for page_size, expected in cases.items():
+            with self.subTest(page_size=page_size):
+                response = self.client.get(url, {'page_size': page_size} if page_size else {})
+                self.assertEqual(len(response.context['page']), expected)
+                self.assertEqual(response.context['page'].page_size, expected)
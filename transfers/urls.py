@@ -6,10 +6,12 @@ urlpatterns = [
     # Transfer management
     path('', views.transfer_list, name='transfer_list'),
     path('create/', views.create_transfer, name='create_transfer'),
+    path('import/', views.import_transfers, name='import_transfers'),
     path('<int:transfer_id>/', views.transfer_detail, name='transfer_detail'),
     path('<int:transfer_id>/validate/', views.validate_transfer, name='validate_transfer'),
     path('<int:transfer_id>/execute/', views.execute_transfer, name='execute_transfer'),
     path('pending/', views.pending_transfers, name='pending_transfers'),
+    path('batch/', views.batch_transition_transfers, name='batch_transition_transfers'),
 
     # Commission configuration
     path('commissions/', views.commission_config_list, name='commission_config_list'),
@@ -19,11 +21,15 @@ urlpatterns = [
 
     # Commission preview (AJAX)
     path('commission-preview/', views.get_commission_preview, name='commission_preview'),
+    path('commission-previews/', views.commission_previews, name='commission_previews'),
 
     # Earnings
     path('commissions/overview/', views.commissions_overview, name='commissions_overview'),
     path('commissions/clear/', views.clear_commissions, name='clear_commissions'),
 
+    # Accounting exports (streamed CSV / JSON Lines)
+    path('export/<str:kind>/', views.export_data, name='export_data'),
+
     # draft transfers
     path('drafts/', views.draft_transfers, name='draft_transfers'),
     path('<int:transfer_id>/promote/', views.promote_draft_transfer, name='promote_draft_transfer'),
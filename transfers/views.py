@@ -1,20 +1,31 @@
 import datetime
+import uuid
+from decimal import Decimal, InvalidOperation
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
-from django.db.models.functions import TruncDay, TruncMonth, TruncWeek, TruncYear
+from django.db.models import Count, Sum
 from django.db.utils import IntegrityError
-from django.http import HttpResponseForbidden, JsonResponse
+from django.http import HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
-from django.views.decorators.http import require_http_methods
-
-from users.models import User, log_user_activity
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_http_methods
+
+from stock.rates import get_exchange_rate_version, get_rate_snapshot
+from users.models import User, UserActivity, log_user_activity
+from .commission_index import describe_bracket, find_commission_config, get_commission_index, get_commission_version
+from .commission_rollup import delete_distributions, rollup_by_period
+from .duplicates import find_idempotent_transfer, find_recent_duplicate, get_idempotency_key
+from .exports import EXPORT_FORMATS, EXPORT_KINDS, build_export_rows, iter_export_lines, parse_export_filters
 from .forms import CommissionConfigForm, TransferForm
-from .models import CommissionConfig, CommissionDistribution, TRANSFER_STATUS, Transfer
-from .services import bulk_promote_draft_transfers
+from .imports import IMPORT_COLUMNS, TransferImportError, import_transfers_csv
+from .models import CommissionConfig, CommissionDistribution, CommissionRollup, TRANSFER_STATUS, Transfer
+from .pagination import paginate_request
+from .search import search_transfers
+from .services import BATCH_TRANSITIONS, bulk_promote_draft_transfers, bulk_transition_transfers
 
 logger = __import__('logging').getLogger(__name__)
 
@@ -31,11 +42,18 @@ def transfer_list(request):
     if status:
         transfers = transfers.filter(status=status)
 
-    transfers = transfers.order_by('-created_at')
+    # Beneficiary name or phone, served by the normalized columns and trigram table
+    query = request.GET.get('q', '').strip()
+    if query:
+        transfers = search_transfers(transfers, query)
+
+    transfers = paginate_request(request, transfers)
 
     context = {
         'transfers': transfers,
+        'page': transfers,
         'current_status': status,
+        'query': query,
         'status_choices': TRANSFER_STATUS,
     }
 
@@ -45,20 +63,48 @@ def transfer_list(request):
 @login_required
 def create_transfer(request):
     """Create new transfer - agents and managers"""
+    duplicate = None
+    idempotency_key = get_idempotency_key(request) if request.method == 'POST' else None
+
     if request.method == 'POST':
+        # A retried request (same Idempotency-Key) gets the transfer the first one created
+        original = find_idempotent_transfer(request.user, idempotency_key)
+        if original:
+            messages.info(request, f'Transfer {original.reference_id} déjà créé par cette demande.')
+            return redirect('transfer_detail', transfer_id=original.id)
+
         form = TransferForm(request.POST)
-        if form.is_valid():
+        if form.is_valid() and not request.POST.get('confirm_duplicate'):
+            # Same agent, phone, amount, currency and method within the window: ask for confirmation
+            form.instance.agent = request.user
+            duplicate = find_recent_duplicate(form.instance)
+
+        if duplicate:
+            log_user_activity(
+                    request.user,
+                    'transfer_duplicate_blocked',
+                    {
+                        'duplicate_of': duplicate.id,
+                        'reference_id': duplicate.reference_id,
+                        'amount': str(form.instance.amount),
+                        'currency': form.instance.sent_currency,
+                    },
+                    request
+            )
+            messages.warning(
+                    request,
+                    f'Un transfert identique ({duplicate.reference_id}) a été déclaré le '
+                    f'{timezone.localtime(duplicate.created_at):%d/%m/%Y à %H:%M}. '
+                    f'Cochez la confirmation pour le déclarer quand même.'
+            )
+        elif form.is_valid():
             try:
                 transfer = form.save(commit=False)
                 transfer.agent = request.user
+                transfer.idempotency_key = idempotency_key
 
                 # Check if commission config exists for this transfer
-                commission_config = CommissionConfig.objects.filter(
-                        currency=transfer.sent_currency,
-                        min_amount__lte=transfer.amount,
-                        max_amount__gte=transfer.amount,
-                        active=True
-                ).first()
+                commission_config = transfer.get_commission_config()
 
                 if commission_config:
                     # Commission config exists - transfer can go to PENDING
@@ -134,6 +180,13 @@ def create_transfer(request):
 
                 return redirect('transfer_detail', transfer_id=transfer.id)
 
+            except IntegrityError:
+                # Concurrent request with the same idempotency key won the insert
+                original = find_idempotent_transfer(request.user, idempotency_key)
+                if not original:
+                    raise
+                return redirect('transfer_detail', transfer_id=original.id)
+
             except ValidationError as e:
                 messages.error(request, str(e))
                 log_user_activity(
@@ -148,11 +201,14 @@ def create_transfer(request):
         form = TransferForm()
 
     # Get available commission configs for preview
-    commission_configs = CommissionConfig.objects.filter(active=True).order_by('currency', 'min_amount')
+    commission_configs = get_commission_index().configs
 
     context = {
         'form': form,
         'commission_configs': commission_configs,
+        'duplicate': duplicate,
+        # Kept across re-renders: the key only gets used by a request that creates a transfer
+        'idempotency_key': idempotency_key or uuid.uuid4().hex,
     }
 
     return render(request, 'transfers/create_transfer.html', context)
@@ -179,6 +235,11 @@ def check_promotable_transfers(request, config_id):
                 amount__lte=commission_config.max_amount
         ).select_related('agent')
 
+        matching_count = matching_transfers.count()
+
+        # Latest background auto-promotion run for this config, for progress polling
+        promotion_task = commission_config.promotion_tasks.order_by('-created_at').first()
+
         # Build response with transfer details for preview
         transfer_details = []
         for transfer in matching_transfers[:5]:  # Limit to first 5 for preview
@@ -192,9 +253,10 @@ def check_promotable_transfers(request, config_id):
 
         return JsonResponse({
             'success': True,
-            'count': len(matching_transfers),
+            'count': matching_count,
             'transfers_preview': transfer_details,
-            'has_more': len(matching_transfers) > 5,
+            'has_more': matching_count > 5,
+            'promotion_task': promotion_task.as_status_dict() if promotion_task else None,
             'config_details': {
                 'currency': commission_config.currency,
                 'min_amount': str(commission_config.min_amount),
@@ -296,7 +358,7 @@ def draft_transfers(request):
     """List draft transfers based on user permissions"""
     if request.user.is_manager():
         # Managers see all draft transfers
-        transfers = Transfer.objects.filter(status='DRAFT').select_related('agent').order_by('-created_at')
+        transfers = Transfer.objects.filter(status='DRAFT').select_related('agent')
         template_context = {
             'is_manager_view': True,
             'title': 'Tous les Transferts en Brouillon'
@@ -306,20 +368,68 @@ def draft_transfers(request):
         transfers = Transfer.objects.filter(
                 status='DRAFT',
                 agent=request.user
-        ).select_related('agent').order_by('-created_at')
+        ).select_related('agent')
         template_context = {
             'is_manager_view': False,
             'title': 'Mes Transferts en Brouillon'
         }
 
+    transfers = paginate_request(request, transfers)
+
     context = {
         'transfers': transfers,
+        'page': transfers,
         **template_context
     }
 
     return render(request, 'transfers/draft_transfers.html', context)
 
 
+@login_required
+def import_transfers(request):
+    """Import transfers from a CSV file - agents and managers, transfers are declared for the current user"""
+    context = {'columns': IMPORT_COLUMNS}
+
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        if not upload:
+            messages.error(request, "Veuillez choisir un fichier CSV.")
+            return render(request, 'transfers/import_transfers.html', context)
+
+        try:
+            result = import_transfers_csv(
+                    upload,
+                    request.user,
+                    ip_address=request.META.get('REMOTE_ADDR'),
+                    max_rows=getattr(settings, 'TRANSFER_IMPORT_MAX_ROWS', 10000)
+            )
+        except TransferImportError as e:
+            messages.error(request, str(e))
+            return render(request, 'transfers/import_transfers.html', context)
+
+        log_user_activity(
+                request.user,
+                'transfers_imported',
+                {
+                    'filename': upload.name,
+                    'created': result['created'],
+                    'pending': result['pending'],
+                    'drafts': result['drafts'],
+                    'failed': result['failed']
+                },
+                request
+        )
+
+        if result['created']:
+            messages.success(request, f"{result['created']} transfert(s) importé(s), dont {result['drafts']} en brouillon.")
+        if result['failed']:
+            messages.warning(request, f"{result['failed']} ligne(s) rejetée(s), voir le rapport ci-dessous.")
+
+        context['result'] = result
+
+    return render(request, 'transfers/import_transfers.html', context)
+
+
 @login_required
 def transfer_detail(request, transfer_id):
     """View transfer details"""
@@ -337,11 +447,21 @@ def transfer_detail(request, transfer_id):
         'commission': commission,
         'can_validate': transfer.can_be_validated_by(request.user),
         'can_execute': transfer.can_be_executed_by(request.user),
+        'audit_trail': UserActivity.objects.for_entity(transfer) if request.user.is_manager() else None,
     }
 
     return render(request, 'transfers/transfer_detail.html', context)
 
 
+def _lost_transition_response(transfer, required_status):
+    """Response when another request changed the transfer status first"""
+    return JsonResponse({
+        'error': f'Transfer was updated by another request. Current status: {transfer.get_status_display()}. '
+                 f'Required status: {required_status}.',
+        'current_status': transfer.status
+    }, status=409)
+
+
 @login_required
 @require_http_methods(["POST"])
 def validate_transfer(request, transfer_id):
@@ -360,11 +480,8 @@ def validate_transfer(request, transfer_id):
     comment = request.POST.get('comment', '')
 
     if action == 'validate':
-        transfer.status = 'VALIDATED'
-        transfer.validated_by = request.user
-        transfer.validated_at = timezone.now()
-        transfer.validation_comment = comment
-        transfer.save()
+        if not transfer.validate(request.user, comment):
+            return _lost_transition_response(transfer, 'PENDING')
 
         # Calculate and create commission
         create_commission_for_transfer(transfer)
@@ -379,11 +496,8 @@ def validate_transfer(request, transfer_id):
         messages.success(request, f'Transfer #{transfer.id} validated successfully')
 
     elif action == 'reject':
-        transfer.status = 'CANCELED'
-        transfer.validated_by = request.user
-        transfer.validated_at = timezone.now()
-        transfer.validation_comment = comment
-        transfer.save()
+        if not transfer.reject(request.user, comment):
+            return _lost_transition_response(transfer, 'PENDING')
 
         log_user_activity(
                 request.user,
@@ -414,11 +528,8 @@ def execute_transfer(request, transfer_id):
     comment = request.POST.get('comment', '').strip()
 
     try:
-        transfer.status = 'COMPLETED'
-        transfer.executed_by = request.user
-        transfer.executed_at = timezone.now()
-        transfer.execution_comment = comment
-        transfer.save()
+        if not transfer.execute(request.user, comment):
+            return _lost_transition_response(transfer, 'VALIDATED')
 
         log_user_activity(
                 request.user,
@@ -444,18 +555,65 @@ def execute_transfer(request, transfer_id):
         return JsonResponse({'error': f'Failed to complete transfer: {str(e)}'}, status=500)
 
 
+@login_required
+@require_http_methods(["POST"])
+def batch_transition_transfers(request):
+    """
+    Validate, reject or execute many transfers in one transaction - managers and superusers only.
+    Expects a JSON body: {"action": "validate" | "reject" | "execute", "transfer_ids": [...], "comment": ""}
+    """
+    if not request.user.is_manager():
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    try:
+        import json
+        data = json.loads(request.body)
+        action = data.get('action')
+        transfer_ids = [int(transfer_id) for transfer_id in data.get('transfer_ids', [])]
+        comment = str(data.get('comment', '')).strip()
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+
+    if action not in BATCH_TRANSITIONS:
+        return JsonResponse({'error': f'Unknown action: {action}'}, status=400)
+
+    if not transfer_ids:
+        return JsonResponse({'error': 'No transfer selected'}, status=400)
+
+    max_size = getattr(settings, 'TRANSFER_BATCH_MAX_SIZE', 500)
+    if len(transfer_ids) > max_size:
+        return JsonResponse({'error': f'Too many transfers in one batch (max {max_size})'}, status=400)
+
+    if action == 'reject' and not comment:
+        return JsonResponse({'error': 'A comment is required to reject transfers'}, status=400)
+
+    results = bulk_transition_transfers(transfer_ids, action, request.user, comment, request.META.get('REMOTE_ADDR'))
+    succeeded = sum(1 for result in results.values() if result['success'])
+
+    return JsonResponse({
+        'success': succeeded > 0,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': {str(transfer_id): result for transfer_id, result in results.items()}
+    })
+
+
 @login_required
 def pending_transfers(request):
     """List pending transfers for managers and superusers"""
     if not request.user.is_manager():
         return HttpResponseForbidden("Access denied")
 
-    transfers_pending = Transfer.objects.filter(status='PENDING').select_related('agent').order_by('-created_at')
-    total_amount = transfers_pending.aggregate(total=Sum('amount'))['total'] or 0
+    transfers_pending = Transfer.objects.filter(status='PENDING').select_related('agent')
+    # Totals come from one aggregate over the status index; the list itself is paginated
+    totals = transfers_pending.aggregate(total=Sum('amount'), count=Count('id'))
+    page = paginate_request(request, transfers_pending)
     return render(request, 'transfers/pending_transfers.html',
                   {
-                      'transfers': transfers_pending,
-                      'total_amount': total_amount,
+                      'transfers': page,
+                      'page': page,
+                      'total_amount': totals['total'] or 0,
+                      'total_count': totals['count'],
                   })
 
 
@@ -619,13 +777,11 @@ def update_commission_config(request, config_id):
 def create_commission_for_transfer(transfer):
     """Helper function to create commission for a validated transfer"""
     # Find applicable commission config for the transfer currency and amount
-    config = CommissionConfig.objects.filter(
-            manager=transfer.validated_by,
-            currency=transfer.sent_currency,  # Commission config must match transfer currency
-            min_amount__lte=transfer.amount,
-            max_amount__gte=transfer.amount,
-            active=True
-    ).first()
+    if not transfer.validated_by_id:
+        return False
+
+    # Commission config must match transfer currency and belong to the validating manager
+    config = transfer.get_commission_config(manager_id=transfer.validated_by_id)
 
     if config:
         commission_data = CommissionDistribution.calculate_commission(transfer, config)
@@ -657,17 +813,14 @@ def get_commission_preview(request):
             return JsonResponse({'error': 'Amount and currency required'})
 
         try:
-            amount = float(amount)
-        except ValueError:
+            amount = Decimal(amount)
+        except InvalidOperation:
+            return JsonResponse({'error': 'Invalid amount'})
+        if not amount.is_finite():
             return JsonResponse({'error': 'Invalid amount'})
 
         # Find applicable commission config
-        config = CommissionConfig.objects.filter(
-                currency=currency,
-                min_amount__lte=amount,
-                max_amount__gte=amount,
-                active=True
-        ).first()
+        config = find_commission_config(currency, amount)
 
         if config:
             # Calculate commission preview
@@ -695,6 +848,59 @@ def get_commission_preview(request):
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def _commission_previews_etag(request):
+    # Answers only depend on the query string and the active configs
+    return get_commission_version()
+
+
+@login_required
+@require_http_methods(["GET"])
+@condition(etag_func=_commission_previews_etag)
+def commission_previews(request):
+    """
+    Commission previews for several amounts at once, answered from the bracket index.
+
+    Query: repeated amount/currency pairs (?amount=100&currency=EUR&amount=900&currency=USD),
+    and brackets=1 to also get the whole active bracket table so the form can resolve
+    previews locally. The ETag is the commission config version: revalidating costs a
+    cache read and returns 304 until a config changes.
+    """
+    amounts = request.GET.getlist('amount')
+    currencies = request.GET.getlist('currency')
+    max_items = getattr(settings, 'COMMISSION_PREVIEW_MAX_ITEMS', 100)
+
+    if len(amounts) != len(currencies):
+        return JsonResponse({'error': 'Chaque montant doit avoir une devise.'}, status=400)
+    if len(amounts) > max_items:
+        return JsonResponse({'error': f'Maximum {max_items} montants par requête.'}, status=400)
+
+    index = get_commission_index()
+    previews = []
+    for amount, currency in zip(amounts, currencies):
+        try:
+            value = Decimal(amount)
+        except InvalidOperation:
+            value = None
+        if value is None or not value.is_finite():
+            previews.append({'amount': amount, 'currency': currency, 'error': 'Montant invalide'})
+            continue
+
+        config = index.find(currency, value)
+        preview = {'amount': amount, 'currency': currency, 'config_found': config is not None}
+        if config:
+            preview.update(describe_bracket(config))
+        previews.append(preview)
+
+    data = {'success': True, 'version': get_commission_version(), 'previews': previews}
+    if request.GET.get('brackets'):
+        data['brackets'] = index.bracket_table()
+
+    response = JsonResponse(data)
+    # Always revalidate: the ETag makes that a 304 until the configs change
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @login_required
 def commissions_overview(request):
     """ list current user commission for a specified period, managers can view all user's commissions"""
@@ -702,14 +908,6 @@ def commissions_overview(request):
     user = request.user
     period = request.GET.get('period', 'month')  # 'day', 'week', 'month', 'year'
 
-    trunc_map = {
-        'day': TruncDay,
-        'week': TruncWeek,
-        'month': TruncMonth,
-        'year': TruncYear,
-    }
-    trunc_function = trunc_map.get(period, TruncMonth)
-
     period_label_map = {
         'day': 'jour',
         'week': 'semaine',
@@ -718,22 +916,16 @@ def commissions_overview(request):
     }
     period_label = period_label_map.get(period, 'mois')
 
+    # Period totals come from the daily rollup (see transfers/commission_rollup.py)
     # agents only see their earnings
     if not user.is_manager():
-        commissions = (
-            CommissionDistribution.objects
-            .filter(agent=user)
-            .annotate(period=trunc_function('created_at'))
-            .values('period')
-            .annotate(total=Sum('declaring_agent_amount'))
-            .order_by('period')
-        )
+        commissions = rollup_by_period(CommissionRollup.objects.filter(agent=user), period).order_by('period')
 
-        detailed = (
-            CommissionDistribution.objects
-            .filter(agent=user)
-            .select_related('transfer__validated_by', 'config_used')
-            .order_by('-created_at')
+        detailed = paginate_request(
+                request,
+                CommissionDistribution.objects
+                .filter(agent=user)
+                .select_related('transfer__validated_by', 'config_used')
         )
 
         context = {
@@ -741,23 +933,15 @@ def commissions_overview(request):
             'period': period,
             'commissions': commissions,
             'detailed_commissions': detailed,
+            'page': detailed,
             'period_label': period_label,
         }
     else:
         # Managers can visualize the commisions and all agent's earnings
-        global_commissions = (
-            CommissionDistribution.objects
-            .annotate(period=trunc_function('created_at'))
-            .values('period')
-            .annotate(
-                    total_agent=Sum('declaring_agent_amount'),
-                    total_manager=Sum('manager_amount')
-            )
-            .order_by('-period')
-        )
+        global_commissions = rollup_by_period(CommissionRollup.objects.all(), period).order_by('-period')
 
         per_agent_totals = (
-            CommissionDistribution.objects
+            CommissionRollup.objects
             .values('agent__id', 'agent__username')
             .annotate(
                     total=Sum('declaring_agent_amount'),
@@ -767,10 +951,10 @@ def commissions_overview(request):
             .order_by('total')
         )
 
-        detailed = (
-            CommissionDistribution.objects
-            .select_related('transfer__validated_by', 'config_used', 'agent')
-            .order_by('-created_at')
+        detailed = paginate_request(
+                request,
+                CommissionDistribution.objects
+                .select_related('transfer__validated_by', 'config_used', 'agent')
         )
 
         context = {
@@ -779,6 +963,7 @@ def commissions_overview(request):
             'global_commissions': global_commissions,
             'per_agent_totals': per_agent_totals,
             'detailed_commissions': detailed,
+            'page': detailed,
             'period_label': period_label,
         }
 
@@ -810,8 +995,7 @@ def clear_commissions(request):
         # Supprimer par ID
         if commission_id:
             qs = qs.filter(id=commission_id)
-            count = qs.count()
-            qs.delete()
+            count = delete_distributions(qs)
             messages.success(request, f"{count} commission(s) supprimée(s) par ID.")
             return redirect('commissions_overview')
 
@@ -832,8 +1016,7 @@ def clear_commissions(request):
         elif mode == 'year' and year_str:
             qs = qs.filter(created_at__year=int(year_str))
 
-        count = qs.count()
-        qs.delete()
+        count = delete_distributions(qs)
         messages.success(request, f"{count} commission(s) supprimée(s).")
         return redirect('commissions_overview')
 
@@ -841,53 +1024,91 @@ def clear_commissions(request):
 
 
 @login_required
+def export_data(request, kind):
+    """Stream transfers or commission distributions as CSV / JSON Lines - managers and superusers only"""
+    if not request.user.is_manager():
+        return HttpResponseForbidden("Access denied")
+
+    export_format = request.GET.get('format', 'csv')
+    if kind not in EXPORT_KINDS or export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'Export inconnu'}, status=404)
+
+    try:
+        filters = parse_export_filters(request.GET)
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+
+    headers, rows = build_export_rows(kind, filters)
+
+    log_user_activity(
+            request.user,
+            'data_exported',
+            {
+                'kind': kind,
+                'format': export_format,
+                'filters': {key: str(value) for key, value in filters.items()},
+            },
+            request
+    )
+
+    filename = f"{kind}-{timezone.localdate():%Y%m%d}.{export_format}"
+    content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+    response = StreamingHttpResponse(iter_export_lines(headers, rows, export_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _exchange_rate_etag(request):
+    return get_exchange_rate_version()
+
+
+@login_required
+@require_http_methods(["GET"])
+@condition(etag_func=_exchange_rate_etag)
 def get_exchange_rate(request):
-    """AJAX endpoint to get 'exchange rate' for transfer creation preview"""
-    if request.method == 'GET':
-        from_currency = request.GET.get('from')
-        to_currency = request.GET.get('to')
+    """
+    AJAX endpoint to get 'exchange rate' for transfer creation preview.
+    Served from the rate snapshot (see stock/rates.py); the ETag is the snapshot version.
+    """
+    from_currency = request.GET.get('from')
+    to_currency = request.GET.get('to')
 
-        if not from_currency or not to_currency:
-            return JsonResponse({'error': 'From and to currencies required'})
+    if not from_currency or not to_currency:
+        return JsonResponse({'error': 'From and to currencies required'})
 
-        if from_currency == to_currency:
-            return JsonResponse({
-                'success': True,
-                'rate_found': True,
-                'rate': '1.0000',
-                'from_currency': from_currency,
-                'to_currency': to_currency,
-                'rate_date': 'Same currency'
-            })
+    if from_currency == to_currency:
+        return JsonResponse({
+            'success': True,
+            'rate_found': True,
+            'rate': '1.0000',
+            'from_currency': from_currency,
+            'to_currency': to_currency,
+            'source': 'identity',
+            'via': None,
+            'rate_date': 'Same currency'
+        })
 
-        try:
-            # Import here to avoid circular imports
-            from stock.models import ExchangeRate
-
-            # Get the most recent active exchange rate
-            exchange_rate = ExchangeRate.objects.filter(
-                    from_currency=from_currency,
-                    to_currency=to_currency,
-                    active=True
-            ).order_by('-created_at').first()
-
-            if exchange_rate:
-                return JsonResponse({
-                    'success': True,
-                    'rate_found': True,
-                    'rate': str(exchange_rate.rate),
-                    'from_currency': from_currency,
-                    'to_currency': to_currency,
-                    'rate_date': exchange_rate.created_at.strftime('%d/%m/%Y')
-                })
-            else:
-                return JsonResponse({
-                    'success': True,
-                    'rate_found': False,
-                    'message': f'Aucun taux de change configuré pour {from_currency} → {to_currency}'
-                })
+    # Direct, inverse or triangulated through another currency
+    conversion = get_rate_snapshot().get_conversion(from_currency, to_currency)
 
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=500)
+    if conversion:
+        response = JsonResponse({
+            'success': True,
+            'rate_found': True,
+            'rate': str(conversion['rate']),
+            'from_currency': from_currency,
+            'to_currency': to_currency,
+            'source': conversion['source'],
+            'via': conversion['via'],
+            'rate_date': timezone.localtime(conversion['created_at']).strftime('%d/%m/%Y')
+        })
+    else:
+        response = JsonResponse({
+            'success': True,
+            'rate_found': False,
+            'message': f'Aucun taux de change configuré pour {from_currency} → {to_currency}'
+        })
 
-    return JsonResponse({'error': 'Method not allowed'}, status=405)
+    # Always revalidate: the ETag makes that a 304 until a rate changes
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
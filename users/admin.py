@@ -35,9 +35,9 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(UserActivity)
 class UserActivityAdmin(admin.ModelAdmin):
     list_display = ('user', 'action', 'timestamp', 'ip_address')
-    list_filter = ('action', 'timestamp', 'user__user_type')
-    search_fields = ('user__username', 'action', 'ip_address')
-    readonly_fields = ('user', 'action', 'details', 'ip_address', 'timestamp')
+    list_filter = ('action', 'entity_type', 'timestamp', 'user__user_type')
+    search_fields = ('user__username', 'action', 'ip_address', '=entity_id')
+    readonly_fields = ('user', 'action', 'details', 'ip_address', 'timestamp', 'entity_type', 'entity_id')
     ordering = ('-timestamp',)
 
     def has_add_permission(self, request):
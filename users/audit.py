@@ -0,0 +1,281 @@
+"""
+Buffered audit writer for UserActivity.
+
+Audit records are not inserted one by one on the request path:
+
+- Inside audit_batch() (every request, sync or async, through
+  ActivityLoggingMiddleware, and the background tasks) records are collected and
+  written with one bulk_create when the batch ends, or earlier once
+  AUDIT_BATCH_SIZE records are waiting. The batch lives in a context variable, so
+  concurrent async requests sharing a thread each keep their own.
+- Elsewhere (shell, management commands, threads) they go to a bounded in-process
+  queue that a background thread writes every AUDIT_FLUSH_INTERVAL seconds. A full
+  queue makes the caller write its record itself, and an atexit hook drains the
+  queue, so a clean shutdown loses nothing.
+
+A record that cannot be written (e.g. SQLite "database is locked" while a request
+holds the write lock) is not dropped: it is retried by the background writer with
+exponential backoff (AUDIT_RETRY_DELAY, doubling, AUDIT_WRITE_RETRIES times), and
+the atexit hook retries whatever is still waiting.
+
+A record logged inside a transaction is only buffered once it commits, so work that
+rolls back leaves no audit rows, as when they were inserted in the transaction.
+Timestamps are taken when the record is logged, not when it is written.
+
+Set AUDIT_BACKGROUND_WRITES = False to write records outside a batch synchronously
+(tests, scripts that read the audit trail back right away).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Records of the current audit_batch(), per context (request, task, thread)
+_batch = ContextVar('audit_batch', default=None)
+
+_queue = None
+_writer = None
+_writer_lock = threading.Lock()
+_stopping = threading.Event()
+# (due time, activity) of the records waiting for another write attempt
+_retries = deque()
+
+RETRY_MAX_DELAY = 30
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def write_activities(activities):
+    """
+    Insert audit records with one bulk_create. If that fails, retry them one by one
+    so a single bad record (e.g. its user was deleted meanwhile) does not drop the rest.
+
+    Returns:
+        int: Number of records written
+    """
+    from .models import UserActivity
+
+    if not activities:
+        return 0
+
+    try:
+        with transaction.atomic():
+            UserActivity.objects.bulk_create(activities, batch_size=_setting('AUDIT_BATCH_SIZE', 500))
+        return len(activities)
+    except Exception as e:
+        logger.warning(f"Audit bulk write of {len(activities)} records failed, writing them one by one: {e}")
+
+    written = 0
+    failed = []
+    for activity in activities:
+        try:
+            activity.pk = None
+            with transaction.atomic():
+                activity.save()
+            written += 1
+        except Exception as e:
+            logger.warning(f"Audit record '{activity.action}' not written, will retry: {e}")
+            failed.append(activity)
+
+    if failed:
+        _schedule_retry(failed)
+    return written
+
+
+def _schedule_retry(activities):
+    """Queue records for another write attempt, after a delay doubling at each attempt"""
+    max_attempts = _setting('AUDIT_WRITE_RETRIES', 5)
+    base_delay = _setting('AUDIT_RETRY_DELAY', 0.5)
+
+    for activity in activities:
+        attempts = getattr(activity, '_audit_attempts', 0) + 1
+        if attempts > max_attempts:
+            logger.error(f"Audit record '{activity.action}' lost after {max_attempts} retries")
+            continue
+        activity._audit_attempts = attempts
+        activity.pk = None
+        _retries.append((time.monotonic() + min(base_delay * 2 ** (attempts - 1), RETRY_MAX_DELAY), activity))
+
+    if not _stopping.is_set():
+        _start_writer()
+
+
+def _take_retries(due_only=True):
+    """Remove and return the records waiting for a retry (only those due by default)"""
+    now = time.monotonic()
+    taken, waiting = [], []
+    while True:
+        try:
+            due, activity = _retries.popleft()
+        except IndexError:
+            break
+        if due_only and due > now:
+            waiting.append((due, activity))
+        else:
+            taken.append(activity)
+    _retries.extend(waiting)
+    return taken
+
+
+def open_batch():
+    """
+    Start collecting the audit records logged in this context.
+
+    Returns:
+        Token to pass to close_batch(), None when a batch is already open
+        (nested batches join the outermost one)
+    """
+    if _batch.get() is not None:
+        return None
+    return _batch.set([])
+
+
+def close_batch(token):
+    """
+    End the batch open_batch() started, in the same context.
+
+    Returns:
+        list: Its records, for write_activities() (empty for a nested batch)
+    """
+    if token is None:
+        return []
+    batch = _batch.get()
+    _batch.reset(token)
+    return batch
+
+
+@contextmanager
+def audit_batch():
+    """
+    Collect the audit records logged in this context and write them together on exit.
+    Nested batches join the outermost one.
+    """
+    token = open_batch()
+    try:
+        yield
+    finally:
+        write_activities(close_batch(token))
+
+
+def flush_batch():
+    """Write the records of the current batch now (the batch stays open)"""
+    batch = _batch.get()
+    if batch:
+        pending = batch[:]
+        batch.clear()
+        write_activities(pending)
+
+
+def _enqueue(activity):
+    batch = _batch.get()
+    if batch is not None:
+        batch.append(activity)
+        if len(batch) >= _setting('AUDIT_BATCH_SIZE', 500):
+            flush_batch()
+        return
+
+    if not _setting('AUDIT_BACKGROUND_WRITES', True) or _stopping.is_set():
+        write_activities([activity])
+        return
+
+    _start_writer()
+    try:
+        _queue.put_nowait(activity)
+    except queue.Full:
+        # Back-pressure instead of dropping: the caller pays for its own insert
+        write_activities([activity])
+
+
+def record_activity(activity):
+    """
+    Buffer an unsaved UserActivity for writing.
+    Inside a transaction it is buffered on commit, and dropped on rollback.
+    """
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _enqueue(activity))
+    else:
+        _enqueue(activity)
+
+
+def _writer_loop():
+    interval = _setting('AUDIT_FLUSH_INTERVAL', 1.0)
+    batch_size = _setting('AUDIT_BATCH_SIZE', 500)
+
+    while not _stopping.is_set():
+        pending = _take_retries()
+        try:
+            pending.append(_queue.get(timeout=interval))
+        except queue.Empty:
+            if not pending:
+                continue
+
+        while len(pending) < batch_size:
+            try:
+                pending.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            close_old_connections()
+            write_activities(pending)
+        except Exception as e:
+            logger.error(f"Audit writer failed on {len(pending)} records: {e}", exc_info=True)
+
+
+def _start_writer():
+    global _queue, _writer
+
+    if _writer is not None and _writer.is_alive():
+        return
+
+    with _writer_lock:
+        if _writer is not None and _writer.is_alive():
+            return
+        if _queue is None:
+            _queue = queue.Queue(maxsize=_setting('AUDIT_QUEUE_SIZE', 10000))
+        _writer = threading.Thread(target=_writer_loop, name='audit-writer', daemon=True)
+        _writer.start()
+
+
+def drain_queue():
+    """
+    Write everything still queued or waiting for a retry, from the calling thread.
+    Failed records are retried here, with the same backoff, until written or given up.
+
+    Returns:
+        int: Number of records written
+    """
+    pending = []
+    while _queue is not None:
+        try:
+            pending.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    written = write_activities(pending + _take_retries(due_only=False))
+
+    while _retries:
+        time.sleep(max(0, min(due for due, _activity in _retries) - time.monotonic()))
+        written += write_activities(_take_retries())
+    return written
+
+
+@atexit.register
+def shutdown():
+    """Stop the background writer and write what it had not written yet"""
+    _stopping.set()
+    if _writer is not None:
+        _writer.join(timeout=_setting('AUDIT_FLUSH_INTERVAL', 1.0) + 5)
+    written = drain_queue()
+    if written:
+        logger.info(f"Audit writer flushed {written} records at shutdown")
@@ -0,0 +1,223 @@
+"""
+Per-model audit detail extractors.
+
+Each audited model label maps to a list of (detail key, attribute) pairs, compiled
+once into an extractor on first use. Extractors only read local columns and *_id
+values, never related objects, so building the details of a save costs no query
+and does not depend on how many models are registered.
+
+Models in AUDIT_EXCLUDED_MODELS (the defaults below plus settings.AUDIT_EXCLUDED_MODELS)
+are not audited at all: framework tables and tables derived from other models
+(search grams, rollups, checkpoints...) whose changes are already covered by the
+save that produced them. Other models get the base details (model, object_id).
+"""
+import datetime
+import logging
+import uuid
+from decimal import Decimal
+from operator import attrgetter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCLUDED_MODELS = frozenset({
+    'users.UserActivity',
+    'sessions.Session',
+    'admin.LogEntry',
+    'contenttypes.ContentType',
+    'django_q.Task',
+    'django_q.Success',
+    'django_q.Failure',
+    'django_q.OrmQ',
+    'transfers.ReferenceSequence',
+    'transfers.TransferSearchTrigram',
+    'transfers.CommissionRollup',
+    'stock.StockBalanceCheckpoint',
+})
+
+
+def _full_name(instance):
+    return f'{instance.first_name} {instance.last_name}'.strip() or instance.username
+
+
+# Detail key -> attribute name (local column or *_id) or callable(instance)
+AUDIT_DETAIL_FIELDS = {
+    # Users - who can do what
+    'users.User': {
+        'username': 'username',
+        'user_type': 'user_type',
+        'name': _full_name,
+        'email': 'email',
+        'is_active': 'is_active_user',
+        'created_by_id': 'created_by_id',
+    },
+    # Transfers - critical for financial audit
+    'transfers.Transfer': {
+        'reference_id': 'reference_id',
+        'beneficiary_name': 'beneficiary_name',
+        'amount': 'amount',
+        'currency': 'sent_currency',
+        'received_currency': 'received_currency',
+        'status': 'status',
+        'agent_id': 'agent_id',
+    },
+    # Stocks - cash management
+    'stock.Stock': {
+        'currency': 'currency',
+        'location': 'location',
+        'amount': 'amount',
+        'name': 'name',
+    },
+    # Stock movements - cash flow tracking
+    'stock.StockMovement': {
+        'movement_type': 'type',
+        'amount': 'amount',
+        'stock_id': 'stock_id',
+        'destination_stock_id': 'destination_stock_id',
+        'destination_amount': 'destination_amount',
+        'reason': 'reason',
+    },
+    # Exchange rates - affect all conversions
+    'stock.ExchangeRate': {
+        'from_currency': 'from_currency',
+        'to_currency': 'to_currency',
+        'rate': 'rate',
+        'active': 'active',
+    },
+    # Commission configurations - affect profit calculations
+    'transfers.CommissionConfig': {
+        'currency': 'currency',
+        'min_amount': 'min_amount',
+        'max_amount': 'max_amount',
+        'commission_amount': 'commission_amount',
+        'agent_share': 'agent_share',
+        'active': 'active',
+        'manager_id': 'manager_id',
+    },
+    # Commission distributions - actual payments made
+    'transfers.CommissionDistribution': {
+        'transfer_id': 'transfer_id',
+        'total_commission': 'total_commission',
+        'agent_amount': 'declaring_agent_amount',
+        'manager_amount': 'manager_amount',
+        'agent_id': 'agent_id',
+    },
+}
+
+# Details key -> model an activity is about, first match wins. Activities without
+# one of these keys are about the object saved or deleted (model, object_id), so a
+# commission distribution belongs to its transfer and a movement to its stock.
+ENTITY_KEYS = (
+    ('transfer_id', 'transfers.Transfer'),
+    ('stock_id', 'stock.Stock'),
+    ('config_id', 'transfers.CommissionConfig'),
+    ('commission_config_id', 'transfers.CommissionConfig'),
+    ('rate_id', 'stock.ExchangeRate'),
+)
+
+# Details key -> second model an activity concerns, besides its entity: a transfer
+# between stocks is filed under its source stock and also shows on the destination's
+RELATED_ENTITY_KEYS = (
+    ('destination_stock_id', 'stock.Stock'),
+)
+
+_extractors = {}
+_excluded = None
+
+
+def _json_value(value):
+    """Details are stored in a JSONField"""
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _compile(label):
+    getters = [
+        (key, source if callable(source) else attrgetter(source))
+        for key, source in AUDIT_DETAIL_FIELDS.get(label, {}).items()
+    ]
+
+    def extract(instance):
+        details = {'model': label, 'object_id': instance.pk}
+        for key, getter in getters:
+            details[key] = _json_value(getter(instance))
+        return details
+
+    return extract
+
+
+def is_audited(label):
+    """False for the models excluded from the audit trail"""
+    global _excluded
+
+    if _excluded is None:
+        _excluded = DEFAULT_EXCLUDED_MODELS | frozenset(getattr(settings, 'AUDIT_EXCLUDED_MODELS', ()))
+    return label not in _excluded
+
+
+def get_extractor(label):
+    """The compiled extractor of a model label"""
+    extractor = _extractors.get(label)
+    if extractor is None:
+        extractor = _extractors[label] = _compile(label)
+    return extractor
+
+
+def extract_model_details(instance):
+    """
+    Audit details of a model instance: model label, object id and the registered
+    columns of its model. Never queries the database.
+    """
+    label = instance._meta.label
+    try:
+        return get_extractor(label)(instance)
+    except Exception as e:
+        # A wrong registry entry must not break the save being audited
+        logger.error(f"Error extracting audit details for {label}: {e}", exc_info=True)
+        return {'model': label, 'object_id': instance.pk, 'extraction_error': f"Extraction failed: {e}"}
+
+
+def _entity_id(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def resolve_entity(details):
+    """
+    The (entity_type, entity_id) an activity's details refer to, ('', None) if none.
+    Stored on UserActivity so the trail of an object is an indexed lookup.
+    """
+    if not isinstance(details, dict):
+        return '', None
+
+    for key, label in ENTITY_KEYS:
+        entity_id = _entity_id(details.get(key))
+        if entity_id is not None:
+            return label, entity_id
+
+    entity_id = _entity_id(details.get('object_id'))
+    if details.get('model') and entity_id is not None:
+        return details['model'], entity_id
+    return '', None
+
+
+def resolve_related_entity(details):
+    """
+    The second (entity_type, entity_id) an activity concerns, ('', None) if none.
+    Stored on UserActivity so that object's trail is an indexed lookup too.
+    """
+    if not isinstance(details, dict):
+        return '', None
+
+    for key, label in RELATED_ENTITY_KEYS:
+        entity_id = _entity_id(details.get(key))
+        if entity_id is not None:
+            return label, entity_id
+    return '', None
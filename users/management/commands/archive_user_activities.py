@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from users.retention import archive_old_activities
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive the user activities older than the retention period to gzip JSONL files "
+        "(one directory per day) then delete them, in chunks. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Retention in days, AUDIT_RETENTION_DAYS by default")
+        parser.add_argument('--chunk-size', type=int, help="Primary keys per chunk, AUDIT_RETENTION_CHUNK_SIZE by default")
+        parser.add_argument('--max-chunks', type=int, help="Stop after this many chunks")
+        parser.add_argument('--max-seconds', type=float, help="Stop starting new chunks after this many seconds")
+
+    def handle(self, *args, **options):
+        result = archive_old_activities(
+                days=options['days'],
+                chunk_size=options['chunk_size'],
+                max_chunks=options['max_chunks'],
+                max_seconds=options['max_seconds'],
+        )
+
+        self.stdout.write(
+                f"{result['archived']} activities archived to {result['files']} files, "
+                f"{result['deleted']} deleted ({result['chunks']} chunks)."
+        )
+        if result['complete']:
+            self.stdout.write(self.style.SUCCESS("No activity older than the retention period remains."))
+        else:
+            self.stdout.write(self.style.WARNING("Stopped by a limit, run again to continue."))
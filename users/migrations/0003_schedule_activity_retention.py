@@ -0,0 +1,39 @@
+from datetime import datetime, time, timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+SCHEDULE_NAME = 'audit-retention'
+
+
+def create_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+
+    # Nightly, starting at 02:30 local time
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    Schedule.objects.update_or_create(
+            name=SCHEDULE_NAME,
+            defaults={
+                'func': 'users.retention.run_activity_retention',
+                'schedule_type': 'D',
+                'repeats': -1,
+                'next_run': timezone.make_aware(datetime.combine(tomorrow, time(2, 30))),
+            },
+    )
+
+
+def delete_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.filter(name=SCHEDULE_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_useractivity_timestamp'),
+        ('django_q', '0018_task_success_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_schedule, delete_schedule),
+    ]
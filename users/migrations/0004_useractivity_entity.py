@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+BACKFILL_CHUNK_SIZE = 2000
+
+# Frozen copy of users.audit_details.resolve_entity as of this migration: later
+# changes to the live rules must not change what this backfill did
+ENTITY_KEYS = (
+    ('transfer_id', 'transfers.Transfer'),
+    ('stock_id', 'stock.Stock'),
+    ('config_id', 'transfers.CommissionConfig'),
+    ('commission_config_id', 'transfers.CommissionConfig'),
+    ('rate_id', 'stock.ExchangeRate'),
+)
+
+
+def _entity_id(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def resolve_entity(details):
+    if not isinstance(details, dict):
+        return '', None
+
+    for key, label in ENTITY_KEYS:
+        entity_id = _entity_id(details.get(key))
+        if entity_id is not None:
+            return label, entity_id
+
+    entity_id = _entity_id(details.get('object_id'))
+    if details.get('model') and entity_id is not None:
+        return details['model'], entity_id
+    return '', None
+
+
+def fill_entities(apps, schema_editor):
+    UserActivity = apps.get_model('users', 'UserActivity')
+
+    # Keyset over the primary key: bounded memory whatever the table size
+    last_id = 0
+    while True:
+        rows = list(UserActivity.objects.filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .values_list('pk', 'details')[:BACKFILL_CHUNK_SIZE])
+        if not rows:
+            break
+
+        activities = []
+        for pk, details in rows:
+            entity_type, entity_id = resolve_entity(details)
+            if entity_type:
+                activities.append(UserActivity(pk=pk, entity_type=entity_type, entity_id=entity_id))
+        UserActivity.objects.bulk_update(activities, ['entity_type', 'entity_id'])
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_schedule_activity_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useractivity',
+            name='entity_id',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='useractivity',
+            name='entity_type',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['entity_type', 'entity_id', '-timestamp'], name='users_usera_entity__974650_idx'),
+        ),
+        migrations.RunPython(fill_entities, migrations.RunPython.noop),
+    ]
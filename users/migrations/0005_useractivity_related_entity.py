@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+BACKFILL_CHUNK_SIZE = 2000
+
+# Frozen copy of users.audit_details.resolve_related_entity as of this migration
+RELATED_ENTITY_KEYS = (
+    ('destination_stock_id', 'stock.Stock'),
+)
+
+
+def _entity_id(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def resolve_related_entity(details):
+    if not isinstance(details, dict):
+        return '', None
+
+    for key, label in RELATED_ENTITY_KEYS:
+        entity_id = _entity_id(details.get(key))
+        if entity_id is not None:
+            return label, entity_id
+    return '', None
+
+
+def fill_related_entities(apps, schema_editor):
+    UserActivity = apps.get_model('users', 'UserActivity')
+
+    # Keyset over the primary key: bounded memory whatever the table size
+    last_id = 0
+    while True:
+        rows = list(UserActivity.objects.filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .values_list('pk', 'details')[:BACKFILL_CHUNK_SIZE])
+        if not rows:
+            break
+
+        activities = []
+        for pk, details in rows:
+            entity_type, entity_id = resolve_related_entity(details)
+            if entity_type:
+                activities.append(UserActivity(pk=pk, related_entity_type=entity_type, related_entity_id=entity_id))
+        UserActivity.objects.bulk_update(activities, ['related_entity_type', 'related_entity_id'])
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_useractivity_entity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useractivity',
+            name='related_entity_id',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='useractivity',
+            name='related_entity_type',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['related_entity_type', 'related_entity_id', '-timestamp'], name='users_usera_related_5be9c8_idx'),
+        ),
+        migrations.RunPython(fill_related_entities, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,9 @@ from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .audit import record_activity
+from .audit_details import resolve_entity, resolve_related_entity
+
 logger = logging.getLogger(__name__)
 
 
@@ -89,6 +92,29 @@ class User(AbstractUser):
         return f"{self.username} ({self.get_user_type_display()})"
 
 
+AUDIT_TRAIL_SIZE = 20
+
+
+class UserActivityManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create does not call save(): fill the entity columns here too
+        objs = list(objs)
+        for activity in objs:
+            activity.set_entity()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def for_entity(self, instance, limit=AUDIT_TRAIL_SIZE):
+        """
+        Latest activities about a model instance, newest first (one query, each side
+        of the OR on its own entity index): the activities filed under it and the
+        ones that concern it as their related entity.
+        """
+        label = instance._meta.label
+        condition = (models.Q(entity_type=label, entity_id=instance.pk)
+                     | models.Q(related_entity_type=label, related_entity_id=instance.pk))
+        return self.filter(condition).select_related('user').order_by('-timestamp')[:limit]
+
+
 class UserActivity(models.Model):
     """
     Track user activities for audit purposes
@@ -97,17 +123,38 @@ class UserActivity(models.Model):
     action = models.CharField(max_length=100)
     details = models.JSONField(default=dict, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the activity is logged: audit.py may write it a little later
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Object the activity is about, from its details (see audit_details.resolve_entity)
+    entity_type = models.CharField(max_length=100, blank=True, editable=False)
+    entity_id = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    # Second object it concerns (see audit_details.resolve_related_entity)
+    related_entity_type = models.CharField(max_length=100, blank=True, editable=False)
+    related_entity_id = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+
+    objects = UserActivityManager()
 
     class Meta:
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['user', '-timestamp']),
             models.Index(fields=['action', '-timestamp']),
+            models.Index(fields=['entity_type', 'entity_id', '-timestamp']),
+            models.Index(fields=['related_entity_type', 'related_entity_id', '-timestamp']),
         ]
         verbose_name = _("User Activity")
         verbose_name_plural = _("User Activities")
 
+    def set_entity(self):
+        if not self.entity_type:
+            self.entity_type, self.entity_id = resolve_entity(self.details)
+        if not self.related_entity_type:
+            self.related_entity_type, self.related_entity_id = resolve_related_entity(self.details)
+
+    def save(self, *args, **kwargs):
+        self.set_entity()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.username} - {self.action} at {self.timestamp}"
 
@@ -124,7 +171,8 @@ def log_user_activity(user, action: str, details: Optional[Dict[str, Any]] = Non
         if request:
             activity_data['ip_address'] = request.META.get('REMOTE_ADDR')
 
-        activity = UserActivity.objects.create(**activity_data)
+        activity = UserActivity(**activity_data)
+        record_activity(activity)
         logger.debug(f"Logged activity: {user.username} - {action}")
         return activity
 
@@ -148,11 +196,12 @@ def log_user_activity_direct(user, action: str, details: Optional[Dict[str, Any]
         UserActivity: The created activity record, or None if creation failed
     """
     try:
-        activity = UserActivity.objects.create(
+        activity = UserActivity(
                 user=user,
                 action=action,
                 details=details or {}
         )
+        record_activity(activity)
         logger.debug(f"Logged direct activity: {user.username} - {action}")
         return activity
 
@@ -164,6 +213,7 @@ def log_user_activity_direct(user, action: str, details: Optional[Dict[str, Any]
 def cleanup_old_activities(days: int = 60) -> int:
     """
     Clean up old user activities to prevent database bloat.
+    They are archived to compressed files first, in chunks (see retention.py).
 
     Args:
         days (int): Age threshold in days
@@ -172,17 +222,9 @@ def cleanup_old_activities(days: int = 60) -> int:
         int: Number of activities deleted
     """
     try:
-        cutoff_date = timezone.now() - timedelta(days=days)
-
-        # Delete old activities
-        deleted_count, _ = UserActivity.objects.filter(
-                timestamp__lt=cutoff_date
-        ).delete()
-
-        if deleted_count > 0:
-            logger.info(f"Cleaned up {deleted_count} old user activities (older than {days} days)")
+        from .retention import archive_old_activities
 
-        return deleted_count
+        return archive_old_activities(days=days)['deleted']
 
     except Exception as e:
         logger.error(f"Failed to cleanup old activities: {e}", exc_info=True)
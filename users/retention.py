@@ -0,0 +1,150 @@
+"""
+UserActivity retention with compressed archives.
+
+Activities older than AUDIT_RETENTION_DAYS are moved out of the table in chunks of
+AUDIT_RETENTION_CHUNK_SIZE primary keys:
+
+1. The chunk's old rows are streamed to gzip-compressed JSONL files, one per day of
+   activity: AUDIT_ARCHIVE_DIR/YYYY/MM/DD/useractivity-<first id>-<last id>.jsonl.gz.
+   Files are written under a temporary name and renamed once complete.
+2. The archived ids are deleted in a short transaction, so writers are only blocked
+   for one chunk at a time.
+
+The job is resumable: every chunk is independent and deleted only after its files
+exist. A run interrupted between the two steps writes the same files again (same
+rows, same names) and then deletes them; if rows of that window aged past the
+cutoff in between, they land in a second file and some ids appear twice, so
+readers of the archives should key rows by id. Runs can be bounded in time; the
+nightly task re-queues itself while old rows remain.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ('id', 'user_id', 'user__username', 'action', 'details', 'ip_address', 'timestamp',
+                  'entity_type', 'entity_id')
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'AUDIT_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archives' / 'audit'))
+
+
+def _write_archive(path, rows):
+    """Write rows as gzip JSONL, atomically (temporary file then rename)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+
+    with open(temporary, 'wb') as raw:
+        with gzip.open(raw, 'wt', encoding='utf-8') as archive:
+            for row in rows:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+                archive.write('\n')
+        # On disk before the rows are deleted
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    os.replace(temporary, path)
+
+
+def _archive_chunk(rows, archive_dir):
+    """Write one chunk's rows to their day partitions, returns the files written"""
+    by_day = defaultdict(list)
+    for row in rows:
+        row['username'] = row.pop('user__username')
+        by_day[timezone.localdate(row['timestamp'])].append(row)
+
+    paths = []
+    for day, day_rows in sorted(by_day.items()):
+        path = (archive_dir / f'{day:%Y}' / f'{day:%m}' / f'{day:%d}'
+                / f"useractivity-{day_rows[0]['id']}-{day_rows[-1]['id']}.jsonl.gz")
+        _write_archive(path, day_rows)
+        paths.append(path)
+    return paths
+
+
+def archive_old_activities(days=None, chunk_size=None, max_seconds=None, max_chunks=None, archive_dir=None):
+    """
+    Archive then delete the activities older than `days`, chunk by chunk.
+
+    Args:
+        days (int, optional): Retention in days, AUDIT_RETENTION_DAYS by default
+        chunk_size (int, optional): Primary keys per chunk, AUDIT_RETENTION_CHUNK_SIZE by default
+        max_seconds (float, optional): Stop starting new chunks after this long
+        max_chunks (int, optional): Stop after this many chunks
+        archive_dir (Path, optional): AUDIT_ARCHIVE_DIR by default
+
+    Returns:
+        dict: {'archived', 'deleted', 'chunks', 'files', 'complete'}; complete is False
+        when a limit stopped the run before every old row was processed
+    """
+    from .models import UserActivity
+
+    days = days if days is not None else getattr(settings, 'AUDIT_RETENTION_DAYS', 60)
+    chunk_size = chunk_size or getattr(settings, 'AUDIT_RETENTION_CHUNK_SIZE', 1000)
+    archive_dir = Path(archive_dir) if archive_dir else get_archive_dir()
+
+    cutoff = timezone.now() - timedelta(days=days)
+    old = UserActivity.objects.filter(timestamp__lt=cutoff)
+    started = time.monotonic()
+    result = {'archived': 0, 'deleted': 0, 'chunks': 0, 'files': 0, 'complete': False}
+
+    next_id = old.order_by('pk').values_list('pk', flat=True).first()
+    while next_id is not None:
+        if max_chunks is not None and result['chunks'] >= max_chunks:
+            break
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            break
+
+        # Chunks are primary key windows: bounded whatever the id gaps
+        window = old.filter(pk__gte=next_id, pk__lt=next_id + chunk_size)
+        rows = list(window.order_by('pk').values(*ARCHIVE_FIELDS))
+
+        if rows:
+            paths = _archive_chunk(rows, archive_dir)
+            with transaction.atomic():
+                deleted, _ = UserActivity.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+
+            result['archived'] += len(rows)
+            result['deleted'] += deleted
+            result['files'] += len(paths)
+        result['chunks'] += 1
+
+        next_id = old.filter(pk__gte=next_id + chunk_size).order_by('pk').values_list('pk', flat=True).first()
+    else:
+        result['complete'] = True
+
+    if result['archived']:
+        logger.info(f"Audit retention: {result['archived']} activities older than {days} days archived "
+                    f"to {result['files']} files and deleted ({result['chunks']} chunks)")
+    return result
+
+
+def run_activity_retention():
+    """
+    Nightly django-q2 task (scheduled by users migration 0003).
+
+    Runs for at most AUDIT_RETENTION_MAX_SECONDS so it finishes within the cluster
+    timeout, and queues itself again while old activities remain.
+    """
+    result = archive_old_activities(max_seconds=getattr(settings, 'AUDIT_RETENTION_MAX_SECONDS', 60))
+
+    if not result['complete'] and result['chunks']:
+        try:
+            from django_q.tasks import async_task
+            async_task('users.retention.run_activity_retention', task_name='audit-retention-continue')
+        except Exception as e:
+            logger.error(f"Could not queue the rest of the audit retention, it resumes next night: {e}")
+
+    return result
@@ -4,6 +4,7 @@ from typing import Any, Dict, Optional
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
 from django.db import transaction
 from django.urls import reverse
 from django.utils.encoding import force_bytes
@@ -12,16 +13,59 @@ from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from email_service.services import (notify_admin_of_user_action, send_password_setup_email,
                                     send_user_notification_email)
 from .models import UserActivity
-from .utils import format_user_display_name, validate_user_permissions
+from .utils import bump_cache_version, format_user_display_name, get_cache_version, validate_user_permissions
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
+DASHBOARD_VERSION_KEYS = {
+    'users': 'dashboard:users_version',
+    'transfers': 'dashboard:transfers_version',
+    'commissions': 'dashboard:commissions_version',
+}
+DASHBOARD_CACHE_TIMEOUT = 60 * 60  # Safety net, entries are normally replaced by a version bump
+
+# Columns the recent rows of the manager dashboard show
+RECENT_TRANSFER_FIELDS = ('reference_id', 'beneficiary_name', 'amount', 'sent_currency', 'status', 'created_at',
+                          'agent__username', 'agent__first_name', 'agent__last_name')
+RECENT_COMMISSION_FIELDS = ('total_commission', 'created_at', 'transfer__reference_id', 'agent__username')
+
+
+def invalidate_dashboard_cache(*sections: str) -> None:
+    """
+    Bump the version of dashboard sections ('users', 'transfers', 'commissions') once the
+    current transaction commits. Saves and deletes do this through signals; code that
+    writes with update() or bulk_create() must call it itself.
+
+    Args:
+        *sections: Sections to invalidate, all of them if omitted
+    """
+    for section in sections or DASHBOARD_VERSION_KEYS:
+        transaction.on_commit(lambda key=DASHBOARD_VERSION_KEYS[section]: bump_cache_version(key))
+
+
+def _cached_dashboard_section(section: str, scope: str, builder) -> Dict[str, Any]:
+    """Get a dashboard section from the cache, building it if its version changed"""
+    key = f"dashboard:{section}:{scope}:{get_cache_version(DASHBOARD_VERSION_KEYS[section])}"
+    data = cache.get(key)
+    if data is None:
+        data = builder()
+        cache.set(key, data, DASHBOARD_CACHE_TIMEOUT)
+    return data
+
+
 def get_manager_dashboard_data(user: User) -> Dict[str, Any]:
     """
     Get dashboard data for managers and superusers.
 
+    Counters come from one conditional aggregate per table and are cached per section
+    (users, transfers, commissions) under version keys bumped when those models change.
+    Only aggregates are cached: the recent rows are read live (five rows on the
+    created_at index), so no User row lands in the shared cache and renamed agents
+    show up at once. A warm dashboard queries those rows, the recent activities and
+    the stocks.
+
     Args:
         user: The requesting user
 
@@ -34,6 +78,8 @@ def get_manager_dashboard_data(user: User) -> Dict[str, Any]:
     if not (user.is_superuser or user.is_manager()):
         raise PermissionError("Access denied to manager dashboard")
 
+    from django.db.models import Count, Q, Sum
+
     # Import here to avoid circular imports
     try:
         from transfers.models import Transfer, CommissionDistribution
@@ -44,36 +90,33 @@ def get_manager_dashboard_data(user: User) -> Dict[str, Any]:
         Stock = None
 
     # User stats based on permissions
-    if user.is_superuser:
-        total_agents = User.objects.filter(user_type='agent', is_active_user=True).count()
-        total_managers = User.objects.filter(user_type='manager', is_active_user=True).count()
-        recent_activities = UserActivity.objects.select_related('user').order_by('-timestamp')[:10]
-    else:
-        total_agents = User.objects.filter(
-                user_type='agent', is_active_user=True, is_superuser=False
-        ).count()
-        total_managers = User.objects.filter(
-                user_type='manager', is_active_user=True, is_superuser=False
-        ).count()
-        recent_activities = UserActivity.objects.filter(
-                user__is_superuser=False
-        ).select_related('user').order_by('-timestamp')[:10]
+    scope = 'superuser' if user.is_superuser else 'manager'
+    users = User.objects.filter(is_active_user=True)
+    activities = UserActivity.objects.select_related('user').order_by('-timestamp')
+    if not user.is_superuser:
+        users = users.filter(is_superuser=False)
+        activities = activities.filter(user__is_superuser=False)
+
+    user_stats = _cached_dashboard_section('users', scope, lambda: users.aggregate(
+            total_agents=Count('id', filter=Q(user_type='agent')),
+            total_managers=Count('id', filter=Q(user_type='manager'))
+    ))
 
     context: Dict[str, Any] = {
-        'total_agents': total_agents,
-        'total_managers': total_managers,
-        'recent_activities': recent_activities,
+        **user_stats,
+        'recent_activities': activities[:10],
         'name': format_user_display_name(user)
     }
 
     # Transfer data
     if Transfer:
-        context.update({
-            'pending_transfers': Transfer.objects.filter(status='PENDING').count(),
-            'validated_transfers': Transfer.objects.filter(status='VALIDATED').count(),
-            'completed_transfers': Transfer.objects.filter(status='COMPLETED').count(),
-            'recent_transfers': Transfer.objects.select_related('agent').order_by('-created_at')[:5],
-        })
+        context.update(_cached_dashboard_section('transfers', 'all', lambda: Transfer.objects.aggregate(
+                pending_transfers=Count('id', filter=Q(status='PENDING')),
+                validated_transfers=Count('id', filter=Q(status='VALIDATED')),
+                completed_transfers=Count('id', filter=Q(status='COMPLETED'))
+        )))
+        context['recent_transfers'] = (Transfer.objects.select_related('agent')
+                                       .only(*RECENT_TRANSFER_FIELDS).order_by('-created_at')[:5])
 
     # Stock data
     if Stock:
@@ -81,20 +124,14 @@ def get_manager_dashboard_data(user: User) -> Dict[str, Any]:
 
     # Commission data
     if CommissionDistribution:
-        from django.db.models import Sum
-        total_commissions = CommissionDistribution.objects.aggregate(
-                total_paid=Sum('total_commission'),
-                total_to_agents=Sum('declaring_agent_amount'),
-                total_to_managers=Sum('manager_amount')
-        )
-        recent_commissions = CommissionDistribution.objects.select_related(
-                'transfer', 'agent', 'config_used'
-        ).order_by('-created_at')[:5]
-
-        context.update({
-            'total_commissions': total_commissions,
-            'recent_commissions': recent_commissions,
-        })
+        context['total_commissions'] = _cached_dashboard_section(
+                'commissions', 'all', lambda: CommissionDistribution.objects.aggregate(
+                        total_paid=Sum('total_commission'),
+                        total_to_agents=Sum('declaring_agent_amount'),
+                        total_to_managers=Sum('manager_amount')
+                ))
+        context['recent_commissions'] = (CommissionDistribution.objects.select_related('transfer', 'agent')
+                                         .only(*RECENT_COMMISSION_FIELDS).order_by('-created_at')[:5])
 
     return context
 
@@ -1,193 +1,163 @@
 import logging
-import threading
+from contextvars import ContextVar
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.contrib.auth import get_user_model
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from .audit import audit_batch, close_batch, open_batch, record_activity, write_activities
+from .audit_details import extract_model_details, is_audited
+
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
-# Thread-local storage for the current user and request context
-_thread_locals = threading.local()
+# Current user and request for the signal handlers. Context variables rather than
+# thread locals: under ASGI several requests run in one thread, and asgiref carries
+# the context across sync_to_async/async_to_sync thread hops. A new thread starts
+# with an empty context, like it started with empty thread locals.
+_current_user = ContextVar('audit_current_user', default=None)
+_current_request = ContextVar('audit_current_request', default=None)
 
 
 def set_current_user(user):
     """Set current-user for signal handlers - used in tests or special cases"""
-    _thread_locals.user = user
+    _current_user.set(user)
 
 
 def get_current_user():
-    """Get current-user from thread local storage"""
-    return getattr(_thread_locals, 'user', None)
+    """Get current-user from the current context"""
+    return _current_user.get()
 
 
 def get_current_request():
-    """Get current-request from thread local storage"""
-    return getattr(_thread_locals, 'request', None)
+    """Get current-request from the current context"""
+    return _current_request.get()
 
 
 class ActivityLoggingMiddleware:
     """
     Middleware to capture current-user and request for audit logging.
     Helpful for financial compliance - we need to know who did what.
+    Works in both sync (WSGI) and async (ASGI) middleware chains.
     """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Store current user and request in thread locals for signal access
-        try:
-            if hasattr(request, 'user') and request.user.is_authenticated:
-                _thread_locals.user = request.user
-                _thread_locals.request = request
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # The request's audit records are written together when it ends (see audit.py)
+        with audit_batch():
+            tokens = self._set_context(request, request.user if hasattr(request, 'user') else None)
+            try:
+                return self.get_response(request)
+            finally:
+                self._reset_context(tokens)
 
-            response = self.get_response(request)
+    async def __acall__(self, request):
+        batch = open_batch()
+        try:
+            # request.user would query the session synchronously: resolve it the async way
+            try:
+                user = await request.auser() if hasattr(request, 'auser') else None
+            except Exception as e:
+                logger.error(f"ActivityLoggingMiddleware error: {e}", exc_info=True)
+                user = None
+            tokens = self._set_context(request, user)
+            try:
+                return await self.get_response(request)
+            finally:
+                self._reset_context(tokens)
+        finally:
+            records = close_batch(batch)
+            if records:
+                await sync_to_async(write_activities)(records)
 
+    def _set_context(self, request, user):
+        """Store current user and request for signal access, returns the tokens to reset them"""
+        try:
+            if user is not None and user.is_authenticated:
+                return _current_user.set(user), _current_request.set(request)
         except Exception as e:
             # Log middleware errors but don't break the request
             logger.error(f"ActivityLoggingMiddleware error: {e}", exc_info=True)
-            # Still process the request even if logging setup fails
-            response = self.get_response(request)
-
-        finally:
-            # ALWAYS clean up thread locals to prevent memory leaks
-            if hasattr(_thread_locals, 'user'):
-                delattr(_thread_locals, 'user')
-            if hasattr(_thread_locals, 'request'):
-                delattr(_thread_locals, 'request')
+        return None
 
-        return response
+    def _reset_context(self, tokens):
+        # ALWAYS restore the previous values, nothing leaks into the next request
+        if tokens:
+            _current_user.reset(tokens[0])
+            _current_request.reset(tokens[1])
 
 
-def safe_log_activity(action, details=None):
+def build_activity(action, details=None):
     """
-    Safe logging that won't break main operations if audit logging fails.
-    In a financial app, the business operation must succeed even if logging fails.
+    Build (without saving) the audit record safe_log_activity would write.
+    Returns None when there is no user context. Used by bulk paths that
+    write many audit rows with a single bulk_create.
     """
-    try:
-        current_user = get_current_user()
-        if not current_user:
-            # No user context - likely a system operation, migration, or test
-            return
-
-        # Import here to avoid circular imports and potential infinite loops
-        from .models import UserActivity
+    current_user = get_current_user()
+    if not current_user:
+        # No user context - likely a system operation, migration, or test
+        return None
 
-        activity_data = {
-            'user': current_user,
-            'action': action,
-            'details': details or {},
-        }
+    # Import here to avoid circular imports and potential infinite loops
+    from .models import UserActivity
 
-        # Add an IP address if we have request context
-        request = get_current_request()
-        if request:
-            activity_data['ip_address'] = request.META.get('REMOTE_ADDR')
+    activity_data = {
+        'user': current_user,
+        'action': action,
+        'details': details or {},
+    }
 
-        UserActivity.objects.create(**activity_data)
+    # Add an IP address if we have request context
+    request = get_current_request()
+    if request:
+        activity_data['ip_address'] = request.META.get('REMOTE_ADDR')
 
-    except Exception as e:
-        # NEVER let logging failures break business operations
-        # But DO log the failure so we know our audit trail has gaps
-        logger.error(f"Audit logging failed for action '{action}': {e}", exc_info=True)
+    return UserActivity(**activity_data)
 
 
-def extract_model_details(instance):
+def build_model_save_activity(instance, created):
     """
-    Extract meaningful details from model instances for audit logging.
-    Returns a dict with relevant information for each model type.
+    Build (without saving) the audit record log_model_saves writes for a model save.
+    Lets bulk_create/update() paths keep the same audit trail as per-row saves.
     """
-    details = {
-        'model': instance._meta.label,
-        'object_id': getattr(instance, 'id', None),
-    }
+    if not is_audited(instance._meta.label):
+        return None
+
+    model_name = instance._meta.label.lower().replace('.', '_')
+    action = f'{model_name}_{"created" if created else "updated"}'
+
+    # Extract relevant details based on model type
+    details = extract_model_details(instance)
+    details['created'] = created
 
+    return build_activity(action, details)
+
+
+def safe_log_activity(action, details=None):
+    """
+    Safe logging that won't break main operations if audit logging fails.
+    In a financial app, the business operation must succeed even if logging fails.
+    """
     try:
-        # User model details
-        if hasattr(instance, 'username'):
-            details.update({
-                'username': instance.username,
-                'user_type': getattr(instance, 'user_type', 'unknown'),
-                'name': f'{getattr(instance, "first_name", "")} {getattr(instance, "last_name", "")}'.strip() or instance.username,
-                'email': getattr(instance, 'email', ''),
-                'is_active': getattr(instance, 'is_active_user', None)
-            })
-
-        # Transfer model details - critical for financial audit
-        elif hasattr(instance, 'beneficiary_name'):
-            details.update({
-                'beneficiary_name': instance.beneficiary_name,
-                'amount': str(getattr(instance, 'amount', 0)),
-                'currency': getattr(instance, 'sent_currency', 'unknown'),
-                'status': getattr(instance, 'status', 'unknown'),
-                'agent_username': getattr(instance.agent, 'username', 'No agent') if hasattr(instance,
-                                                                                             'agent') and instance.agent else 'No agent',
-                'reference': getattr(instance, 'reference', '')
-            })
-
-        # Stock model details - important for cash management
-        elif hasattr(instance, 'currency') and hasattr(instance, 'location'):
-            details.update({
-                'currency': instance.currency,
-                'location': instance.location,
-                'amount': str(getattr(instance, 'amount', 0)),
-                'name': getattr(instance, 'name', 'Unnamed stock')
-            })
-
-        # Stock movement details - cash flow tracking
-        elif hasattr(instance, 'type') and hasattr(instance, 'stock'):
-            details.update({
-                'movement_type': instance.type,
-                'amount': str(getattr(instance, 'amount', 0)),
-                'stock_currency': getattr(instance.stock, 'currency', 'unknown'),
-                'stock_location': getattr(instance.stock, 'location', 'unknown'),
-                'reason': getattr(instance, 'reason', 'No reason provided')
-            })
-
-        # Exchange rate details - affects all calculations
-        elif hasattr(instance, 'from_currency') and hasattr(instance, 'to_currency'):
-            details.update({
-                'from_currency': instance.from_currency,
-                'to_currency': instance.to_currency,
-                'rate': str(getattr(instance, 'rate', 0)),
-                'active': getattr(instance, 'active', None)
-            })
-
-        # Commission configuration - affects profit calculations
-        elif hasattr(instance, 'commission_amount'):
-            details.update({
-                'currency': getattr(instance, 'currency', 'unknown'),
-                'commission_amount': str(instance.commission_amount),
-                'agent_share': str(getattr(instance, 'agent_share', 0)),
-                'manager_share': str(getattr(instance, 'manager_share', 0)),
-                'active': getattr(instance, 'active', None)
-            })
-
-        # Commission distribution - actual payments made
-        elif hasattr(instance, 'total_commission'):
-            details.update({
-                'transfer_id': getattr(instance.transfer, 'id', None) if hasattr(instance,
-                                                                                 'transfer') and instance.transfer else None,
-                'total_commission': str(instance.total_commission),
-                'agent_amount': str(getattr(instance, 'declaring_agent_amount', 0)),
-                'manager_amount': str(getattr(instance, 'manager_amount', 0)),
-                'agent_username': getattr(instance.agent, 'username', 'unknown') if hasattr(instance,
-                                                                                            'agent') and instance.agent else 'unknown'
-            })
-
-    except AttributeError as e:
-        # Specific handling for missing attributes
-        logger.warning(f"Missing attribute while extracting details for {instance._meta.label}: {e}")
-        details['extraction_error'] = f"Missing attribute: {e}"
+        activity = build_activity(action, details)
+        if activity:
+            # Buffered, written in bulk with the rest of the request (see audit.py)
+            record_activity(activity)
 
     except Exception as e:
-        # Log any other errors in detail extraction
-        logger.error(f"Unexpected error extracting details for {instance._meta.label}: {e}", exc_info=True)
-        details['extraction_error'] = f"Extraction failed: {e}"
-
-    return details
+        # NEVER let logging failures break business operations
+        # But DO log the failure so we know our audit trail has gaps
+        logger.error(f"Audit logging failed for action '{action}': {e}", exc_info=True)
 
 
 @receiver(post_save)
@@ -196,8 +166,8 @@ def log_model_saves(sender, instance, created, **kwargs):
     Automatically log all model saves for financial audit compliance.
     Every change to data needs to be tracked with user attribution.
     """
-    # Skip UserActivity to prevent infinite loops
-    if sender._meta.label == 'users.UserActivity':
+    # Skip UserActivity (infinite loops), framework and derived tables (see audit_details.py)
+    if not is_audited(sender._meta.label):
         return
 
     # Skip if no current user (migrations, system operations, tests)
@@ -205,10 +175,6 @@ def log_model_saves(sender, instance, created, **kwargs):
     if not current_user:
         return
 
-    # Skip Django's built-in models that don't need business audit
-    if sender._meta.label in ['sessions.Session', 'admin.LogEntry', 'contenttypes.ContentType']:
-        return
-
     try:
         model_name = sender._meta.label.lower().replace('.', '_')
         action = f'{model_name}_{"created" if created else "updated"}'
@@ -240,8 +206,8 @@ def log_model_deletes(sender, instance, **kwargs):
     Automatically log all model deletions for financial audit compliance.
     Deletions are critical to track in financial systems.
     """
-    # Skip UserActivity to prevent issues
-    if sender._meta.label == 'users.UserActivity':
+    # Skip UserActivity, framework and derived tables
+    if not is_audited(sender._meta.label):
         return
 
     # Skip if no current user
@@ -249,30 +215,36 @@ def log_model_deletes(sender, instance, **kwargs):
     if not current_user:
         return
 
-    # Skip Django's built-in models
-    if sender._meta.label in ['sessions.Session', 'admin.LogEntry', 'contenttypes.ContentType']:
-        return
-
     try:
         model_name = sender._meta.label.lower().replace('.', '_')
         action = f'{model_name}_deleted'
 
-        # Extract details about what was deleted
+        # Extract details about what was deleted (its identifying columns are in the registry)
         details = extract_model_details(instance)
         details['deleted_object_id'] = getattr(instance, 'id', None)
 
-        # Add specific identifying information about deleted object
-        if hasattr(instance, 'username'):
-            details['deleted_username'] = instance.username
-        elif hasattr(instance, 'beneficiary_name'):
-            details['deleted_beneficiary'] = instance.beneficiary_name
-        elif hasattr(instance, 'currency'):
-            details['deleted_currency'] = instance.currency
-        elif hasattr(instance, 'reference'):
-            details['deleted_reference'] = getattr(instance, 'reference', '')
-
         safe_log_activity(action, details)
 
     except Exception as e:
         # Log the error but don't break the delete operation
         logger.error(f"Error in post_delete signal for {sender._meta.label}: {e}", exc_info=True)
+
+
+DASHBOARD_SECTION_SENDERS = {
+    'users.User': 'users',
+    'transfers.Transfer': 'transfers',
+    'transfers.CommissionDistribution': 'commissions',
+}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender='transfers.Transfer')
+@receiver(post_delete, sender='transfers.Transfer')
+@receiver(post_save, sender='transfers.CommissionDistribution')
+@receiver(post_delete, sender='transfers.CommissionDistribution')
+def invalidate_dashboard_on_change(sender, instance, **kwargs):
+    """Refresh the cached manager dashboard section of the changed model"""
+    from .services import invalidate_dashboard_cache
+
+    invalidate_dashboard_cache(DASHBOARD_SECTION_SENDERS[sender._meta.label])
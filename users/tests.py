@@ -1,3 +1,141 @@
-from django.test import TestCase
+import pickle
+import queue
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import OperationalError, transaction
+from django.test import TestCase, override_settings
+
+from . import audit
+from .models import User, UserActivity, log_user_activity_direct
+from .services import get_manager_dashboard_data
+
+
+@override_settings(AUDIT_BACKGROUND_WRITES=True, AUDIT_RETRY_DELAY=0)
+class AuditWriterTest(TestCase):
+    """Buffered audit writes (users/audit.py): no record may be lost"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        # A private queue and no background thread: the tests decide when records are written
+        self.queue = queue.Queue(maxsize=2)
+        for patcher in (
+                mock.patch.object(audit, '_queue', self.queue),
+                mock.patch.object(audit, '_writer', None),
+                mock.patch.object(audit, '_stopping', threading.Event()),
+                mock.patch.object(audit, '_retries', audit.deque()),
+                mock.patch.object(audit, '_start_writer'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _log(self, action):
+        # TestCase runs inside a transaction: records are buffered by its on_commit callbacks
+        with self.captureOnCommitCallbacks(execute=True):
+            return log_user_activity_direct(self.user, action)
+
+    def test_rollback_leaves_no_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    log_user_activity_direct(self.user, 'rolled_back')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+            with transaction.atomic():
+                log_user_activity_direct(self.user, 'committed')
+
+        audit.drain_queue()
+        self.assertEqual(list(UserActivity.objects.values_list('action', flat=True)), ['committed'])
+
+    def test_full_queue_makes_caller_write_its_record(self):
+        self._log('queued 1')
+        self._log('queued 2')
+        self.assertFalse(UserActivity.objects.exists())
+
+        self._log('overflow')
+
+        self.assertEqual(list(UserActivity.objects.values_list('action', flat=True)), ['overflow'])
+        self.assertEqual(self.queue.qsize(), 2)
+
+    def test_shutdown_drains_the_queue(self):
+        self._log('queued 1')
+        self._log('queued 2')
+
+        audit.shutdown()
+
+        self.assertEqual(UserActivity.objects.count(), 2)
+        self.assertTrue(self.queue.empty())
+
+    def test_failed_write_is_retried_not_lost(self):
+        locked = OperationalError('database is locked')
+        save = UserActivity.save
+        attempts = []
+
+        def flaky_save(activity, *args, **kwargs):
+            attempts.append(activity.action)
+            if len(attempts) <= 2:
+                raise locked
+            return save(activity, *args, **kwargs)
+
+        with mock.patch.object(UserActivity.objects, 'bulk_create', side_effect=locked), \
+                mock.patch.object(UserActivity, 'save', flaky_save):
+            self.assertEqual(audit.write_activities([UserActivity(user=self.user, action='locked')]), 0)
+            self.assertEqual(len(audit._retries), 1)
+
+            self.assertEqual(audit.drain_queue(), 1)
+
+        self.assertEqual(attempts, ['locked'] * 3)
+        self.assertEqual(list(UserActivity.objects.values_list('action', flat=True)), ['locked'])
+        self.assertFalse(audit._retries)
+
+    @override_settings(AUDIT_WRITE_RETRIES=2)
+    def test_retries_are_bounded(self):
+        with mock.patch.object(UserActivity.objects, 'bulk_create', side_effect=OperationalError('locked')), \
+                mock.patch.object(UserActivity, 'save', side_effect=OperationalError('locked')) as save:
+            audit.write_activities([UserActivity(user=self.user, action='never')])
+            audit.drain_queue()
+
+        self.assertEqual(save.call_count, 3)
+        self.assertFalse(audit._retries)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ManagerDashboardCacheTest(TestCase):
+    """Cached dashboard sections hold aggregates only, the recent rows are read live"""
+
+    def setUp(self):
+        from transfers.models import Transfer
+
+        cache.clear()
+        self.manager = User.objects.create(username='manager', email='manager@example.com', user_type='manager')
+        self.agent = User.objects.create(username='agent', email='agent@example.com', user_type='agent',
+                                         first_name='Jean', last_name='Ndayi')
+        Transfer.objects.create(beneficiary_name='Beneficiary', beneficiary_phone='+25700000000', method='CASH',
+                                amount='100.00', sent_currency='EUR', received_currency='BIF', agent=self.agent,
+                                status='PENDING')
+
+    def _dashboard(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return get_manager_dashboard_data(self.manager)
+
+    def test_only_aggregates_are_cached(self):
+        self._dashboard()
+
+        for section in ('transfers', 'commissions'):
+            cached = [pickle.loads(value) for key, value in cache._cache.items() if f':dashboard:{section}:' in key]
+            self.assertEqual(len(cached), 1)
+            self.assertTrue(all(value is None or isinstance(value, (int, Decimal)) for value in cached[0].values()),
+                            cached[0])
+
+    def test_renamed_agent_shows_on_a_warm_dashboard(self):
+        self.assertEqual(self._dashboard()['pending_transfers'], 1)
+
+        self.agent.first_name = 'Jeanne'
+        self.agent.save()
+
+        transfer = self._dashboard()['recent_transfers'][0]
+        self.assertEqual(transfer.agent.format_user_display_name(), 'Jeanne Ndayi')
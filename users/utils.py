@@ -1,5 +1,7 @@
 import logging
+import uuid
 
+from django.core.cache import cache
 from django.db.models import QuerySet
 
 from .models import User
@@ -110,3 +112,37 @@ def format_user_display_name(user) -> str:
         return user.last_name
     else:
         return user.username
+
+
+def get_cache_version(key: str) -> str:
+    """
+    Get the current version token stored under a cache key.
+    A fresh token is created if the key is missing (first use or cache cleared).
+
+    Args:
+        key (str): Cache key holding the version token
+
+    Returns:
+        str: Current version token
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key: str) -> str:
+    """
+    Replace the version token stored under a cache key.
+    Every process holding data built for the previous token will rebuild it.
+
+    Args:
+        key (str): Cache key holding the version token
+
+    Returns:
+        str: New version token
+    """
+    version = uuid.uuid4().hex
+    cache.set(key, version, timeout=None)
+    return version